@@ -0,0 +1,330 @@
+##########################################
+
+# This python script builds the KH03 overnight and day beds files (downloaded by the two extract_* scripts into
+# rawdata/available-and-occupied-beds/overnight and /day) into the published csvs, in one run:
+# - overnight_day_beds_2000_10_clean.csv from the annual 'NHS Organisations in England' files (2000-01 to 2009-10)
+# - overnight_day_beds_2010_24_clean.csv from the quarterly 'NHS Trust by Sector' files (2010-11 onwards)
+# The day and overnight files of both layouts are read together in a process pool, one file per worker
+# Columns are found from the header text (sector names, grouped under available / occupied / % occupied or in that
+# order) rather than from their position, so added or moved columns do not shift the values
+# Each row gets an integer (organisation, period) key, and the day beds are joined onto the overnight beds with one
+# hash join per layout (a left join, as in the R script, but on the organisation code only, not also on its name)
+# The organisation change adjustment (overnight_day_beds_2000_24_clean.csv) is still done by the R script
+# Usage:
+#   python scripts/available-and-occupied-beds/build_datasets_overnight_day_beds.py [--workers 4]
+
+##########################################
+
+
+### LIBRARIES
+# pip install python-calamine (faster sheet reading, optional)
+import argparse
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # shared modules in scripts/
+import numpy as np
+import pandas as pd
+from excel_backends import read_excel # Excel parsing backends with per-file fallback
+from periods import MISSING_PERIOD, encode_financial_year, encode_period_end # integer period keys
+from instrument import instrumented_run, stage # per-stage run report
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+RAW_DATA_DIR = Path(os.getenv("RAW_DATA_DIR", BASE_DIR / "rawdata" / "available-and-occupied-beds"))
+OUTPUT_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data")) / "available-and-occupied-beds"
+WORKERS = int(os.getenv("BEDS_WORKERS", min(4, os.cpu_count() or 1)))
+KINDS = {'overnight': 'on', 'day': 'day'}  # raw data folder -> column infix
+QUARTERLY_SHEET = 'NHS Trust by Sector'
+HEADER_SEARCH_ROWS = 30
+MEASURES = ['available', 'occupied', 'percent_occupied']  # order of the repeated sector blocks
+# Published column order of the two csvs
+SECTORS_ANNUAL = ['total', 'general_acute', 'mental_illness', 'learn_disabil', 'maternity']
+SECTORS_QUARTERLY = ['total', 'general_acute', 'learn_disabil', 'maternity', 'mental_illness']
+ANNUAL_COLUMNS = {
+    'overnight': ([f'{s}_on_beds_available' for s in SECTORS_ANNUAL]
+                  + [f'{s}_on_beds_occupied' for s in SECTORS_ANNUAL]
+                  + [f'{s}_on_beds_percent_occupied' for s in SECTORS_QUARTERLY]),
+    'day': ['total_day_beds_available'],  # the only day beds column in every annual file
+}
+QUARTERLY_COLUMNS = {kind: [f'{s}_{infix}_beds_{m}' for m in MEASURES for s in SECTORS_QUARTERLY]
+                     for kind, infix in KINDS.items()}
+OUTPUTS = {'annual': 'overnight_day_beds_2000_10_clean.csv', 'quarterly': 'overnight_day_beds_2010_24_clean.csv'}
+TEXT_COLUMNS = ['year', 'period_end', 'org_code', 'org_name', 'quarter']  # quoted in the csvs, as R wrote them
+ORG_CODE_NAMES = {'org_code', 'org_id', 'code', 'organisation_code'}
+ORG_NAME_NAMES = {'org_name', 'name', 'organisation_name'}
+QUARTERS = {'june': 'Q1', 'september': 'Q2', 'december': 'Q3', 'march': 'Q4'}  # financial year quarters
+
+
+### FUNCTIONS
+def file_layout(filename):
+    """'annual' for the 2000-01 to 2009-10 files, 'quarterly' for the later ones, None for other files."""
+    if re.search(r'20(0[0-9])', filename):
+        return 'annual' if 'NHS_Organisations_in_England' in filename else None
+    return 'quarterly'
+
+
+def find_files(raw_dir=RAW_DATA_DIR):
+    """Raw files as a list of (kind, layout, path), kind being the overnight or day folder."""
+    files = []
+    for kind in KINDS:
+        for path in sorted((Path(raw_dir) / kind).rglob('*')):
+            if path.suffix.lower() not in ('.xls', '.xlsx'):
+                continue
+            layout = file_layout(path.name)
+            if layout is not None:
+                files.append((kind, layout, path))
+    return files
+
+
+def clean_name(name):
+    """janitor::make_clean_names for one header cell."""
+    name = str(name).strip().lower().replace('%', ' percent ').replace('&', ' ')
+    return re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+
+
+def sector(header):
+    """Sector of a header cell (total, general_acute, ...), or None for other columns (acute, geriatric, ...)."""
+    name = clean_name(header)
+    if 'general' in name and 'acute' in name:
+        return 'general_acute'
+    if 'learning' in name:
+        return 'learn_disabil'
+    if 'maternity' in name:
+        return 'maternity'
+    if 'mental' in name:
+        return 'mental_illness'
+    if name in ('total', 'available_beds', 'occupied_beds') or 'all_sectors' in name:
+        return 'total'
+    return None
+
+
+def measure(label):
+    """Measure named in a (group and) header label, or None when only the column order tells."""
+    name = clean_name(label)
+    if 'percent' in name or 'occupancy' in name:
+        return 'percent_occupied'
+    if 'occupied' in name:
+        return 'occupied'
+    if 'available' in name:
+        return 'available'
+    return None
+
+
+def find_header_row(raw):
+    """Row with the organisation code and name headers."""
+    for i in range(min(HEADER_SEARCH_ROWS, len(raw))):
+        names = {clean_name(cell) for cell in raw.iloc[i] if pd.notna(cell)}
+        if names & ORG_CODE_NAMES and names & ORG_NAME_NAMES:
+            return i
+    raise ValueError("No header row with organisation code and name")
+
+
+def header_columns(raw, header_row, infix):
+    """
+    Position of each column kept, by name. A sector column takes its measure from its own or its group label
+    (the row above, carried to the right), else from how often the sector has been seen (available, occupied,
+    % occupied), as the blocks always come in that order.
+    """
+    header = raw.iloc[header_row]
+    group = raw.iloc[header_row - 1] if header_row > 0 else pd.Series([None] * len(header), index=header.index)
+    if group.notna().sum() < 2:  # a title or blank line, not a grouped header
+        group = pd.Series([None] * len(header), index=header.index)
+    group = group.ffill()
+    columns, seen = {}, {}
+    for position, (g, h) in enumerate(zip(group, header)):
+        if pd.isna(h):
+            continue
+        name = clean_name(h)
+        if name in ORG_CODE_NAMES:
+            columns.setdefault('org_code', position)
+        elif name in ORG_NAME_NAMES:
+            columns.setdefault('org_name', position)
+        elif name == 'year':
+            columns.setdefault('year', position)
+        elif name in ('period', 'period_end'):
+            columns.setdefault('period_end', position)
+        elif (s := sector(h)) is not None:
+            label = ' '.join(str(part) for part in (g, h) if pd.notna(part))
+            count = seen.get(s, 0)
+            seen[s] = count + 1
+            m = measure(label) or (MEASURES[count] if count < len(MEASURES) else None)
+            if m is not None:
+                columns.setdefault(f'{s}_{infix}_beds_{m}', position)
+    return columns
+
+
+def read_file(kind, layout, path):
+    """Worker: read one raw file into the published columns of its layout, with the (organisation, period) keys."""
+    raw = read_excel(path, sheet_name=QUARTERLY_SHEET if layout == 'quarterly' else 0, header=None)
+    header_row = find_header_row(raw)
+    columns = header_columns(raw, header_row, KINDS[kind])
+    value_cols = (QUARTERLY_COLUMNS if layout == 'quarterly' else ANNUAL_COLUMNS)[kind]
+    keys = ['year', 'period_end'] if layout == 'quarterly' else ['year']
+    missing = [name for name in ['org_code', 'org_name'] + keys if name not in columns]
+    if missing:
+        raise ValueError(f"{path.name}: no {', '.join(missing)} column")
+    kept = [name for name in keys + ['org_code', 'org_name'] + value_cols if name in columns]
+    df = raw.iloc[header_row + 1:, [columns[name] for name in kept]]
+    df.columns = kept
+    df = df[df['org_code'].notna() & df['org_name'].notna()]
+    if layout == 'quarterly':
+        df = df[df['period_end'].notna()]
+    df = df.reindex(columns=keys + ['org_code', 'org_name'] + value_cols).reset_index(drop=True)
+    return finalise(df, layout, value_cols), [name for name in value_cols if name not in columns]
+
+
+def finalise(df, layout, value_cols):
+    """
+    Types, names and the year (and quarter) of the published csv, plus the integer period key:
+    - annual files: the start year of the financial year
+    - quarterly files: the financial year quarter, and the calendar year of the period end (a period end other
+      than the quarter-end months raises a ValueError rather than being taken for Q4)
+    """
+    df = df.copy()
+    df['org_code'] = df['org_code'].astype(str).str.strip()
+    df['org_name'] = df['org_name'].astype(str).str.strip().str.upper()
+    df[value_cols] = df[value_cols].apply(pd.to_numeric, errors='coerce').astype('float64')
+    start_year = pd.to_numeric(df['year'].astype(str).str.extract(r'^(\d{4})', expand=False), errors='coerce')
+    if layout == 'annual':
+        df['year'] = start_year.astype('Int64')
+        df['period'] = encode_financial_year(df['year'])
+    else:
+        df['period_end'] = df['period_end'].astype(str).str.strip().str.title()
+        df['quarter'] = df['period_end'].str.lower().map(QUARTERS)
+        unknown = sorted(df.loc[df['quarter'].isna(), 'period_end'].unique())
+        if unknown:
+            raise ValueError(f"period end {unknown} is not one of {list(QUARTERS)}, cannot tell its quarter")
+        df['year'] = (start_year + (df['quarter'] == 'Q4')).astype('Int64')
+        df['period'] = encode_period_end(df['year'], df['period_end'])
+    # Occupancy of the files without a % occupied block (2000-01), from the counts
+    for available in [col for col in value_cols if col.endswith('_beds_available')]:
+        percent = available.replace('_available', '_percent_occupied')
+        occupied = available.replace('_available', '_occupied')
+        if percent in df and occupied in df and df[percent].isna().all():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                df[percent] = np.where(df[available] > 0, df[occupied] / df[available], np.nan)
+    return df
+
+
+def org_period_keys(org_codes, periods, codes):
+    """One int64 key per row: the organisation's index in codes in the high 32 bits, the period in the low ones."""
+    org_index = codes.get_indexer(org_codes).astype(np.int64)
+    return (org_index << 32) | (np.asarray(periods, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def join_day_beds(overnight, day, day_cols):
+    """
+    Left join of the day beds onto the overnight beds on the (organisation, period) key: one hash join on a
+    single int64 column. Rows without a period are left without day beds.
+    """
+    codes = pd.Index(pd.unique(pd.concat([overnight['org_code'], day['org_code']], ignore_index=True)))
+    on_key = org_period_keys(overnight['org_code'], overnight['period'], codes)
+    day_key = org_period_keys(day['org_code'], day['period'], codes)
+    day = pd.DataFrame(day[day_cols].to_numpy(), columns=day_cols, index=day_key)
+    day = day[(day_key & 0xFFFFFFFF) != (MISSING_PERIOD & 0xFFFFFFFF)]
+    duplicated = day.index.duplicated(keep='first')
+    if duplicated.any():
+        print(f"Dropped {duplicated.sum()} duplicate day beds rows (same organisation and period)")
+        day = day[~duplicated]
+    joined = day.reindex(on_key)  # the hash join: one lookup per overnight row
+    return pd.concat([overnight.reset_index(drop=True), joined.reset_index(drop=True).astype('float64')], axis=1)
+
+
+def combine(frames, layout):
+    """The published table of one layout from its overnight and day frames."""
+    overnight = pd.concat(frames.get('overnight', []), ignore_index=True) if frames.get('overnight') else None
+    if overnight is None:
+        raise ValueError(f"No overnight beds files of the {layout} layout")
+    columns = QUARTERLY_COLUMNS if layout == 'quarterly' else ANNUAL_COLUMNS
+    day = pd.concat(frames['day'], ignore_index=True) if frames.get('day') \
+        else pd.DataFrame(columns=['org_code', 'period'] + columns['day'])
+    df = join_day_beds(overnight, day, columns['day'])
+    if layout == 'quarterly':
+        order = ['year', 'period_end', 'org_code', 'org_name'] + columns['overnight'] + ['quarter'] + columns['day']
+        sort = ['org_code', 'year', 'quarter']
+    else:
+        order = ['year', 'org_code', 'org_name'] + columns['overnight'] + columns['day']
+        sort = ['org_code', 'year']
+    return df.sort_values(sort, kind='stable')[order].reset_index(drop=True)
+
+
+def write_published_csv(df, path):
+    """
+    Write a published csv in the format write.csv gave it (so a rebuild only changes the rows that changed): header
+    and text columns quoted, numbers with up to 15 significant digits (175, not 175.0), NA unquoted.
+    """
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if col in TEXT_COLUMNS or not pd.api.types.is_numeric_dtype(values):
+            text = '"' + values.astype(str).str.replace('"', '""', regex=False) + '"'
+        else:
+            text = pd.Series([f'{v:.15g}' for v in values.to_numpy(dtype=np.float64)], index=df.index)
+        columns.append(text.where(values.notna(), 'NA'))
+    header = ','.join(f'"{col}"' for col in df.columns)
+    lines = columns[0].str.cat(columns[1:], sep=',') if len(df) else pd.Series([], dtype=object)
+    with open(path, 'w', newline='') as f:
+        f.write('\n'.join([header, *lines]) + '\n')
+
+
+def build(raw_dir=RAW_DATA_DIR, output_dir=OUTPUT_DIR, workers=WORKERS):
+    """Read every day and overnight file in a process pool, join them per layout and write the two csvs."""
+    files = find_files(raw_dir)
+    print(f"{len(files)} files: " + ', '.join(f"{sum(f[0] == kind for f in files)} {kind}" for kind in KINDS))
+    frames, failed = {'annual': {}, 'quarterly': {}}, []
+    with stage('read_files', files=len(files), workers=workers) as s:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(files)))) as pool:
+            futures = {pool.submit(read_file, *f): f for f in files}
+            for future in as_completed(futures):
+                kind, layout, path = futures[future]
+                try:
+                    df, missing = future.result()
+                except Exception as e:
+                    failed.append(f"{path.name}: {type(e).__name__}: {e}")
+                    print(f"Failed {path.name}: {e}")
+                    continue
+                frames[layout].setdefault(kind, []).append(df)
+                print(f"Read {kind} {path.name}: {len(df)} organisations"
+                      + (f" (no {', '.join(missing)} columns)" if missing else ""))
+        s['failed'] = len(failed)
+    if failed:
+        raise RuntimeError(f"{len(failed)} files failed: " + "; ".join(failed))
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    written = {}
+    for layout, filename in OUTPUTS.items():
+        if not frames[layout]:
+            print(f"No {layout} files, {filename} not written")
+            continue
+        with stage(f'join_{layout}') as s:
+            df = combine(frames[layout], layout)
+            s['rows_out'] = len(df)
+        tmp_path = output_dir / f'{filename}.tmp'
+        write_published_csv(df, tmp_path)
+        os.replace(tmp_path, output_dir / filename)
+        written[layout] = df
+        print(f"Wrote {filename}: {len(df)} rows")
+    return written
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the KH03 overnight and day beds files into the published csvs")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="files read in parallel")
+    parser.add_argument('--raw-dir', type=Path, default=RAW_DATA_DIR)
+    parser.add_argument('--output-dir', type=Path, default=OUTPUT_DIR)
+    with instrumented_run('available-and-occupied-beds'):  # takes --profile off the command line first
+        args = parser.parse_args(argv)
+        build(args.raw_dir, args.output_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,12 +9,13 @@
 
 # pip install selenium
 import os
-import time
 from urllib.parse import urljoin
 from urllib.request import urlopen, Request, URLError
 from bs4 import BeautifulSoup
-import requests
 from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # shared modules in scripts/
+from download_metrics import DownloadMetrics, fetch # download telemetry
 #from extract_supporting_facilities_webarchive import handle_webarchive_download  # webarchive functionality
 
 
@@ -69,25 +70,28 @@ def check_downloaded_file(download_dir):
         return None
 
 
-def download_file(url, filename):
+def download_file(url, filename, metrics=None):
     """Download file using Selenium for complex JavaScript-based redirection or direct download."""
     download_dir = os.path.dirname(filename)
+    metrics = metrics if metrics is not None else DownloadMetrics('download')  # records are dropped without a run
     try:
         if 'webarchive' in url or 'web.archive' in url:
             print('This is likely a webarchive URL, using Selenium library...')
-            latest_file = handle_webarchive_download(url, download_dir,
-                                                     check_downloaded_file)  # calling function from different file
-            if latest_file:
-                os.rename(latest_file, filename)
-                print(f"Successfully downloaded and renamed to {filename}")
-                return True
+            with metrics.timed(url, 'selenium') as record:
+                latest_file = handle_webarchive_download(url, download_dir,
+                                                         check_downloaded_file)  # calling function from different file
+                if latest_file:
+                    os.rename(latest_file, filename)
+                    record['ok'], record['bytes'] = True, os.path.getsize(filename)
+                    print(f"Successfully downloaded and renamed to {filename}")
+                    return True
         else:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             print("Non-webarchive file, direct download method using 'urllib.request' library)...")
-            response = requests.get(url, headers=headers, allow_redirects=True)
-            if response.status_code == 200:
+            response = fetch(url, headers, metrics) # timings, size, status and retries go to the run metrics
+            if response is not None and response.status_code == 200:
                 with open(filename, 'wb') as f:
                     f.write(response.content)
                 print(f"Successfully downloaded {filename}")
@@ -169,6 +173,7 @@ def main():
             print("Please try again.\n")
 
         # Output
+        metrics = DownloadMetrics('beds-overnight') # download telemetry, summarised at the end of the run
         for id in selected_ids:
             url, filename, text = links[id - 1]
             full_path = os.path.join(RAW_DATA_DIR, filename)
@@ -178,13 +183,13 @@ def main():
                 continue
 
             print(f"Downloading {filename} ...\n")
-            success = download_file(url, full_path)
+            success = download_file(url, full_path, metrics)
             if success:
                 print(f"Successfully downloaded {filename}\n")
             else:
                 print(f"Failed to download {filename}\n")
                 failed_downloads.append((id, filename, url))
-            time.sleep(1)
+            metrics.sleep(1)
 
         # Failed downloads
         if failed_downloads:
@@ -195,6 +200,8 @@ def main():
                 print(f"Filename: {filename}")
                 print(f"URL: {url}\n")
 
+        metrics.finish()
+
     # Errors
     except URLError as e:
         print(f"Network error: {e}")
@@ -0,0 +1,299 @@
+##########################################
+
+# This python script benchmarks the supporting facilities build stages on synthetic workbooks (synthetic_workbooks.py)
+# Stages: read_dataset, filter_rows, append_datasets (merge of sorted runs), map_columns (header_aliases.py), clean_dataset,
+# org_change_remap and panel_join (panel.py), the parse throughput of every installed Excel backend, and the
+# RTT wait-distribution metrics and long format (wait_distribution.py) on a year of synthetic monthly band counts
+# Each stage is timed on corpora at several scales (1x is about the size of the real raw files) and reports
+# wall time, rows per second and peak traced memory. Results are printed and written to a JSON file
+# The synthetic corpora are cached in BENCH_DIR/scale-<n>/ and only generated once
+# Regression gate: --baseline compares the run with stored results and exits with 1 when a stage is slower or
+# heavier than the baseline by more than the tolerance. Stages are timed round-robin, --repeat rounds (5 by default;
+# baselines timed with fewer are refused), and a stage that looks slower is timed again before it is reported
+# Usage:
+#   python benchmark.py [--scales 1 10 100] [--repeat 3] [--output results.json]
+#   python benchmark.py --scales 1 10 --save-baseline        store the results as the baseline
+#   python benchmark.py --scales 1 10 --baseline             compare with the stored baseline
+
+##########################################
+
+
+### LIBRARIES
+import pandas as pd
+from pathlib import Path
+import argparse
+import contextlib
+import datetime
+import io
+import numpy as np
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from synthetic_workbooks import generate_supporting_facilities, PROVIDERS_PER_SCALE, TREATMENT_FUNCTIONS # synthetic raw files
+from streaming import spill_run, read_appended # sorted runs for the append
+from build_datasets_main import read_dataset, filter_rows, append_datasets, clean_dataset
+from header_aliases import map_columns # canonical variables of the raw headers
+from panel import remap_org_changes, join_panel # org-change remap and panel join
+from excel_backends import read_excel, backends_for # Excel parsing backends
+from wait_distribution import wait_metrics, to_long # RTT week-band metrics
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+BENCH_DIR = Path(os.getenv("BENCH_DIR", BASE_DIR / "rawdata" / "benchmarks"))
+BASELINE_PATH = Path(os.getenv("BENCH_BASELINE", BENCH_DIR / "baseline.json"))
+VALUE_COLS = ['nr_operating_theatres', 'nr_day_case_theatres']
+HEADER_TEXT = 'Of which, number of dedicated day case theatres'
+MIN_BASELINE_REPEAT = 5  # timed runs per stage a baseline needs, so one slow run does not become the reference
+NOISE_STDEVS = 3  # slowdowns within this many baseline standard deviations are noise
+CONFIRM_ROUNDS = 2  # extra rounds of timed runs for a stage that looks regressed (a busy machine slows whole rounds)
+
+
+### FUNCTIONS
+def synthetic_corpus(scale, bench_dir=BENCH_DIR):
+    """Raw folder of synthetic supporting facilities workbooks at a scale, generated on first use."""
+    raw_dir = Path(bench_dir) / f'scale-{scale:g}'
+    marker = raw_dir / '.complete'
+    if not marker.exists():
+        print(f"Generating synthetic workbooks at {scale:g}x in {raw_dir} ...")
+        generate_supporting_facilities(raw_dir, scale)
+        marker.touch()
+    return raw_dir, sorted(f for f in os.listdir(raw_dir) if not f.startswith('.'))
+
+
+def measure_stages(funcs, repeat=3):
+    """
+    Time every function of {name: func} repeat times, round-robin (each round runs every function once), so that
+    all stages see the same machine speed when the CPU is throttled during the run; then run each once more under
+    tracemalloc for the peak memory it allocates (timed runs are kept separate because tracing slows
+    allocation-heavy code down). The build functions print progress; their output is discarded.
+    """
+    times = {name: [] for name in funcs}
+    for _ in range(repeat):
+        for name, func in funcs.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func()
+                times[name].append(time.perf_counter() - start)
+    results = {}
+    for name, func in funcs.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracemalloc.start()
+            try:
+                func()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        results[name] = {'median_s': statistics.median(times[name]), 'min_s': min(times[name]),
+                         'stdev_s': statistics.stdev(times[name]) if repeat > 1 else 0.0, 'peak_mb': peak / 2**20,
+                         'repeat': repeat}
+    return results
+
+
+def measure(func, repeat=3):
+    """Wall time and peak memory of one function (see measure_stages)."""
+    return measure_stages({'func': func}, repeat)['func']
+
+
+def synthetic_lookup(org_codes, changed_share=0.1, problematic_share=0.02, seed=0):
+    """Trust lookup in the layout of trust_lookup_uncomplicated_changes.csv: a share of organisations merge into others."""
+    rng = np.random.default_rng(seed)
+    codes = np.array(sorted(org_codes))
+    old = rng.choice(codes, int(len(codes) * changed_share), replace=False)
+    final = rng.choice(np.setdiff1d(codes, old), len(old))
+    return pd.DataFrame({'old_code': old, 'final_code': final, 'experiences_split': 0,
+                         'problematic': (rng.random(len(old)) < problematic_share / changed_share).astype(int)})
+
+
+def synthetic_bands(scale, months=12, seed=0):
+    """Week-band counts in the layout of rtt_provider: a year of monthly provider by treatment function rows."""
+    rng = np.random.default_rng(seed)
+    n_rows = int(PROVIDERS_PER_SCALE * scale) * len(TREATMENT_FUNCTIONS) * months
+    decay = np.exp(-np.arange(53) / rng.uniform(6, 14, (n_rows, 1)))
+    counts = rng.poisson(decay * rng.uniform(5, 200, (n_rows, 1))).astype(float)
+    bands = pd.DataFrame(counts, columns=[f'between_{i}_{i + 1}' for i in range(52)] + ['between_52_plus'])
+    keys = pd.DataFrame({'org_code': [f'R{i % 4096:03X}' for i in range(n_rows)],
+                         'period': np.repeat(np.arange(months, dtype=np.int32), n_rows // months + 1)[:n_rows]})
+    return pd.concat([keys, bands], axis=1)
+
+
+def prepare_inputs(raw_dir, files, work_dir):
+    """Intermediate inputs of each stage, produced once with the real stage functions."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        raw = {file: read_dataset(raw_dir / file, file) for file in files}
+        filtered = {file: filter_rows(df, HEADER_TEXT) for file, df in raw.items()}
+        runs = []
+        for order, (file, df) in enumerate(filtered.items()):
+            df = df.copy()
+            df.columns = list(df.columns[:3]) + list(df.iloc[0, 3:])
+            runs.append(spill_run(df.iloc[1:].reset_index(drop=True), work_dir / f'{order}.pkl', order, name=file))
+        appended_path = append_datasets(runs, work_dir / 'appended.csv', 'period', interactive=False)
+        appended = read_appended(appended_path)
+        clean = clean_dataset(appended.copy())
+    series = clean.rename(columns={'organisation_code': 'org_code'})[['org_code', 'period'] + VALUE_COLS]
+    series[VALUE_COLS] = series[VALUE_COLS].apply(pd.to_numeric, errors='coerce')
+    lookup = synthetic_lookup(series['org_code'].unique())
+    remapped = remap_org_changes(series, lookup, VALUE_COLS)
+    # A second series on the same organisations and periods to join with
+    other = remapped[['org_code', 'period']].assign(beds=np.random.default_rng(0).integers(0, 900, len(remapped)))
+    return raw, runs, appended, series, lookup, remapped, other
+
+
+def benchmark_scale(scale, repeat=3, bench_dir=BENCH_DIR, baseline=None, gate=None):
+    """
+    Time every stage on the corpus at one scale. With a baseline, a stage that looks regressed (compare with the
+    gate settings) is timed again up to CONFIRM_ROUNDS times and its fastest round is kept.
+    """
+    raw_dir, files = synthetic_corpus(scale, bench_dir)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as tmp:
+        work_dir = Path(tmp)
+        raw, runs, appended, series, lookup, remapped, other = prepare_inputs(raw_dir, files, work_dir)
+        raw_rows = sum(len(df) for df in raw.values())
+        stages = {
+            'read_dataset': (lambda: [read_dataset(raw_dir / file, file) for file in files], raw_rows),
+            'filter_rows': (lambda: [filter_rows(df, HEADER_TEXT) for df in raw.values()], raw_rows),
+            'append_datasets': (lambda: append_datasets(runs, work_dir / 'bench.csv', 'period', interactive=False),
+                                len(appended)),
+            'map_columns': (lambda: map_columns(appended, 'supporting_facilities', report=False), len(appended)),
+            'clean_dataset': (lambda: clean_dataset(appended.copy()), len(appended)),
+            'org_change_remap': (lambda: remap_org_changes(series, lookup, VALUE_COLS), len(series)),
+            'panel_join': (lambda: join_panel({'sf': remapped, 'beds': other}), len(remapped) + len(other)),
+        }
+        bands = synthetic_bands(scale)
+        stages['wait_metrics'] = (lambda: wait_metrics(bands), len(bands))
+        stages['wait_long'] = (lambda: to_long(bands, ['org_code', 'period']), len(bands))
+        # Parse throughput of each backend installed for every file (whole workbooks, all sheets)
+        for backend in sorted(set.intersection(*(set(backends_for(raw_dir / file, [])) for file in files))):
+            stages[f'parse[{backend}]'] = (
+                lambda backend=backend: [read_excel(raw_dir / file, sheet_name=None, backends=[backend]) for file in files],
+                raw_rows)
+        measured = measure_stages({name: func for name, (func, _) in stages.items()}, repeat)
+        for name, (func, rows) in stages.items():
+            result = dict(measured[name], stage=name, scale=scale)
+            for _ in range(CONFIRM_ROUNDS if baseline is not None else 0):
+                if compare([result], baseline, **(gate or {}))[0]['status'] != 'regressed':
+                    break
+                result = min(result, dict(measure(func, repeat), stage=name, scale=scale), key=lambda r: r['median_s'])
+            result.update({'files': len(files), 'rows': rows,
+                           'rows_per_s': rows / result['median_s'] if result['median_s'] else None})
+            results.append(result)
+            print(f"{name:<20} {scale:>6g}x {rows:>10,} rows {result['median_s']:>9.3f} s "
+                  f"{result['rows_per_s']:>12,.0f} rows/s {result['peak_mb']:>9.1f} MB")
+    return results
+
+
+def check_baseline(baseline, min_repeat=MIN_BASELINE_REPEAT):
+    """Raise if the baseline was timed with fewer than min_repeat runs per stage."""
+    repeats = [r.get('repeat', 1) for r in baseline['results']]
+    if repeats and min(repeats) < min_repeat:
+        raise ValueError(f"Baseline timed with --repeat {min(repeats)}, save it again with --repeat {min_repeat} or more")
+
+
+def compare(results, baseline, tolerance=0.25, memory_tolerance=0.25, min_delta_s=0.05):
+    """
+    Compare results with baseline results per (stage, scale). A stage regresses when its median time grows by more
+    than tolerance and by more than max(min_delta_s, NOISE_STDEVS x the standard deviation of the timed runs), to
+    ignore noise, or its peak memory grows by more than memory_tolerance. Returns the comparison rows.
+    """
+    base = {(r['stage'], r['scale']): r for r in baseline['results']}
+    rows = []
+    for r in results:
+        b = base.get((r['stage'], r['scale']))
+        if b is None:
+            rows.append({'stage': r['stage'], 'scale': r['scale'], 'status': 'new'})
+            continue
+        noise = max(min_delta_s, NOISE_STDEVS * max(b.get('stdev_s', 0.0), r['stdev_s']))
+        time_ratio = r['median_s'] / b['median_s'] if b['median_s'] else float('inf')
+        memory_ratio = r['peak_mb'] / b['peak_mb'] if b['peak_mb'] else float('inf')
+        slower = time_ratio > 1 + tolerance and r['median_s'] - b['median_s'] > noise
+        heavier = memory_ratio > 1 + memory_tolerance
+        faster = time_ratio < 1 - tolerance and b['median_s'] - r['median_s'] > noise
+        rows.append({'stage': r['stage'], 'scale': r['scale'], 'base_s': b['median_s'], 'median_s': r['median_s'],
+                     'time_ratio': time_ratio, 'base_mb': b['peak_mb'], 'peak_mb': r['peak_mb'],
+                     'memory_ratio': memory_ratio,
+                     'status': 'regressed' if slower or heavier else 'improved' if faster else 'ok'})
+    return rows
+
+
+def print_comparison(rows):
+    """Diff table of a comparison."""
+    print(f"\n{'stage':<20} {'scale':>7} {'baseline':>10} {'now':>10} {'time':>8} {'base MB':>9} {'now MB':>9} {'mem':>8}  status")
+    for r in rows:
+        if r['status'] == 'new':
+            print(f"{r['stage']:<20} {r['scale']:>6g}x {'':>66}  new (not in baseline)")
+            continue
+        print(f"{r['stage']:<20} {r['scale']:>6g}x {r['base_s']:>9.3f}s {r['median_s']:>9.3f}s {r['time_ratio'] - 1:>+8.0%} "
+              f"{r['base_mb']:>9.1f} {r['peak_mb']:>9.1f} {r['memory_ratio'] - 1:>+8.0%}  {r['status']}")
+
+
+def environment():
+    """Versions and machine details stored with the results, so runs can be compared."""
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the supporting facilities build stages on synthetic workbooks")
+    parser.add_argument('--scales', nargs='+', type=float, default=[1, 10, 100], help="corpus scales (1 = real size)")
+    parser.add_argument('--repeat', type=int, default=MIN_BASELINE_REPEAT, help="timed runs per stage")
+    parser.add_argument('--output', default=None, help="results JSON (default BENCH_DIR/results-<timestamp>.json)")
+    parser.add_argument('--baseline', nargs='?', const=str(BASELINE_PATH), default=None,
+                        help="compare with a stored baseline and exit with 1 on regressions (default BENCH_DIR/baseline.json)")
+    parser.add_argument('--save-baseline', nargs='?', const=str(BASELINE_PATH), default=None,
+                        help="store the results as the baseline (default BENCH_DIR/baseline.json)")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown of the median time")
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help="allowed relative growth of peak memory")
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help="slowdowns below this many seconds (or 3 baseline standard deviations) are ignored")
+    args = parser.parse_args(argv)
+    if args.save_baseline and args.repeat < MIN_BASELINE_REPEAT:
+        parser.error(f"--save-baseline needs --repeat {MIN_BASELINE_REPEAT} or more")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            check_baseline(baseline)
+        except ValueError as e:
+            parser.error(str(e))
+
+    env = environment()
+    print(f"{'stage':<20} {'scale':>7} {'rows':>15} {'time':>11} {'throughput':>19} {'peak':>12}")
+    gate = {'tolerance': args.tolerance, 'memory_tolerance': args.memory_tolerance, 'min_delta_s': args.min_delta}
+    results = []
+    for scale in args.scales:
+        results += benchmark_scale(scale, args.repeat, baseline=baseline, gate=gate)
+
+    output = Path(args.output) if args.output else \
+        BENCH_DIR / f"results-{env['timestamp'].replace(':', '').replace('-', '')}.json"
+    for path in filter(None, [output, args.save_baseline]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'environment': env, 'results': results}, f, indent=2)
+        print(f"\nResults saved to {path}")
+
+    if baseline is not None:
+        rows = compare(results, baseline, **gate)
+        print_comparison(rows)
+        regressed = [r for r in rows if r['status'] == 'regressed']
+        if regressed:
+            print(f"\n{len(regressed)} stage(s) regressed against {args.baseline}")
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
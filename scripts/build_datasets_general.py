@@ -6,14 +6,15 @@
 
 
 ### LIBRARIES
-# pip install xlrd
-import xlrd # for .xls
+# pip install xlrd (used by pandas for .xls), pip install openpyxl (.xlsx)
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import os
-from extract_supporting_facilities_main import validate_id_input # validating IDs functionality
+from selection import validate_id_input # validating IDs functionality
+from excel_backends import read_excel # Excel parsing backends with per-file fallback
 import re # for file reading and text extraction 
+import layout_plans # parse plans of the workbook templates
 
 
 ### FUNCTIONS
@@ -27,7 +28,7 @@ def read_dataset(file_path, filename):
         if ext == '.csv':
             df = pd.read_csv(file_path)
         elif ext in ['.xls', '.xlsx']:
-            df = pd.read_excel(file_path)
+            df = read_excel(file_path)
         else:
             raise ValueError(f"Unsupported file format: {ext}")
     except Exception as e:
@@ -149,6 +150,7 @@ def main():
             
     # Output
     datasets = {}
+    plans = layout_plans.connect()  # start rows chosen before, by workbook template
     for id in selected_ids:
         file = files[id - 1]
         file_path = Path(RAW_DATA_DIR) / file
@@ -166,9 +168,21 @@ def main():
         print("\nFirst few rows:")
         print(df.head(30))
         
-        filter_input = input("\nNeed to drop first few rows? (yes/no): ").lower()
+        # Files of a template seen before start at the row chosen for it; the start row of a new template is saved
+        raw_part = df.iloc[:, 2:]  # without year_var and quarter_var
+        fp = layout_plans.fingerprint(raw_part)
+        plan = layout_plans.get_plan(plans, fp)
+        if plan is not None and plan['header_row'] is not None and layout_plans.matches(raw_part, plan):
+            print(f"\nLayout {fp} seen before ({plan['source']}), starting at row {plan['header_row']}")
+            filter_input, filter_input_2 = 'yes', plan['header_row']
+        else:
+            filter_input = input("\nNeed to drop first few rows? (yes/no): ").lower()
+            if filter_input == 'yes':
+                filter_input_2 = input("\nWhich row do you want to start at?: ").lower()
+                if filter_input_2.isdigit() and int(filter_input_2) < len(df):
+                    layout_plans.save_plan(plans, fp, layout_plans.make_plan(raw_part, int(filter_input_2)),
+                                           source=file, reviewed=True)
         if filter_input == 'yes':
-            filter_input_2 = input("\nWhich row do you want to start at?: ").lower()
             df = filter_rows(df, filter_input_2)
             
             # Using first row values as column names
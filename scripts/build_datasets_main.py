@@ -6,14 +6,31 @@
 
 
 ### LIBRARIES
-# pip install xlrd
-import xlrd # for .xls
+# pip install xlrd (used by pandas for .xls), pip install openpyxl (.xlsx)
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import os
-from extract_supporting_facilities_main import validate_id_input # validating IDs functionality
+import sys
+import shutil
+import tempfile
+from selection import validate_id_input # validating IDs functionality
+from excel_backends import read_excel # Excel parsing backends with per-file fallback
 import re # for file reading and text extraction 
+from periods import encode_financial_quarter, period_label # integer period keys
+from dataset_store import publish # partitioned dataset store
+from incremental import load_state, save_state, plan_build, store_frame, cached_run, cache_exists, drop_files, record_output # incremental builds
+from streaming import spill_run, union_columns, merge_runs, write_csv_stream, read_appended # bounded-memory append
+from instrument import instrumented_run, stage, frame_bytes, file_bytes # per-stage run report
+from header_aliases import match_headers, map_columns # canonical variables of the raw headers
+from coverage_report import check_frame # period coverage checks
+from revisions import overlapping_files, revision_order, drop_superseded, organisation_headers # revised releases
+import raw_catalog # raw-file catalog with cached structure
+import layout_plans # parse plans of the workbook templates
+
+
+### SETTINGS
+HEADER_LABEL = 'Of which, number of dedicated day case theatres'  # text of the header row of every raw file
 
 
 ### FUNCTIONS
@@ -26,32 +43,32 @@ def read_dataset(file_path, filename):
         year, quarter_info, is_all_quarters = extract_date_info(filename)
         
         if is_all_quarters:
-            # Read all sheets and combine them
+            # Read all sheets in one parse of the workbook and combine the quarter sheets
             dfs = []
-            excel_file = pd.ExcelFile(file_path)
+            sheets = read_excel(file_path, sheet_name=None)
             
-            for sheet in excel_file.sheet_names:
+            for sheet, df_sheet in sheets.items():
                 for month_pattern, quarter in quarter_info.items():
                     if month_pattern in sheet:
-                        df_sheet = pd.read_excel(file_path, sheet_name=sheet)
-                        df_sheet['year_var'] = year
-                        df_sheet['quarter_var'] = quarter
-                        dfs.append(df_sheet)
+                        dfs.append(df_sheet.assign(year_var=year, quarter_var=quarter))
             
             if dfs:
                 df = pd.concat(dfs, ignore_index=True)
             else:
-                df = pd.read_excel(file_path)  # Fallback to reading entire file
+                df = next(iter(sheets.values()))  # Fallback to the first sheet
                 df['year_var'] = year
                 df['quarter_var'] = '.'
         else:
             # Regular file reading
-            df = pd.read_excel(file_path)  # Removed csv option as per comment
+            df = read_excel(file_path)  # Removed csv option as per comment
             df['year_var'] = year
             df['quarter_var'] = quarter_info  # quarter_info is just quarter in this case    
         
-        # Reordering columns so year_var and quarter_var come first
-        new_column_order = ['year_var', 'quarter_var'] + [col for col in df.columns if col not in ('year_var', 'quarter_var')]
+        # Integer period key (monthly ordinal of the quarter end) used for sorting and joining
+        df['period'] = encode_financial_quarter(df['year_var'], df['quarter_var'])
+        
+        # Reordering columns so year_var, quarter_var and period come first
+        new_column_order = ['year_var', 'quarter_var', 'period'] + [col for col in df.columns if col not in ('year_var', 'quarter_var', 'period')]
         df = df[new_column_order]
         return df
         
@@ -91,9 +108,27 @@ def extract_date_info(filename):
         quarter = f"Q{quarter_match.group(1) or quarter_match.group(2)}" if quarter_match else '.'
         return year, quarter, False
 
-def filter_rows(df, variable_name_str):
+def quarter_known(df):
+    """
+    Whether every row of a processed file has its quarter (rows without one are keyed on Q4); the missing quarter
+    '.' is 'NA' once filter_rows has run.
+    """
+    return not df['quarter_var'].astype(str).isin(['.', 'NA']).any()
+
+def find_header_row(df, variable_name_str):
+    """
+    Index of the first row with a cell containing variable_name_str (case insensitive), or None.
+    """
+    found = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        found |= df[col].astype(str).str.contains(variable_name_str, case=False, regex=False).to_numpy(dtype=bool)
+    rows = np.flatnonzero(found)
+    return int(rows[0]) if len(rows) else None
+
+def filter_rows(df, variable_name_str, start_row=None):
     """
     Filter dataframe rows starting from variable name.
+    start_row (e.g. the header row recorded in the raw-file catalog) skips the search.
     """
     try:
         # Define missing value indicators
@@ -103,11 +138,7 @@ def filter_rows(df, variable_name_str):
         df = df.replace(missing_values, 'NA')
         df = df.fillna('NA')
         # Find the row containing "Number of operating theatres"
-        target_row = None
-        for idx, row in df.iterrows():
-            if row.astype(str).str.contains(variable_name_str, case=False).any():
-                target_row = idx
-                break
+        target_row = start_row if start_row is not None else find_header_row(df, variable_name_str)
         if target_row is not None:
             filtered_df = df.iloc[target_row:].reset_index(drop=True)
             return filtered_df
@@ -118,99 +149,197 @@ def filter_rows(df, variable_name_str):
         print(f"Error during filtering: {e}, keeping original dataset")
         return df
 
-def rename_selected_columns(df):
+def describe_file(file_path, con=None):
     """
-    Rename specific columns in dataframe
+    Structure of a raw file for the raw-file catalog (see raw_catalog.py): year and quarters from its name, layout,
+    sheets with their row counts and the header row of each sheet (as indexed by read_dataset).
+    With the catalog connection con, the header row comes from the parse plan of the sheet's template (see
+    layout_plans.py) and is only searched for in sheets of a new template, which are flagged for review.
+    Returns None when the file could not be read, so it is described again on the next build.
     """
-    while True:
-        print("\nCurrent columns:", df.columns.tolist())
-        rename = input("Do you want to rename a column? (yes/no): ").lower()
-        if rename != 'yes':
-            break
-            
-        col_name = input("Which column do you want to rename?: ")
-        if col_name not in df.columns:
-            print("Column not found")
-            continue
-            
-        new_name = input("Enter new column name: ")
-        df = df.rename(columns={col_name: new_name})
-    return df
-
-
-def append_datasets(datasets, year_var_str, quarter_var_str):
+    filename = Path(file_path).name
+    try:
+        year, quarter_info, is_all_quarters = extract_date_info(filename)
+    except Exception as e:
+        print(f"Error reading the period of {filename}: {e}")
+        return None
+    structure = {'year': year, 'layout': 'all_quarters' if is_all_quarters else 'quarterly',
+                 'quarters': list(quarter_info.values()) if is_all_quarters else [quarter_info]}
+    try:
+        sheets = read_excel(file_path, sheet_name=None)
+    except Exception as e:
+        print(f"Error reading the sheets of {filename}: {e}")
+        return None
+    structure['sheets'] = {str(sheet): len(df) for sheet, df in sheets.items()}
+    if con is None:
+        structure['header_rows'] = {str(sheet): find_header_row(df, HEADER_LABEL) for sheet, df in sheets.items()}
+        return structure
+    structure['header_rows'], fingerprints = {}, {}
+    for sheet, df in sheets.items():
+        fp, plan, new = layout_plans.plan_for(con, df, 'supporting_facilities', source=f"{filename} [{sheet}]",
+                                              detect=lambda d: find_header_row(d, HEADER_LABEL))
+        if new:
+            print(f"New layout template {fp} in {filename} [{sheet}] (header row {plan['header_row']}), "
+                  f"flagged for review (python layout_plans.py)")
+        structure['header_rows'][str(sheet)], fingerprints[str(sheet)] = plan['header_row'], fp
+    structure['details'] = {'fingerprints': fingerprints}
+    return structure
+
+def catalog_header_row(entry):
+    """
+    Header row of a catalogued file in the frame read_dataset returns (quarter sheets stacked in workbook order),
+    or None if the catalog does not know it.
+    """
+    if not entry or not entry.get('sheets') or entry.get('header_rows') is None:
+        return None
+    sheets = list(entry['sheets'])
+    if entry['layout'] == 'all_quarters':
+        _, quarter_info, _ = extract_date_info(entry['name'])
+        sheets = [sheet for sheet in sheets if any(pattern in sheet for pattern in quarter_info)] or sheets[:1]
+    else:
+        sheets = sheets[:1]
+    offset = 0
+    for sheet in sheets:
+        if entry['header_rows'].get(sheet) is not None:
+            return offset + entry['header_rows'][sheet]
+        offset += entry['sheets'][sheet]
+    return None
+
+def append_datasets(runs, output_path, period_var_str, interactive=True, raw_dir=None):
     """
-    Append datasets vertically.
+    Append the spilled runs (see streaming.py) vertically into output_path, sorted on the integer period key.
+    The runs are merged and written block by block, so the appended dataset is never held in memory.
+    Where files overlap in period (an original and a revised release), only the latest revision of each
+    organisation is kept (see revisions.py; raw_dir gives the download dates used to rank unmarked files).
     """
-    if len(datasets) < 2:
+    if interactive and len(runs) < 2:
         print("Need at least 2 datasets to append")
         return None
         
     print("\nAvailable datasets:")
-    for i, (name, df) in enumerate(datasets.items(), 1):
-        print(f"{i}. {name}")
-        print(f"   Columns: {df.columns.tolist()}\n")
+    for i, run in enumerate(runs, 1):
+        print(f"{i}. {run['name']}")
+        print(f"   Columns: {run['columns']}\n")
     
     try:
-        appended_df = pd.concat(datasets.values(), axis=0, ignore_index=True)
-        appended_df = appended_df.sort_values(by=[year_var_str, quarter_var_str], ascending=True)
-        appended_df = appended_df.reset_index(drop=True)
-        appended_df = rename_selected_columns(appended_df)
-        print(f"\nAppended dataset shape: {appended_df.shape}")
-        return appended_df
+        columns = union_columns(runs)
+        # The raw headers are kept; the clean step maps them to the canonical variables (see header_aliases.py)
+        _, _, unknown = match_headers(columns, 'supporting_facilities')
+        if unknown:
+            print(f"Unknown headers (not mapped when cleaning, add them to header_aliases.ALIASES): {unknown}")
+        for run in runs:
+            if not run.get('period_known', True):
+                print(f"Quarter of {run['name']} not known (keyed on Q4), not checked against other releases")
+        overlaps = overlapping_files(runs)
+        for earlier, later, first, last in overlaps:
+            labels = sorted(set(period_label([first, last], 'quarter')))
+            print(f"Files overlapping in {' to '.join(labels)}: {earlier} and {later}")
+        blocks = merge_runs(runs, period_var_str)
+        superseded = {}
+        if overlaps:
+            blocks = drop_superseded(merge_runs(runs, period_var_str, with_keys=True), revision_order(runs, raw_dir),
+                                     organisation_headers(columns), superseded)
+        rows = write_csv_stream(blocks, columns, output_path)
+        if superseded.get('dropped'):
+            print(f"Dropped {superseded['dropped']} rows superseded by a later revision in {superseded['periods']} periods")
+        print(f"\nAppended dataset shape: ({rows}, {len(columns)})")
+        return output_path
     except Exception as e:
         print(f"Error during append: {e}")
         return None    
     
-def consolidate_columns(df, column_groups):
+def process_file(file_path, filename, entry=None):
     """
-    Efficiently consolidate multiple column groups into single columns.
-    Used in data cleaning.
+    Read one raw file, drop the preamble rows above the header and use the header row as column names.
+    entry is the catalog entry of the file; its header row spares searching for the header.
     """
+    with stage('read_dataset', file=filename, bytes_in=file_bytes(file_path)) as s:
+        df = read_dataset(file_path, filename)
+        s['rows_out'], s['bytes_out'] = (len(df), frame_bytes(df)) if df is not None else (0, 0)
+    if df is None:
+        return None
+    
+    # Filtering by variable name: "Of which, number of dedicated day case theatres"
+    with stage('filter_rows', file=filename, rows_in=len(df)) as s:
+        df = filter_rows(df, HEADER_LABEL, start_row=catalog_header_row(entry))
+        s['rows_out'] = len(df)
+    
+    # Using first row values as column names
     try:
-        # Create all new columns at once
-        for new_col, old_cols in column_groups.items():
-            # Convert to string type to avoid type mismatches
-            cols_to_combine = [df[col].astype(str) for col in old_cols if col in df.columns]
-            if cols_to_combine:
-                # Replace 'nan' and 'NA' with None for proper coalescing
-                for i, col in enumerate(cols_to_combine):
-                    cols_to_combine[i] = col.replace({'nan': None, 'NA': None})
-                
-                # Combine all columns using reduce
-                from functools import reduce
-                df[new_col] = reduce(lambda x, y: x.combine_first(y), cols_to_combine)
-        
-        # Reorder columns to put new columns after quarter_var
-        old_cols = df.columns.tolist()
-        new_cols = [col for col in old_cols if col not in column_groups.keys()]
-        insert_pos = new_cols.index('quarter_var') + 1
-        for new_col in column_groups.keys():
-            new_cols.insert(insert_pos, new_col)
-            insert_pos += 1
-            
-        return df[new_cols]
-        
+        # Keep original names of the first three columns (year_var, quarter_var, period)
+        id_column_names = list(df.columns[:3])
+        # Creating a new list of column names
+        new_columns = id_column_names + list(df.iloc[0, 3:])
+        # Apply new column names to the DataFrame
+        df.columns = new_columns
+        df = df.iloc[1:].reset_index(drop=True)
     except Exception as e:
-        print(f"Error consolidating columns: {e}")
-        return df
+        print(f"Error setting column names: {e}")
+    return df
+
+def build_incremental(raw_data_dir, data_dir, files, state_dir, output_name='supporting-facilities.csv', catalog=None):
+    """
+    Rebuild the appended dataset processing only new or changed raw files.
+    Processed frames of unchanged files come from the build cache, frames of revised files are replaced
+    and frames of files no longer in raw_data_dir are dropped. catalog holds the catalog entries of the files.
+    """
+    catalog = catalog or {}
+    state = load_state(state_dir)
+    to_process, unchanged, removed, fingerprints = plan_build(raw_data_dir, files, state, state_dir)
+    print(f"\nIncremental build: {len(to_process)} new or changed, {len(unchanged)} unchanged, {len(removed)} removed")
+    
+    drop_files(removed, state, state_dir)
+    runs = []
+    for order, file in enumerate(files):
+        if file not in unchanged or not cache_exists(file, state, state_dir):
+            print(f"\nReading {file} ...")
+            df = process_file(Path(raw_data_dir) / file, file, catalog.get(file))
+            if df is None:
+                continue
+            store_frame(df, file, fingerprints[file], state, state_dir, period_known=quarter_known(df))
+            del df
+        runs.append(cached_run(file, order, state, state_dir))
     
+    if not runs:
+        print("No datasets to merge")
+        return {}
+    # Same order as a full build: files in sorted order, stable on period
+    output_path = os.path.join(data_dir, output_name)
+    with stage('append_datasets', rows_in=sum(run['rows'] for run in runs)) as s:
+        if append_datasets(runs, output_path, 'period', interactive=False, raw_dir=raw_data_dir) is None:
+            return {}
+        s['bytes_out'] = file_bytes(output_path)
+    print(f"Dataset successfully saved to {output_path}")
+    record_output(state, output_name, [run['name'] for run in runs])
+    save_state(state, state_dir)
+    return {'appended': read_appended(output_path)}
+
 
 ### MAIN EXECUTION
-def main():
+def main(incremental=False):
     # Defining directories
     try:
         BASE_DIR = Path(__file__).resolve().parent.parent
     except NameError:
         BASE_DIR = Path.cwd()
     RAW_DATA_DIR = os.getenv("RAW_DATA_DIR", BASE_DIR / "rawdata" / "supporting-facilities")
-    DATA_DIR = os.getenv("RAW_DATA_DIR", BASE_DIR / "data")
+    SF_DATA_DIR = os.getenv("SF_DATA_DIR", BASE_DIR / "data" / "supporting-facilities")
+    BUILD_STATE_DIR = os.getenv("BUILD_STATE_DIR", BASE_DIR / "rawdata" / ".build-state" / "supporting-facilities")
+    # Incremental mode (main(incremental=True), python build_datasets_main.py --incremental, or INCREMENTAL=1) runs
+    # unattended on all files
+    incremental = incremental or '--incremental' in sys.argv or os.getenv("INCREMENTAL") == '1'
 
     if not os.path.exists(RAW_DATA_DIR):
         print(f"Directory {RAW_DATA_DIR} does not exist.")
         return
         
-    files = sorted(os.listdir(RAW_DATA_DIR)) # in sorted order
+    # Files from the raw-file catalog: only new or changed workbooks are opened to record their structure,
+    # and only sheets of a new template are searched for their header
+    with stage('catalog'):
+        con = layout_plans.connect()
+        catalog = raw_catalog.refresh(con, RAW_DATA_DIR, lambda path: describe_file(path, con))
+        con.close()
+    files = list(catalog) # in sorted order
     
     if not files:
         print(f"No files found in {RAW_DATA_DIR}")
@@ -218,11 +347,11 @@ def main():
         
     print(f"\nFiles in {RAW_DATA_DIR}:")
     print("-" * 50)
-    for i, file in enumerate(sorted(files), 1):
-        file_path = os.path.join(RAW_DATA_DIR, file)
-        file_size = os.path.getsize(file_path)
-        print(f"{i}. {file} ({file_size/1024:.1f} KB)")
+    for i, file in enumerate(files, 1):
+        print(f"{i}. {file} ({catalog[file]['size']/1024:.1f} KB)")
     
+    if incremental:
+        return build_incremental(RAW_DATA_DIR, SF_DATA_DIR, files, BUILD_STATE_DIR, catalog=catalog)
     
     # User input for IDs
     while True:            
@@ -232,40 +361,18 @@ def main():
             break
         print("Please try again.\n")
             
-    # Output
-    datasets = {}
-    for id in selected_ids:
+    # Output: each processed file is spilled to disk as a period-sorted run instead of being kept in memory
+    run_dir = Path(tempfile.mkdtemp(prefix='supporting-facilities-runs-'))
+    runs = []
+    for order, id in enumerate(selected_ids):
         file = files[id - 1]
         file_path = Path(RAW_DATA_DIR) / file
         print(f"\nReading {file} ...")
         
-        df = read_dataset(file_path, file)
+        df = process_file(file_path, file, catalog[file])
 
         if df is None:
             continue
-            
-#        print("\nDataset Info:")
-#        print(df.info())
-#        print("\nShape:", df.shape)
-#        print("\nColumns:", df.columns.tolist())
-#        print("\nFirst few rows:")
-#        print(df.head(30))
-        
-        # Filtering by variable name: "Of which, number of dedicated day case theatres"
-        df = filter_rows(df, 'Of which, number of dedicated day case theatres')
-        
-        # Using first row values as column names
-        try:
-            # Store original names of the first two columns
-            year_column_name = df.columns[0]
-            quarter_column_name = df.columns[1]
-            # Creating a new list of column names
-            new_columns = [year_column_name, quarter_column_name] + list(df.iloc[0, 2:])
-            # Apply new column names to the DataFrame
-            df.columns = new_columns
-            df = df.iloc[1:].reset_index(drop=True)
-        except Exception as e:
-            print(f"Error setting column names: {e}")
 
         print("\nModified dataset info:")
         print(df.info())
@@ -274,118 +381,125 @@ def main():
         print("\nFirst few rows:")
         print(df.head(10))
         
-        datasets[file] = df
+        runs.append(spill_run(df, run_dir / f"{order}.pkl", order, name=file, period_known=quarter_known(df)))
+        del df
     
-    print(f"\nStored {len(datasets)} datasets in dictionary")
+    print(f"\nStored {len(runs)} datasets as sorted runs in {run_dir}")
     
-    append_input = input("Do you want to merge the datasets (yes/no)?:\n(Dataset will be sorted by year_var and quarter_var)").lower()
-    if append_input == 'yes':
-        append_data = append_datasets(datasets, 'year_var', 'quarter_var')
-        if append_data is not None:
-            save_data_input = input("Do you want to save this dataset as .csv in local directory (yes/no)?: ").lower()
-            if save_data_input == 'yes':
-                try:
-                    output_path = os.path.join(DATA_DIR, 'supporting-facilities.csv')
-                    append_data.to_csv(output_path, index=False)
-                    print(f"Dataset successfully saved to {output_path}")
-                except Exception as e:
-                    print(f"Error saving dataset: {e}")
-            return {'appended': append_data, **datasets}
-    return datasets
-    
-    return datasets
+    try:
+        append_input = input("Do you want to merge the datasets (yes/no)?:\n(Dataset will be sorted by period)").lower()
+        if append_input == 'yes':
+            with stage('append_datasets', rows_in=sum(run['rows'] for run in runs)) as s:
+                appended_path = append_datasets(runs, run_dir / 'supporting-facilities.csv', 'period',
+                                                raw_dir=RAW_DATA_DIR)
+                s['bytes_out'] = file_bytes(appended_path) if appended_path is not None else None
+            if appended_path is not None:
+                save_data_input = input("Do you want to save this dataset as .csv in local directory (yes/no)?: ").lower()
+                if save_data_input == 'yes':
+                    try:
+                        output_path = os.path.join(SF_DATA_DIR, 'supporting-facilities.csv')
+                        shutil.copyfile(appended_path, output_path)
+                        print(f"Dataset successfully saved to {output_path}")
+                    except Exception as e:
+                        print(f"Error saving dataset: {e}")
+                return {'appended': read_appended(appended_path)}
+        return {run['name']: pd.read_pickle(run['path']) for run in runs}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
 
-if __name__ == "__main__":
-    datasets = main()    
-    
-    
-    
-    
-    
 ### CLEANING
-
-# Checking if all years have quarters
-    
-df = datasets['appended']
-
-for year in df['year_var'].unique():
-    df_filtered = df[df['year_var'] == year]
-    print(f"Quarters for {year}")
-    print(df_filtered['quarter_var'].unique())
-    
-print(df.info())
-
-# Creating single vars for measure:
+# Creating single vars for measure (the headers of each are in header_aliases.ALIASES):
 # - organisation code
 # - number of operating theatres
 # - number of daycase theatres
 
-
-# Defining the new columns we want to create
-column_mappings = {
-    'SHA_2': ['SHA', 'SHA Code'],
-    'organisation_code': ['OrgID', 'Organisation Code'],
-    'organisation_name': ['Name', 'Organisation Name'],
-    'area_team_code': ['Area Team Code'],
-    'area_team_name': ['Area Team Name'],
-    'region_code': ['Region Code'],
-    'region_name': ['Region Name'],
-}
-
-df = consolidate_columns(df, column_mappings)
-
-df = df.drop(columns = ['SHA', 'OrgID', 'Name',
-                        'NA', 'SHA Code',
-                        'Organisation Code', 'Organisation Name', 
-                        'Area Team Code', 'Area Team Name', 
-                        'Region Code', 'Region Name']) # unnecessary column
-
-df.rename(columns={'SHA_2': 'SHA',
-                   'Number of operating theatres': 'nr_operating_theatres',
-                   'Of which, number of dedicated day case theatres': 'nr_day_case_theatres'}, inplace=True)
-
-
-
-# Getting final data and cleaning for unimportant rows from merging different raw datasets (e.g. "Source")
-datasets_2 = []  # Use list instead of dict since we're appending
-
-# Filtering the data for each year then dropping rows
-for year in df['year_var'].unique():
-    df_filtered = df[df['year_var'] == year].copy()  # Use copy to avoid SettingWithCopyWarning
-    df_filtered = df_filtered.dropna(subset=['organisation_code'])
-    mask_theatres = (df_filtered['nr_day_case_theatres'] != 'NA') & \
-                    (df_filtered['nr_day_case_theatres'] != 'Of which, number of dedicated day case theatres')
-    mask_org = (df_filtered['organisation_name'] != 'England (Including Independent Sector)') & \
-                (df_filtered['organisation_name'] != 'England (Excluding Independent Sector)')
-    df_filtered = df_filtered[mask_theatres & mask_org]
-    if not df_filtered.empty:
-        datasets_2.append(df_filtered)
-        print(f"Added dataset for year {year} with {len(df_filtered)} rows")
-# Merge all datasets after the loop
-if datasets_2:
+def clean_dataset(df):
+    """
+    Clean the appended dataset: consolidate the variables whose names changed over time and
+    drop rows that are not organisations (totals, repeated headers, sources).
+    """
+    # Appended datasets built before the period key was introduced
+    if 'period' not in df.columns:
+        df.insert(2, 'period', encode_financial_quarter(df['year_var'], df['quarter_var']))
+
+    print(df.info())
+
+    # One column per variable whatever header it had in each raw file; unknown headers are reported
+    df = map_columns(df, 'supporting_facilities')
+
+    # Getting final data and cleaning for unimportant rows from merging different raw datasets (e.g. "Source")
+    datasets_2 = []  # Use list instead of dict since we're appending
+
+    # Filtering the data for each year then dropping rows
+    for year in df['year_var'].unique():
+        df_filtered = df[df['year_var'] == year].copy()  # Use copy to avoid SettingWithCopyWarning
+        df_filtered = df_filtered.dropna(subset=['organisation_code'])
+        mask_theatres = df_filtered['nr_day_case_theatres'].notna() & \
+                        (df_filtered['nr_day_case_theatres'] != 'Of which, number of dedicated day case theatres')
+        mask_org = (df_filtered['organisation_name'] != 'England (Including Independent Sector)') & \
+                    (df_filtered['organisation_name'] != 'England (Excluding Independent Sector)')
+        df_filtered = df_filtered[mask_theatres & mask_org]
+        if not df_filtered.empty:
+            datasets_2.append(df_filtered)
+            print(f"Added dataset for year {year} with {len(df_filtered)} rows")
+    # Merge all datasets after the loop
+    if not datasets_2:
+        print("No datasets to merge")
+        return None
     final_df = pd.concat(datasets_2, axis=0, ignore_index=True)
-    final_df = final_df.sort_values(by=['year_var', 'quarter_var'], ascending=True)
+    final_df = final_df.sort_values(by='period', ascending=True, kind='stable')
     print(f"\nFinal dataset shape: {final_df.shape}")
-else:
-    print("No datasets to merge")
-
-# Checking for quarters across years
-for year in final_df['year_var'].unique():
-    df_filtered = final_df[final_df['year_var'] == year]
-    print(f"Quarters for {year}")
-    print(df_filtered['quarter_var'].unique())
-
-
-# Saving
-try:
-    BASE_DIR = Path(__file__).resolve().parent.parent
-except NameError:
-    BASE_DIR = Path.cwd()
-DATA_DIR = BASE_DIR / "data"
-output_path = os.path.join(DATA_DIR, 'supporting-facilities_clean.csv')
-final_df.to_csv(output_path, index=False)
 
+    # Checking for missing quarters, organisations dropping in and out and unusual row counts (see coverage_report.py)
+    check_frame(final_df, 'supporting_facilities')
+    return final_df
 
+def save_clean_dataset(final_df, data_dir):
+    """
+    Save the cleaned dataset as .csv and publish it to the partitioned store.
+    """
+    output_path = os.path.join(data_dir, 'supporting-facilities_clean.csv')
+    with stage('save_clean_dataset', rows_in=len(final_df)) as s:
+        # The published csv keeps its columns (the R org-change scripts rbind on them); the period key is in the store
+        final_df.drop(columns='period').to_csv(output_path, index=False)
+        s['bytes_out'] = file_bytes(output_path)
+    print(f"Dataset successfully saved to {output_path}")
 
+    # Publishing to the partitioned store (one partition per financial year, only changed partitions are rewritten)
+    with stage('publish', rows_in=len(final_df)):
+        publish(final_df, 'supporting_facilities', org_col='organisation_code')
 
 
+if __name__ == "__main__":
+    # Stages can be run on their own (used by pipeline.py):
+    #   --stage append : build supporting-facilities.csv from the raw files (non-interactive, incremental)
+    #   --stage clean  : build supporting-facilities_clean.csv from supporting-facilities.csv
+    try:
+        BASE_DIR = Path(__file__).resolve().parent.parent
+    except NameError:
+        BASE_DIR = Path.cwd()
+    SF_DATA_DIR = os.getenv("SF_DATA_DIR", BASE_DIR / "data" / "supporting-facilities")
+    build_stage = sys.argv[sys.argv.index('--stage') + 1] if '--stage' in sys.argv else None
+
+    # Timings, memory and row counts of every stage go to a JSON run report (see instrument.py)
+    with instrumented_run('supporting-facilities' + (f'-{build_stage}' if build_stage else '')):
+        if build_stage == 'clean':
+            appended_path = os.path.join(SF_DATA_DIR, 'supporting-facilities.csv')
+            with stage('read_appended', bytes_in=file_bytes(appended_path)) as s:
+                appended = read_appended(appended_path)
+                s['rows_out'] = len(appended)
+            datasets = {'appended': appended}
+        else:
+            datasets = main(incremental=build_stage == 'append')
+        # A stage that produced nothing exits with 1, so pipeline.py does not record it as run
+        failed = build_stage == 'append' and not datasets
+
+        if build_stage != 'append' and datasets and 'appended' in datasets:
+            with stage('clean_dataset', rows_in=len(datasets['appended'])) as s:
+                final_df = clean_dataset(datasets['appended'])
+                s['rows_out'] = len(final_df) if final_df is not None else 0
+            if final_df is not None:
+                save_clean_dataset(final_df, SF_DATA_DIR)
+            failed = failed or final_df is None
+    if failed:
+        sys.exit(1)
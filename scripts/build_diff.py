@@ -0,0 +1,261 @@
+##########################################
+
+# This python script reports what changed in a series between two builds, e.g. after the NHS republished files
+# Every row is keyed on (organisation, period) (plus the extra key columns of the series, and the occurrence
+# number for keys that repeat) and every cell is hashed, one vectorised hash per column. A build is kept as a
+# snapshot of these hashes, so the next build is compared without keeping the old data:
+# - added and removed rows (keys only in the new or the old build)
+# - changed rows, with the columns whose value changed
+# - columns added or removed
+# Snapshots and change logs are kept in rawdata/.build-state/diffs/<series>/ (snapshot.parquet, changes-<time>.json)
+# Usage:
+#   python build_diff.py                        diff every series with its last snapshot and update the snapshots
+#   python build_diff.py supporting_facilities  one series
+#   python build_diff.py --old old.csv --new new.csv    two csvs, with old/new values (keyed on their organisation
+#                                                       column and the period, or on --keys)
+#   python build_diff.py rtt_provider --old old.csv --new new.csv    two csvs keyed on the key columns of a series
+# A series whose source (store partitions or csv) is unchanged since its last snapshot is not read again
+
+##########################################
+
+
+### LIBRARIES
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from pandas.util import hash_array
+from dataset_store import SERIES, STORE_DIR, load_manifest # built series
+from loader import read_source, source_signature # series from the store or its csv
+from periods import add_period_key, period_label # integer period keys
+from instrument import instrumented_run, stage # per-stage run report
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+DIFF_DIR = Path(os.getenv("DIFF_DIR", BASE_DIR / "rawdata" / ".build-state" / "diffs"))
+# Key columns besides (organisation, period), for series with several rows per organisation and period
+EXTRA_KEYS = {
+    'rtt_provider': ['pathway', 'treatment_function_code'],
+}
+MAX_LISTED_ROWS = 500  # changed, added and removed rows listed in a change log (all are counted)
+KEY_HASH = '_key'
+HASH_PREFIX = 'h:'
+UNCHANGED = 'unchanged'  # diff_series result for a series whose source did not change since its snapshot
+
+
+### FUNCTIONS
+def key_columns(series, store_dir=STORE_DIR):
+    """Key columns of a series: its organisation column (as published in the store), the period and its extra keys."""
+    org_col = load_manifest(store_dir)['series'].get(series, {}).get('org_col', SERIES[series][1])
+    return [org_col, 'period'] + EXTRA_KEYS.get(series, [])
+
+
+def csv_keys(df):
+    """Key columns of a csv of some series: the first organisation column of the series it has, and the period."""
+    org_cols = [col for col in dict.fromkeys(org_col for _, org_col in SERIES.values()) if col in df.columns]
+    if not org_cols:
+        raise KeyError("No organisation column of a series in the csv, use --keys")
+    return [org_cols[0], 'period']
+
+
+def hash_column(values):
+    """
+    uint64 hash of every value of a column. Numbers are hashed as float64 and everything else as text, so 3 and 3.0
+    (an int column that gained a missing value) hash the same; missing values hash as ''.
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return hash_array(values.to_numpy(dtype=np.float64, na_value=np.nan))
+    text = values.astype(str).where(values.notna(), '')
+    return hash_array(text.to_numpy(dtype=object))
+
+
+def row_keys(df, keys):
+    """One uint64 per row from the key columns and the occurrence number of the key (0 for unique keys)."""
+    key_frame = df[keys].astype(str).where(df[keys].notna(), '')
+    key_frame = key_frame.assign(_occurrence=key_frame.groupby(keys, sort=False).cumcount())
+    return pd.util.hash_pandas_object(key_frame, index=False).to_numpy()
+
+
+def snapshot(df, keys):
+    """Keys and cell hashes of a build: the key columns, the row key hash and one hash column per value column."""
+    values = [col for col in df.columns if col not in keys]
+    out = {key: df[key].to_numpy(dtype=np.int32) if key == 'period'
+           else df[key].astype(str).where(df[key].notna(), '').to_numpy() for key in keys}
+    out[KEY_HASH] = row_keys(df, keys)
+    out.update({f'{HASH_PREFIX}{col}': hash_column(df[col]) for col in values})
+    return pd.DataFrame(out)
+
+
+def _records(snap, keys, rows):
+    """Key values of some rows of a snapshot, as dicts (periods as labels, e.g. '2010-06')."""
+    columns = [period_label(snap[key].to_numpy()[rows]) if key == 'period' else snap[key].to_numpy()[rows].tolist()
+               for key in keys]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def compare(old, new):
+    """
+    Alignment of two snapshots through their key hashes (one hash lookup): the columns in both, the position in
+    the old build of every new row (-1 for added rows), the removed old rows, and the (matched new rows x common
+    columns) matrix of differing cells.
+    """
+    old_cols = [c[len(HASH_PREFIX):] for c in old.columns if c.startswith(HASH_PREFIX)]
+    common = [c[len(HASH_PREFIX):] for c in new.columns if c.startswith(HASH_PREFIX) and c[len(HASH_PREFIX):] in old_cols]
+    old_index = pd.Index(old[KEY_HASH].to_numpy()).get_indexer(new[KEY_HASH].to_numpy())
+    removed = np.flatnonzero(~np.isin(old[KEY_HASH].to_numpy(), new[KEY_HASH].to_numpy()))
+    hash_cols = [f'{HASH_PREFIX}{c}' for c in common]
+    matched = old_index >= 0
+    differs = new[hash_cols].to_numpy()[matched] != old[hash_cols].to_numpy()[old_index[matched]]
+    return common, old_index, removed, differs
+
+
+def diff_snapshots(old, new, keys, limit=MAX_LISTED_ROWS):
+    """
+    Compare two snapshots: rows added and removed, rows whose value hashes differ with the changed columns, and
+    columns added or removed. Only the columns in both builds are compared.
+    """
+    common, old_index, removed, differs = compare(old, new)
+    matched = np.flatnonzero(old_index >= 0)
+    added = np.flatnonzero(old_index < 0)
+    changed_rows = np.flatnonzero(differs.any(axis=1))
+    changed = _records(new, keys, matched[changed_rows[:limit]])
+    for record, row in zip(changed, changed_rows):
+        record['columns'] = [common[j] for j in np.flatnonzero(differs[row])]
+    old_cols = [c[len(HASH_PREFIX):] for c in old.columns if c.startswith(HASH_PREFIX)]
+    new_cols = [c[len(HASH_PREFIX):] for c in new.columns if c.startswith(HASH_PREFIX)]
+    return {
+        'rows_old': int(len(old)), 'rows_new': int(len(new)),
+        'added': int(len(added)), 'removed': int(len(removed)), 'changed': int(len(changed_rows)),
+        'unchanged': int(len(matched) - len(changed_rows)),
+        'columns_added': [c for c in new_cols if c not in old_cols],
+        'columns_removed': [c for c in old_cols if c not in new_cols],
+        'changed_by_column': {common[j]: int(n) for j, n in enumerate(differs.sum(axis=0)) if n},
+        'added_rows': _records(new, keys, added[:limit]),
+        'removed_rows': _records(old, keys, removed[:limit]),
+        'changed_rows': changed,
+    }
+
+
+def diff_frames(old_df, new_df, keys, limit=MAX_LISTED_ROWS):
+    """Diff of two builds held in memory, with the old and new values of the changed cells of the listed rows."""
+    old_df, new_df = old_df.reset_index(drop=True), new_df.reset_index(drop=True)
+    for df in (old_df, new_df):
+        if 'period' in keys and 'period' not in df.columns:
+            add_period_key(df)
+    old, new = snapshot(old_df, keys), snapshot(new_df, keys)
+    report = diff_snapshots(old, new, keys, limit)
+    _, old_index, _, differs = compare(old, new)
+    matched = np.flatnonzero(old_index >= 0)
+    changed_rows = np.flatnonzero(differs.any(axis=1))[:limit]
+    for record, row in zip(report['changed_rows'], matched[changed_rows]):
+        record['values'] = {col: [_plain(old_df.at[old_index[row], col]), _plain(new_df.at[row, col])]
+                            for col in record['columns']}
+    return report
+
+
+def _plain(value):
+    """JSON-friendly scalar."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def load_build(series):
+    """Current build of a series as a DataFrame, with its period key."""
+    df = read_source(series).to_pandas()
+    if 'period' not in df.columns:
+        add_period_key(df)
+    return df
+
+
+def diff_series(series, diff_dir=DIFF_DIR, limit=MAX_LISTED_ROWS):
+    """
+    Diff the current build of a series with its last snapshot, write the change log and the new snapshot.
+    Returns the report, None on the first run (no snapshot to compare with), or UNCHANGED when the source of the
+    series has the signature it had at the last snapshot (nothing is read).
+    """
+    keys = key_columns(series)
+    series_dir = Path(diff_dir) / series
+    snapshot_path = series_dir / 'snapshot.parquet'
+    signature_path = series_dir / 'source_signature'
+    signature = source_signature(series)
+    if snapshot_path.exists() and signature_path.exists() and signature_path.read_text() == signature:
+        return UNCHANGED
+    new = snapshot(load_build(series), keys)
+    report = None
+    if snapshot_path.exists():
+        report = diff_snapshots(pd.read_parquet(snapshot_path), new, keys, limit)
+        if report['added'] or report['removed'] or report['changed'] or report['columns_added'] \
+                or report['columns_removed']:
+            stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+            with open(series_dir / f'changes-{stamp}.json', 'w') as f:
+                json.dump({'series': series, 'keys': keys, **report}, f, indent=1, default=str)
+    series_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = series_dir / 'snapshot.parquet.tmp'
+    new.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, snapshot_path)
+    signature_path.write_text(signature)
+    return report
+
+
+def print_report(series, report):
+    if report is None:
+        print(f"{series:<30} first snapshot")
+        return
+    if report == UNCHANGED:
+        print(f"{series:<30} source unchanged since the last snapshot")
+        return
+    print(f"{series:<30} {report['rows_new']:>9,} rows: {report['added']:>6,} added {report['removed']:>6,} removed "
+          f"{report['changed']:>6,} changed" + (f", columns added {report['columns_added']}" if report['columns_added'] else "")
+          + (f", columns removed {report['columns_removed']}" if report['columns_removed'] else ""))
+    for col, n in sorted(report['changed_by_column'].items(), key=lambda item: -item[1]):
+        print(f"    {col}: {n:,} rows")
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rows and cells changed between two builds of a series")
+    parser.add_argument('series', nargs='*',
+                        help="series to diff with their last snapshot (default: all); with --old/--new, the series "
+                             "whose key columns are used")
+    parser.add_argument('--old', type=Path, help="old csv, to diff two files instead of snapshots")
+    parser.add_argument('--new', type=Path, help="new csv")
+    parser.add_argument('--keys', nargs='+', help="key columns of the csvs (default: their organisation column "
+                                                   "and the period)")
+    parser.add_argument('--output', type=Path, help="write the report of --old/--new as JSON")
+    with instrumented_run('build-diff'):
+        args = parser.parse_args(argv)
+        if args.old or args.new:
+            if not (args.old and args.new):
+                parser.error("--old and --new go together")
+            if len(args.series) > 1 or (args.series and args.series[0] not in SERIES):
+                parser.error(f"give one series for the key columns of --old/--new, any of {list(SERIES)}")
+            old_df, new_df = pd.read_csv(args.old), pd.read_csv(args.new)
+            keys = args.keys or (key_columns(args.series[0]) if args.series else csv_keys(new_df))
+            report = diff_frames(old_df, new_df, keys)
+            print_report(args.new.name, report)
+            if args.output:
+                args.output.write_text(json.dumps(report, indent=1, default=str))
+            return report
+        reports = {}
+        for series in args.series or SERIES:
+            with stage('diff', file=series) as s:
+                try:
+                    reports[series] = diff_series(series)
+                except (FileNotFoundError, KeyError) as e:
+                    print(f"Skipping {series}: {e}")
+                    continue
+                s['rows_in'] = reports[series]['rows_new'] if isinstance(reports[series], dict) else None
+            print_report(series, reports[series])
+        return reports
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+##########################################
+
+# This python script checks the coverage of every built series: which organisations are there in which periods
+# For each series an (organisation x period) presence matrix is filled with one scatter of the integer keys, and
+# the rows per period with one bincount. From these it reports:
+# - missing periods: periods of the expected cadence (quarterly, monthly, ...) without any row, and rows in
+#   periods off the cadence
+# - intermittent organisations: organisations absent in periods between their first and last one (periods that
+#   are missing for the whole series are not counted against them)
+# - row count anomalies: periods whose number of rows differs from the median of the neighbouring periods by more
+#   than ANOMALY_THRESHOLD
+# The report is written as one compact JSON file (rawdata/.build-state/reports/coverage.json) and summarised on
+# screen, so a nightly build can be checked without reading its console output
+# Usage:
+#   python coverage_report.py                        every series in the store or data/
+#   python coverage_report.py beds_2010_24 --strict  exit with 1 when a series has missing periods or anomalies
+
+##########################################
+
+
+### LIBRARIES
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from dataset_store import DATA_DIR, STORE_DIR, SERIES, load_manifest, read # partitioned dataset store
+from periods import MISSING_PERIOD, add_period_key, month_ordinal, period_label # integer period keys
+from instrument import instrumented_run, stage # per-stage run report
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+REPORT_PATH = Path(os.getenv("COVERAGE_REPORT", BASE_DIR / "rawdata" / ".build-state" / "reports" / "coverage.json"))
+# Expected cadence of each series in months, as [(first period (year, month), months between periods), ...]
+# Series not listed get the most common step between their periods
+CADENCE = {
+    'supporting_facilities': [((2003, 1), 3)],
+    'supporting_facilities_org_adj': [((2003, 1), 3)],
+    'beds_2000_10': [((2000, 1), 12)],
+    'beds_2010_24': [((2010, 1), 3)],
+    'critical_care_beds': [((2002, 1), 6), ((2010, 8), 1)],  # half-yearly snapshots, monthly SitReps from 2010
+    'rtt_provider': [((2007, 1), 1)],
+    'critical_care_sitrep': [((2010, 1), 1)],
+}
+PERIOD_COLUMNS = ['period', 'period_end', 'date', 'year_var', 'quarter_var', 'year', 'quarter']
+ANOMALY_THRESHOLD = 0.25  # relative difference from the neighbours' median row count
+ANOMALY_WINDOW = 5  # periods in the centred window of neighbours (the period itself excluded)
+MAX_LISTED_ORGS = 20  # intermittent organisations listed in the report (all are counted)
+
+
+### FUNCTIONS
+def load_keys(series, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Organisation codes and period keys of a series, from the store or else from its csv."""
+    org_col = SERIES[series][1]
+    manifest = load_manifest(store_dir)
+    if series in manifest['series'] and manifest['series'][series]['partitions']:
+        df = read(series, columns=[org_col], store_dir=store_dir)
+    else:
+        if SERIES[series][0] is None:
+            raise FileNotFoundError(f"Series '{series}' is built straight into the store and is not in {store_dir}")
+        csv_path = Path(data_dir) / SERIES[series][0]
+        header = pd.read_csv(csv_path, nrows=0).columns
+        df = pd.read_csv(csv_path, usecols=[org_col] + [c for c in PERIOD_COLUMNS if c in header],
+                         dtype={org_col: str}, low_memory=False)
+        if 'period' not in df.columns:
+            add_period_key(df)
+    return df[org_col].astype(str).to_numpy(), df['period'].to_numpy(dtype=np.int32)
+
+
+def expected_periods(observed, cadence=None):
+    """
+    Periods expected between the first and last observed period. Each cadence segment starts at its first observed
+    period and steps by its number of months up to the next segment (or the last observed period).
+    """
+    observed = np.unique(observed[observed != MISSING_PERIOD])
+    if len(observed) == 0:
+        return observed
+    if cadence is None:
+        steps = np.diff(observed)
+        cadence = [((0, 1), int(pd.Series(steps).mode().min()) if len(steps) else 1)]
+    starts = [month_ordinal(*start) for start, _ in cadence] + [observed[-1] + 1]
+    grid = []
+    for i, (_, step) in enumerate(cadence):
+        in_segment = observed[(observed >= starts[i]) & (observed < starts[i + 1])]
+        if len(in_segment):
+            end = starts[i + 1] if i + 1 < len(cadence) else observed[-1] + 1
+            grid.append(np.arange(in_segment[0], end, step, dtype=np.int32))
+    return np.concatenate(grid) if grid else observed
+
+
+def presence_matrix(orgs, periods, columns):
+    """
+    Boolean (organisation x period) matrix with one scatter of the (organisation, period) indexes, the organisation
+    codes of its rows, and the number of rows in each period column.
+    """
+    org_index, codes = pd.factorize(orgs, sort=True)
+    period_index = np.searchsorted(columns, periods)
+    matrix = np.zeros((len(codes), len(columns)), dtype=bool)
+    matrix[org_index, period_index] = True
+    return matrix, np.asarray(codes), np.bincount(period_index, minlength=len(columns))
+
+
+def intermittent_orgs(matrix, codes, columns, period_present):
+    """Organisations absent in periods between their first and last one, with their gaps, most gaps first."""
+    n_periods = matrix.shape[1]
+    if matrix.size == 0:
+        return []
+    first = matrix.argmax(axis=1)
+    last = n_periods - 1 - matrix[:, ::-1].argmax(axis=1)
+    position = np.arange(n_periods)
+    within = (position >= first[:, None]) & (position <= last[:, None])
+    holes = within & ~matrix & period_present  # periods missing for everyone are reported as missing periods
+    n_holes = holes.sum(axis=1)
+    # A spell of absence starts where an organisation is present and absent in the next period with data
+    present = matrix[:, period_present]
+    spells = (present[:, :-1] & ~present[:, 1:] & holes[:, period_present][:, 1:]).sum(axis=1)
+    rows = []
+    for i in np.flatnonzero(n_holes)[np.argsort(-n_holes[n_holes > 0], kind='stable')]:
+        rows.append({'org': str(codes[i]), 'first': columns[first[i]], 'last': columns[last[i]],
+                     'present': int(matrix[i].sum()), 'absent': int(n_holes[i]), 'spells': int(spells[i])})
+    return rows
+
+
+def row_count_anomalies(counts, threshold=ANOMALY_THRESHOLD, window=ANOMALY_WINDOW):
+    """
+    Periods whose row count differs from the median of their neighbours (periods with rows only, the period
+    itself excluded) by more than threshold, as {column index: (rows, neighbours' median)}.
+    """
+    index = np.flatnonzero(counts)
+    values = counts[index].astype(float)
+    half = window // 2
+    anomalies = {}
+    for j in range(len(values)):
+        neighbours = np.concatenate([values[max(0, j - half):j], values[j + 1:j + 1 + half]])
+        if len(neighbours) < 2:
+            continue
+        median = float(np.median(neighbours))
+        if median and abs(values[j] - median) / median > threshold:
+            anomalies[int(index[j])] = (int(values[j]), median)
+    return anomalies
+
+
+def series_coverage(orgs, periods, cadence=None, threshold=ANOMALY_THRESHOLD):
+    """Coverage report of one series from its organisation codes and period keys."""
+    orgs, periods = np.asarray(orgs), np.asarray(periods, dtype=np.int32)
+    keyed = periods != MISSING_PERIOD
+    expected = expected_periods(periods, cadence)
+    columns = np.union1d(expected, periods[keyed]).astype(np.int32)
+    matrix, codes, counts = presence_matrix(orgs[keyed], periods[keyed], columns)
+    on_grid = np.isin(columns, expected)
+    labels = period_label(columns)
+    anomalies = row_count_anomalies(counts, threshold)
+    return {
+        'rows': int(len(periods)), 'rows_without_period': int((~keyed).sum()), 'organisations': int(len(codes)),
+        'first_period': labels[0] if len(labels) else None, 'last_period': labels[-1] if len(labels) else None,
+        'periods_expected': int(on_grid.sum()), 'periods_with_data': int((counts > 0).sum()),
+        'missing_periods': [labels[i] for i in np.flatnonzero(on_grid & (counts == 0))],
+        'off_cadence_periods': [labels[i] for i in np.flatnonzero(~on_grid)],
+        'intermittent_orgs': intermittent_orgs(matrix, codes, labels, counts > 0),
+        'row_count_anomalies': [{'period': labels[i], 'rows': rows, 'neighbours_median': median}
+                                for i, (rows, median) in anomalies.items()],
+    }
+
+
+def check_frame(df, series, org_col=None):
+    """Coverage of a series still in memory (e.g. before it is written), printed as the summary."""
+    org_col = org_col or SERIES[series][1]
+    report = compact({series: series_coverage(df[org_col].astype(str), df['period'], CADENCE.get(series))})
+    print_summary(report)
+    return report[series]
+
+
+def coverage_report(series_names=None, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Coverage of each series found in the store or data/ (all series by default), skipping missing ones."""
+    report = {}
+    for series in series_names or SERIES:
+        with stage('coverage', file=series) as s:
+            try:
+                orgs, periods = load_keys(series, data_dir, store_dir)
+            except (FileNotFoundError, KeyError) as e:
+                print(f"Skipping {series}: {e}")
+                continue
+            s['rows_in'] = len(periods)
+            report[series] = series_coverage(orgs, periods, CADENCE.get(series))
+    return report
+
+
+def compact(report, max_orgs=MAX_LISTED_ORGS):
+    """Report with the intermittent organisations counted and only the first max_orgs listed."""
+    out = {}
+    for series, r in report.items():
+        orgs = r['intermittent_orgs']
+        out[series] = {**r, 'intermittent_orgs': len(orgs), 'intermittent_orgs_listed': orgs[:max_orgs]}
+    return out
+
+
+def has_issues(r):
+    """Whether a series report has missing periods, off-cadence periods or row count anomalies."""
+    return bool(r['missing_periods'] or r['off_cadence_periods'] or r['row_count_anomalies'])
+
+
+def print_summary(report):
+    """One line per series, then the missing periods and anomalies."""
+    print(f"\n{'series':<30} {'rows':>9} {'orgs':>6} {'first':>8} {'last':>8} {'periods':>9} {'missing':>8} "
+          f"{'off':>4} {'intermit':>9} {'anomalies':>10}")
+    for series, r in report.items():
+        n_orgs = r['intermittent_orgs'] if isinstance(r['intermittent_orgs'], int) else len(r['intermittent_orgs'])
+        print(f"{series:<30} {r['rows']:>9,} {r['organisations']:>6} {r['first_period'] or '':>8} "
+              f"{r['last_period'] or '':>8} {r['periods_with_data']:>4}/{r['periods_expected']:<4} "
+              f"{len(r['missing_periods']):>8} {len(r['off_cadence_periods']):>4} {n_orgs:>9} "
+              f"{len(r['row_count_anomalies']):>10}")
+    for series, r in report.items():
+        if r['missing_periods']:
+            print(f"{series}: missing periods {', '.join(r['missing_periods'])}")
+        if r['off_cadence_periods']:
+            print(f"{series}: periods off the cadence {', '.join(r['off_cadence_periods'])}")
+        for a in r['row_count_anomalies']:
+            print(f"{series}: {a['period']} has {a['rows']} rows, neighbours {a['neighbours_median']:g}")
+
+
+def save_report(report, path=REPORT_PATH):
+    """Write the compact report as JSON."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coverage and period-gap report of the built series")
+    parser.add_argument('series', nargs='*', help="series to check (default: all)")
+    parser.add_argument('--output', type=Path, default=REPORT_PATH)
+    parser.add_argument('--strict', action='store_true',
+                        help="exit with 1 when a series has missing or off-cadence periods or row count anomalies")
+    with instrumented_run('coverage'):
+        args = parser.parse_args(argv)
+        unknown = [s for s in args.series if s not in SERIES]
+        if unknown:
+            parser.error(f"unknown series {unknown}, use any of {list(SERIES)}")
+        report = compact(coverage_report(args.series))
+        print_summary(report)
+        print(f"\nCoverage report saved to {save_report(report, args.output)}")
+    if args.strict and any(has_issues(r) for r in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
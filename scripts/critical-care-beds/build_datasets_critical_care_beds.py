@@ -0,0 +1,256 @@
+##########################################
+
+# This python script builds the monthly critical care SitRep files (downloaded by
+# extract_critical_care_beds_after_2010.py) into the partitioned store: data/store/critical_care_sitrep/ym=<YYYY-MM>/
+# - the files are read in a process pool, one file per worker
+# - the column names, which change over the years (one-row headers in 2010-11, then headers grouped under
+#   'Number of critical care beds open/occupied' and '% occupied'), are normalised to the published schema of
+#   critical_care_beds_2002_20_clean.csv (number_of_adult_critical_care_beds_open, ..._occupied,
+#   adult_critical_care_beds_percent_occupied, ...)
+# - the occupancy ratios are recomputed from the bed counts for all rows at once (NA when no beds are open)
+# - only months whose file is new or changed are read and written, so a new month is appended on its own
+#   (--full rebuilds every month and drops months whose file is gone)
+# The organisation change adjustment of the published csv is done by panel.remap_org_changes (or the R script)
+# Usage:
+#   python scripts/critical-care-beds/build_datasets_critical_care_beds.py [--workers 4] [--full]
+
+##########################################
+
+
+### LIBRARIES
+# pip install pyarrow, pip install python-calamine (faster sheet reading, optional)
+import argparse
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # shared modules in scripts/
+import numpy as np
+import pandas as pd
+from excel_backends import read_excel # Excel parsing backends with per-file fallback
+from periods import MONTHS, month_ordinal # integer period keys
+from dataset_store import STORE_DIR, load_manifest, register_partitions, content_hash, partition_stats # partitioned store
+from instrument import instrumented_run, stage # per-stage run report
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+RAW_DATA_DIR = Path(os.getenv("RAW_DATA_DIR", BASE_DIR / "rawdata" / "critical-care-beds" / "after-2010"))
+SERIES_NAME = 'critical_care_sitrep'
+SHEET_NAME = 'Critical Care Beds'
+WORKERS = int(os.getenv("CRITICAL_CARE_WORKERS", min(4, os.cpu_count() or 1)))
+HEADER_SEARCH_ROWS = 30
+CARE_TYPES = {'adult': 'adult_critical_care_beds', 'paediatric': 'paediatric_intensive_care_beds',
+              'neonatal': 'neonatal_critical_care_cots_or_beds'}
+TRANSFERS = 'number_of_non_medical_critical_care_transfers'
+# Published column order
+VALUE_COLUMNS = ([f'number_of_{t}_open' for t in CARE_TYPES.values()]
+                 + [f'number_of_{t}_occupied' for t in CARE_TYPES.values()]
+                 + [f'{t}_percent_occupied' for t in CARE_TYPES.values()] + [TRANSFERS])
+ORG_CODE_NAMES = {'org_code', 'code', 'org_id', 'organisation_code', 'provider_code'}
+ORG_NAME_NAMES = {'org_name', 'name', 'organisation_name', 'provider_name'}
+
+
+### FUNCTIONS
+def file_month(filename):
+    """
+    (year, month) of a file from the month name and the financial year (e.g. August_2010-11) or calendar year
+    in its name, or None.
+    """
+    month = re.search(r'(January|February|March|April|May|June|July|August|September|October|November|December)',
+                      filename, re.IGNORECASE)
+    if not month:
+        return None
+    month = MONTHS[month.group(1).lower()]
+    fy = re.search(r'(20\d{2})-\d{2}', filename)
+    if fy:
+        return int(fy.group(1)) + (month < 4), month
+    year = re.search(r'(20\d{2})', filename)
+    return (int(year.group(1)), month) if year else None
+
+
+def find_files(raw_dir=RAW_DATA_DIR):
+    """Monthly files as {(year, month): path}; England summary files are skipped (as in the R script)."""
+    months = {}
+    for path in sorted(Path(raw_dir).rglob('*')):
+        if path.suffix.lower() not in ('.xls', '.xlsx') or 'England' in path.name:
+            continue
+        month = file_month(path.name)
+        if month is not None:
+            months[month] = path
+    return months
+
+
+def file_signature(path):
+    """Cheap fingerprint of a raw file: size and modification time."""
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def partition_name(year, month):
+    """Partition of one month, e.g. ym=2013-04 (not month=, which hive discovery would clash with the month column)."""
+    return f'ym={year}-{month:02d}'
+
+
+def clean_name(name):
+    """janitor::make_clean_names for one header cell."""
+    name = str(name).strip().lower().replace('%', ' percent ')
+    return re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+
+
+def canonical_column(label):
+    """
+    Published name of a column from its (group and) header text, e.g. 'number of critical care beds occupied
+    adult' -> number_of_adult_critical_care_beds_occupied. None for columns that are not kept.
+    """
+    name = clean_name(label)
+    if name in ORG_CODE_NAMES:
+        return 'org_code'
+    if name in ORG_NAME_NAMES:
+        return 'org_name'
+    if 'transfer' in name:
+        return TRANSFERS
+    care_type = next((column for key, column in CARE_TYPES.items() if key in name), None)
+    if care_type is None:
+        return None
+    if 'percent' in name or 'occupancy' in name:
+        return f'{care_type}_percent_occupied'
+    if 'occupied' in name:
+        return f'number_of_{care_type}_occupied'
+    if 'open' in name or 'available' in name:
+        return f'number_of_{care_type}_open'
+    return None
+
+
+def header_labels(raw, header_row):
+    """
+    Labels of the header columns: the header cell, prefixed with the group label of the row above where the
+    header is grouped (group labels span several columns, so they are carried to the right).
+    """
+    header = raw.iloc[header_row]
+    group = raw.iloc[header_row - 1] if header_row > 0 else pd.Series([None] * len(header), index=header.index)
+    if group.notna().sum() < 2:  # a title or blank line, not a grouped header
+        group = pd.Series([None] * len(header), index=header.index)
+    group = group.ffill()
+    return [' '.join(str(part) for part in (g, h) if pd.notna(part)) for g, h in zip(group, header)]
+
+
+def find_header_row(raw):
+    """Row with the organisation code and name headers."""
+    for i in range(min(HEADER_SEARCH_ROWS, len(raw))):
+        names = {clean_name(cell) for cell in raw.iloc[i] if pd.notna(cell)}
+        if names & ORG_CODE_NAMES and names & ORG_NAME_NAMES:
+            return i
+    raise ValueError("No header row with organisation code and name")
+
+
+def read_month(path, year, month):
+    """Worker: read one monthly file into the published columns (values as read, ratios not yet computed)."""
+    raw = read_excel(path, sheet_name=SHEET_NAME, header=None)
+    header_row = find_header_row(raw)
+    columns = {}
+    for position, label in enumerate(header_labels(raw, header_row)):
+        name = canonical_column(label)
+        if name is not None and name not in columns:
+            columns[name] = position
+    missing = [name for name in ['org_code', 'org_name'] if name not in columns]
+    if missing:
+        raise ValueError(f"{path.name}: no {', '.join(missing)} column")
+    df = raw.iloc[header_row + 1:, list(columns.values())]
+    df.columns = list(columns)
+    df = df[df['org_code'].notna() & df['org_name'].notna()].reset_index(drop=True)
+    return df.reindex(columns=['org_code', 'org_name'] + VALUE_COLUMNS), sorted(set(VALUE_COLUMNS) - set(columns))
+
+
+def finalise(df, year, month):
+    """Types, names and date columns of the published csv, and the occupancy ratios recomputed from the counts."""
+    df = df.copy()
+    df['org_code'] = df['org_code'].astype(str).str.strip()
+    df['org_name'] = df['org_name'].astype(str).str.strip().str.upper().str.replace('PRIMARY CARE TRUST', 'PCT')
+    df[VALUE_COLUMNS] = df[VALUE_COLUMNS].apply(pd.to_numeric, errors='coerce').astype('float64')
+    for care_type in CARE_TYPES.values():
+        opened = df[f'number_of_{care_type}_open'].to_numpy()
+        occupied = df[f'number_of_{care_type}_occupied'].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[f'{care_type}_percent_occupied'] = np.where(opened > 0, occupied / opened, np.nan)
+    month_name = pd.Timestamp(year, month, 1).month_name()
+    df.insert(2, 'date', f'{year}-{month:02d}-01')
+    df.insert(3, 'month', month_name)
+    df.insert(4, 'year', year)
+    df.insert(5, 'period', np.int32(month_ordinal(year, month)))
+    return df
+
+
+def write_partition(df, year, month, source, series_dir):
+    """Write one month and return its manifest entry."""
+    name = partition_name(year, month)
+    part_dir = Path(series_dir) / name
+    part_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = part_dir / 'part.parquet.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, part_dir / 'part.parquet')
+    return name, {'path': f'{name}/part.parquet', 'fy': year - (month < 4), 'month': f'{year}-{month:02d}',
+                  'hash': content_hash(df), **partition_stats(df, 'org_code'), 'source': source.name,
+                  'source_signature': file_signature(source)}
+
+
+def build(raw_dir=RAW_DATA_DIR, store_dir=STORE_DIR, workers=WORKERS, full=False):
+    """Read the new or changed months in a process pool and write them into the store."""
+    months = find_files(raw_dir)
+    partitions = load_manifest(store_dir)['series'].get(SERIES_NAME, {}).get('partitions', {})
+    todo = {key: path for key, path in months.items()
+            if full or partitions.get(partition_name(*key), {}).get('source_signature') != file_signature(path)}
+    # Partitions named month=<YYYY-MM> by earlier builds are replaced by their ym= partition
+    removed = sorted(name for name in partitions if name.startswith('month=')
+                     or (full and name not in {partition_name(*key) for key in months}))
+    print(f"{len(months)} monthly files, {len(todo)} to build")
+    if removed:
+        register_partitions(SERIES_NAME, {}, 'org_code', remove=removed, store_dir=store_dir)
+        print(f"Removed {len(removed)} partitions (months whose file is gone or named month= by earlier builds)")
+
+    series_dir = Path(store_dir) / SERIES_NAME
+    entries, columns, failed = {}, {}, []
+    with stage('read_months', files=len(todo), workers=workers) as s:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as pool:
+            futures = {pool.submit(read_month, path, *key): key for key, path in sorted(todo.items())}
+            for future in as_completed(futures):
+                year, month = futures[future]
+                try:
+                    df, missing = future.result()
+                except Exception as e:
+                    failed.append(f"{year}-{month:02d}: {type(e).__name__}: {e}")
+                    print(f"Failed {year}-{month:02d}: {e}")
+                    continue
+                df = finalise(df, year, month)
+                columns.update({col: str(dtype) for col, dtype in df.dtypes.items()})  # of every month written
+                name, entry = write_partition(df, year, month, todo[(year, month)], series_dir)
+                entries[name] = entry
+                print(f"Built {year}-{month:02d}: {len(df)} organisations"
+                      + (f" (no {', '.join(missing)} columns)" if missing else ""))
+        s['rows_out'] = sum(e['rows'] for e in entries.values())
+        s['failed'] = len(failed)
+    if entries:
+        register_partitions(SERIES_NAME, entries, 'org_code', columns, store_dir=store_dir)
+    print(f"Registered {len(entries)} months of {SERIES_NAME}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} months failed: " + "; ".join(failed))
+    return entries
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the monthly critical care SitRep files into the store")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="files read in parallel")
+    parser.add_argument('--full', action='store_true', help="rebuild every month, not only new or changed files")
+    parser.add_argument('--raw-dir', type=Path, default=RAW_DATA_DIR)
+    with instrumented_run('critical-care-beds'):  # takes --profile off the command line first
+        args = parser.parse_args(argv)
+        build(args.raw_dir, STORE_DIR, args.workers, args.full)
+
+
+if __name__ == "__main__":
+    main()
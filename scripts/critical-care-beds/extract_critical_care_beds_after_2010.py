@@ -9,13 +9,13 @@
 
 # pip install selenium
 import os
-import time
 from urllib.parse import urljoin
 from urllib.request import urlopen, Request, URLError
 from bs4 import BeautifulSoup
-import requests
 from pathlib import Path
-from extract_critical_care_beds_webarchive import handle_webarchive_download, setup_chrome_driver  # webarchive functionality
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # shared modules in scripts/
+from download_metrics import DownloadMetrics, fetch # download telemetry
 
 
 ### FUNCTIONS
@@ -69,25 +69,30 @@ def check_downloaded_file(download_dir):
         return None
 
 
-def download_file(url, filename):
+def download_file(url, filename, metrics=None):
     """Download file using Selenium for complex JavaScript-based redirection or direct download."""
     download_dir = os.path.dirname(filename)
+    metrics = metrics if metrics is not None else DownloadMetrics('download')  # records are dropped without a run
     try:
         if 'webarchive' in url or 'web.archive' in url:
             print('This is likely a webarchive URL, using Selenium library...')
-            latest_file = handle_webarchive_download(url, download_dir,
-                                                     check_downloaded_file)  # calling function from different file
-            if latest_file:
-                os.rename(latest_file, filename)
-                print(f"Successfully downloaded and renamed to {filename}")
-                return True
+            with metrics.timed(url, 'selenium') as record:
+                # Imported here so the Selenium/webdriver stack is only loaded when a webarchive file is downloaded
+                from extract_critical_care_beds_webarchive import handle_webarchive_download  # webarchive functionality
+                latest_file = handle_webarchive_download(url, download_dir,
+                                                         check_downloaded_file)  # calling function from different file
+                if latest_file:
+                    os.rename(latest_file, filename)
+                    record['ok'], record['bytes'] = True, os.path.getsize(filename)
+                    print(f"Successfully downloaded and renamed to {filename}")
+                    return True
         else:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             print("Non-webarchive file, direct download method using 'urllib.request' library)...")
-            response = requests.get(url, headers=headers, allow_redirects=True)
-            if response.status_code == 200:
+            response = fetch(url, headers, metrics) # timings, size, status and retries go to the run metrics
+            if response is not None and response.status_code == 200:
                 with open(filename, 'wb') as f:
                     f.write(response.content)
                 print(f"Successfully downloaded {filename}")
@@ -124,7 +129,7 @@ def validate_id_input(selected_files, max_id):
         return None
 
 
-def process_url(dataurl, raw_data_dir):
+def process_url(dataurl, raw_data_dir, metrics):
     """Process a single URL: Extract file links and prompt user for download."""
     failed_downloads = []
 
@@ -171,10 +176,10 @@ def process_url(dataurl, raw_data_dir):
                 continue
 
             print(f"Downloading {filename} ...\n")
-            success = download_file(url, full_path)
+            success = download_file(url, full_path, metrics)
             if not success:
                 failed_downloads.append((id, filename, url))
-            time.sleep(1)
+            metrics.sleep(1)
 
         # Failed downloads report
         if failed_downloads:
@@ -212,8 +217,10 @@ def main():
     ]
     failed_downloads = []  # list of failed downloads
 
+    metrics = DownloadMetrics('critical-care-beds') # download telemetry, summarised at the end of the run
     for url in urls:
-        process_url(url, RAW_DATA_DIR)
+        process_url(url, RAW_DATA_DIR, metrics)
+    metrics.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+##########################################
+
+# This python script publishes the built series into a store partitioned by series and financial year
+# Layout: data/store/<series>/fy=<year>/part.parquet, with data/store/manifest.json recording for every partition
+# its row count, min/max period, number of organisations and a content hash
+# Readers use the manifest to skip partitions, and publishing only rewrites partitions whose content changed
+# Builders that write their partitions themselves (e.g. the RTT builder, one month per worker) record them in the
+# manifest with register_partitions; updates of the manifest are serialised with a lock file
+# Usage:
+#   python dataset_store.py                     publish every built series found in data/
+#   python dataset_store.py beds_2010_24 ...    publish some series (the pipeline leaves out the ones their
+#                                               builder publishes)
+
+##########################################
+
+
+### LIBRARIES
+# pip install pyarrow
+import pandas as pd
+import numpy as np
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import contextlib
+import sys
+from periods import MISSING_PERIOD, add_period_key, period_to_target # integer period keys
+try:
+    import fcntl # manifest lock, not available on Windows
+except ImportError:
+    fcntl = None
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data"))
+STORE_DIR = Path(os.getenv("STORE_DIR", DATA_DIR / "store"))
+
+# Built series: name -> (csv path relative to DATA_DIR, organisation code column)
+# Series without a csv path are built straight into the store
+SERIES = {
+    'supporting_facilities': ('supporting-facilities/supporting-facilities_clean.csv', 'organisation_code'),
+    'supporting_facilities_org_adj': ('supporting-facilities/supporting-facilities_clean_org_change_adj.csv', 'org_code'),
+    'beds_2000_10': ('available-and-occupied-beds/overnight_day_beds_2000_10_clean.csv', 'org_code'),
+    'beds_2010_24': ('available-and-occupied-beds/overnight_day_beds_2010_24_clean.csv', 'org_code'),
+    'critical_care_beds': ('critical-care-beds/critical_care_beds_2002_20_clean.csv', 'org_code'),
+    'rtt_provider': (None, 'org_code'),  # wait-times/build_datasets_wait_times.py, partitioned by pathway and month
+    'critical_care_sitrep': (None, 'org_code'),  # critical-care-beds/build_datasets_critical_care_beds.py, by month
+}
+
+
+### FUNCTIONS
+def load_manifest(store_dir=STORE_DIR):
+    """Load the store manifest, or an empty one if the store does not exist yet."""
+    manifest_path = Path(store_dir) / 'manifest.json'
+    if not manifest_path.exists():
+        return {'series': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, store_dir=STORE_DIR):
+    """Write the manifest atomically so readers never see a half-written file."""
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = store_dir / 'manifest.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, store_dir / 'manifest.json')
+
+
+@contextlib.contextmanager
+def manifest_lock(store_dir=STORE_DIR):
+    """Exclusive lock on the manifest, so concurrent writers (e.g. parallel pipeline stages) do not lose updates."""
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(store_dir / '.manifest.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def partition_name(fy):
+    """Directory name of a financial year partition."""
+    return 'fy=unknown' if fy == MISSING_PERIOD else f'fy={fy}'
+
+
+def content_hash(df):
+    """Hash of the partition content (values and column names), independent of the file encoding."""
+    h = hashlib.sha256()
+    h.update('|'.join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def partition_stats(df, org_col):
+    """Row count, period range and organisation count for one partition."""
+    valid = df['period'][df['period'] != MISSING_PERIOD]
+    return {
+        'rows': int(len(df)),
+        'min_period': int(valid.min()) if len(valid) else MISSING_PERIOD,
+        'max_period': int(valid.max()) if len(valid) else MISSING_PERIOD,
+        'n_orgs': int(df[org_col].nunique()) if org_col in df.columns else 0,
+    }
+
+
+def publish(df, series, org_col='org_code', store_dir=STORE_DIR, replace=True):
+    """
+    Publish a built series into the store, one partition per financial year.
+    Partitions whose content hash is unchanged are left untouched. With replace=True, partitions
+    that are no longer in df are removed (full rebuild), otherwise they are kept (append).
+    """
+    store_dir = Path(store_dir)
+    series_dir = store_dir / series
+    series_dir.mkdir(parents=True, exist_ok=True)
+
+    if 'period' not in df.columns:
+        df = add_period_key(df.copy())
+    periods = df['period'].to_numpy()
+    fy = np.where(periods == MISSING_PERIOD, MISSING_PERIOD, period_to_target(periods, 'financial_year'))
+
+    with manifest_lock(store_dir):
+        manifest = load_manifest(store_dir)
+        entry = manifest['series'].setdefault(series, {'partitions': {}})
+        entry['org_col'] = org_col
+        entry['columns'] = {col: str(dtype) for col, dtype in df.dtypes.items()}
+        partitions = entry['partitions']
+
+        written = []
+        new_names = set()
+        for year in np.unique(fy):
+            part = df[fy == year].reset_index(drop=True)
+            name = partition_name(int(year))
+            new_names.add(name)
+            digest = content_hash(part)
+            if name in partitions and partitions[name]['hash'] == digest and (series_dir / partitions[name]['path']).exists():
+                continue
+            part_dir = series_dir / name
+            part_dir.mkdir(exist_ok=True)
+            tmp_path = part_dir / 'part.parquet.tmp'
+            part.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, part_dir / 'part.parquet')
+            partitions[name] = {'path': f'{name}/part.parquet', 'fy': int(year), 'hash': digest,
+                                **partition_stats(part, org_col)}
+            written.append(name)
+
+        if replace:
+            for name in sorted(set(partitions) - new_names):
+                shutil.rmtree(series_dir / name, ignore_errors=True)
+                del partitions[name]
+
+        entry['rows'] = sum(p['rows'] for p in partitions.values())
+        save_manifest(manifest, store_dir)
+    print(f"Published {series}: {len(written)} of {len(new_names)} partitions written")
+    return written
+
+
+def register_partitions(series, partitions, org_col='org_code', columns=None, remove=(), store_dir=STORE_DIR):
+    """
+    Record partitions written outside publish in the manifest. partitions maps partition name -> entry with
+    'path' (relative to the series folder), 'fy', 'hash' and the partition_stats fields. columns ({name: dtype})
+    are added to the columns of the series. Partitions named in remove are deleted.
+    """
+    series_dir = Path(store_dir) / series
+    with manifest_lock(store_dir):
+        manifest = load_manifest(store_dir)
+        entry = manifest['series'].setdefault(series, {'partitions': {}})
+        entry['org_col'] = org_col
+        entry['columns'] = {**entry.get('columns', {}), **(columns or {})}
+        entry['partitions'].update(partitions)
+        for name in remove:
+            if name in entry['partitions']:
+                shutil.rmtree((series_dir / entry['partitions'].pop(name)['path']).parent, ignore_errors=True)
+        entry['rows'] = sum(p['rows'] for p in entry['partitions'].values())
+        save_manifest(manifest, store_dir)
+    return entry
+
+
+def select_partitions(series, min_period=None, max_period=None, store_dir=STORE_DIR):
+    """Paths of the partitions of a series that overlap [min_period, max_period], using only the manifest."""
+    manifest = load_manifest(store_dir)
+    if series not in manifest['series']:
+        raise KeyError(f"Series '{series}' is not in the store at {store_dir}")
+    selected = []
+    for name, part in sorted(manifest['series'][series]['partitions'].items(), key=lambda kv: (kv[1]['fy'], kv[0])):
+        if min_period is not None and part['max_period'] < min_period:
+            continue
+        if max_period is not None and part['min_period'] > max_period:
+            continue
+        selected.append(Path(store_dir) / series / part['path'])
+    return selected
+
+
+def read(series, min_period=None, max_period=None, columns=None, store_dir=STORE_DIR):
+    """Read a series from the store, skipping partitions outside the requested period range."""
+    paths = select_partitions(series, min_period, max_period, store_dir)
+    if columns is not None and 'period' not in columns:
+        columns = list(columns) + ['period']
+    if not paths:
+        return pd.DataFrame()
+    df = pd.concat([pd.read_parquet(path, columns=columns) for path in paths], ignore_index=True)
+    if min_period is not None or max_period is not None:
+        mask = np.ones(len(df), dtype=bool)
+        if min_period is not None:
+            mask &= df['period'].to_numpy() >= min_period
+        if max_period is not None:
+            mask &= df['period'].to_numpy() <= max_period
+        df = df[mask].reset_index(drop=True)
+    return df
+
+
+### MAIN EXECUTION
+def main():
+    # Publishing the given series (every built series by default) found in data/
+    names = sys.argv[1:] or list(SERIES)
+    unknown = [name for name in names if name not in SERIES]
+    if unknown:
+        sys.exit(f"Unknown series {unknown}, use any of {list(SERIES)}")
+    for series in names:
+        rel_path, org_col = SERIES[series]
+        if rel_path is None:
+            continue
+        csv_path = DATA_DIR / rel_path
+        if not csv_path.exists():
+            print(f"{csv_path} does not exist, skipping {series}")
+            continue
+        print(f"Reading {csv_path} ...")
+        publish(pd.read_csv(csv_path), series, org_col)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+##########################################
+
+# This python script records telemetry for the download layer of the extractors
+# Every request records host, method (direct or Selenium), status code, bytes, time to first byte, total time and
+# retries; time spent in the polite time.sleep between downloads is accounted separately
+# At the end of a run a summary (totals, per host latency percentiles and throughput) and latency and size
+# histograms are printed and written to RUN_REPORT_DIR/downloads-<name>-<timestamp>.json
+# Example:
+#   metrics = DownloadMetrics('supporting-facilities')
+#   response = fetch(url, headers, metrics)
+#   metrics.sleep(1)
+#   metrics.finish()
+
+##########################################
+
+
+### LIBRARIES
+import contextlib
+import datetime
+import json
+import os
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+RUN_REPORT_DIR = Path(os.getenv("RUN_REPORT_DIR", BASE_DIR / "rawdata" / ".build-state" / "reports"))
+MAX_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", 2))  # retries of transient failures (connection errors, 429, 5xx)
+RETRY_BACKOFF = float(os.getenv("DOWNLOAD_BACKOFF", 2.0))  # seconds, doubled after every retry
+RETRY_STATUS = {429, 500, 502, 503, 504}
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]  # seconds (upper bounds; the last bucket is open)
+SIZE_BUCKETS = [10 * 2**10, 100 * 2**10, 2**20, 10 * 2**20, 100 * 2**20]  # bytes
+
+
+### FUNCTIONS
+def percentile(values, q):
+    """Percentile by linear interpolation of sorted values (None for no values)."""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def histogram(values, buckets):
+    """Counts per bucket, labelled by upper bound ('le_<bound>', plus 'gt_<last>')."""
+    counts = {f'le_{b:g}': 0 for b in buckets}
+    counts[f'gt_{buckets[-1]:g}'] = 0
+    for value in values:
+        label = next((f'le_{b:g}' for b in buckets if value <= b), f'gt_{buckets[-1]:g}')
+        counts[label] += 1
+    return counts
+
+
+class DownloadMetrics:
+    """Collects one record per download request and exports the run summary."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.start_time = time.perf_counter()
+        self.requests = []
+        self.sleep_s = 0.0
+
+    def record(self, url, method, status=None, bytes_=0, ttfb_s=None, total_s=0.0, retries=0, error=None):
+        self.requests.append({'url': url, 'host': urlparse(url).netloc, 'method': method, 'status': status,
+                              'bytes': bytes_, 'ttfb_s': ttfb_s, 'total_s': total_s, 'retries': retries,
+                              'ok': error is None and status in (None, 200), 'error': error})
+
+    @contextlib.contextmanager
+    def timed(self, url, method):
+        """Time a download done by other means (e.g. Selenium); the caller sets record['bytes'] and record['ok']."""
+        record = {'bytes': 0, 'ok': False, 'error': None}
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            self.record(url, method, bytes_=record['bytes'], total_s=time.perf_counter() - start,
+                        error=record['error'] or (None if record['ok'] else 'no file'))
+
+    def sleep(self, seconds):
+        """time.sleep, accounted as politeness delay."""
+        time.sleep(seconds)
+        self.sleep_s += seconds
+
+    def summary(self):
+        """Totals, per host and per method statistics and histograms of the recorded requests."""
+        def stats(records):
+            times = [r['total_s'] for r in records]
+            ttfb = [r['ttfb_s'] for r in records if r['ttfb_s'] is not None]
+            total_bytes = sum(r['bytes'] for r in records)
+            return {'requests': len(records), 'failed': sum(not r['ok'] for r in records),
+                    'retries': sum(r['retries'] for r in records), 'bytes': total_bytes, 'seconds': sum(times),
+                    'mb_per_s': total_bytes / 2**20 / sum(times) if sum(times) else None,
+                    'latency_p50_s': percentile(times, 0.5), 'latency_p90_s': percentile(times, 0.9),
+                    'latency_max_s': max(times) if times else None, 'ttfb_p50_s': percentile(ttfb, 0.5),
+                    'ttfb_p90_s': percentile(ttfb, 0.9)}
+        return {'name': self.name, 'started': self.started, 'wall_s': time.perf_counter() - self.start_time,
+                'sleep_s': self.sleep_s, 'total': stats(self.requests),
+                'by_method': {m: stats([r for r in self.requests if r['method'] == m])
+                              for m in sorted({r['method'] for r in self.requests})},
+                'by_host': {h: stats([r for r in self.requests if r['host'] == h])
+                            for h in sorted({r['host'] for r in self.requests})},
+                'status_codes': {str(s): sum(r['status'] == s for r in self.requests)
+                                 for s in sorted({r['status'] for r in self.requests}, key=str)},
+                'latency_histogram_s': histogram([r['total_s'] for r in self.requests], LATENCY_BUCKETS),
+                'size_histogram_bytes': histogram([r['bytes'] for r in self.requests if r['ok']], SIZE_BUCKETS)}
+
+    def finish(self, report_dir=RUN_REPORT_DIR):
+        """Print the summary and write it with the per-request records. Returns the report path."""
+        summary = self.summary()
+        total = summary['total']
+        print("-" * 50)
+        print(f"Downloads: {total['requests']} requests, {total['failed']} failed, {total['retries']} retries, "
+              f"{total['bytes'] / 2**20:.1f} MB in {total['seconds']:.1f} s, {summary['sleep_s']:.1f} s sleeping")
+        for method, s in summary['by_method'].items():
+            print(f"  {method:<10} {s['requests']:>4} requests {s['seconds']:>8.1f} s  p50 {s['latency_p50_s']:.2f} s")
+        for host, s in summary['by_host'].items():
+            rate = f"{s['mb_per_s']:.2f} MB/s" if s['mb_per_s'] is not None else "-"
+            print(f"  {host:<40} p50 {s['latency_p50_s']:.2f} s  p90 {s['latency_p90_s']:.2f} s  {rate}")
+        report_dir = Path(report_dir)
+        report_dir.mkdir(parents=True, exist_ok=True)
+        stamp = self.started.replace(':', '').replace('-', '')
+        report_path = report_dir / f"downloads-{self.name}-{stamp}-{os.getpid()}.json"
+        with open(report_path, 'w') as f:
+            json.dump({**summary, 'requests': self.requests}, f, indent=2, default=str)
+        print(f"Download report saved to {report_path}")
+        return report_path
+
+
+def fetch(url, headers=None, metrics=None, retries=MAX_RETRIES, backoff=RETRY_BACKOFF, timeout=60):
+    """
+    GET a URL with requests, retrying transient failures with exponential backoff.
+    Records status, bytes, time to first byte (headers received) and total time in metrics.
+    Returns the response (content already read), or None when every attempt failed with a connection error.
+    """
+    import requests # imported here so importing this module does not load requests
+    start = time.perf_counter()
+    response, error, attempt = None, None, 0
+    while True:
+        attempt_start = time.perf_counter()
+        try:
+            response = requests.get(url, headers=headers, allow_redirects=True, stream=True, timeout=timeout)
+            ttfb = time.perf_counter() - attempt_start  # of the last attempt
+            response.content  # read the body inside the timing
+            error = None
+            if response.status_code not in RETRY_STATUS or attempt >= retries:
+                break
+        except requests.RequestException as e:
+            response, ttfb, error = None, None, f'{type(e).__name__}: {e}'
+            if attempt >= retries:
+                break
+        attempt += 1
+        time.sleep(backoff * 2 ** (attempt - 1))
+    if metrics is not None:
+        metrics.record(url, 'direct', status=response.status_code if response is not None else None,
+                       bytes_=len(response.content) if response is not None else 0, ttfb_s=ttfb,
+                       total_s=time.perf_counter() - start, retries=attempt, error=error)
+    return response
@@ -0,0 +1,168 @@
+##########################################
+
+# This python script reads Excel workbooks through pluggable parsing backends (pandas engines)
+# - calamine: Rust-backed reader for .xls, .xlsx, .xlsb and .ods (pip install python-calamine), much faster
+# - openpyxl (.xlsx), xlrd (.xls), pyxlsb (.xlsb), odf (.ods): the pure Python engines pandas uses by default
+# A backend is picked per file by extension and availability, in the order of EXCEL_BACKENDS; when it fails on a
+# file, the next backend is tried for that file. EXCEL_BACKEND=openpyxl (or a comma-separated order) overrides it
+# iter_rows streams the rows of one sheet for builders that process large files in chunks. calamine decodes the
+# sheet up front (fast, memory ~ the sheet), openpyxl in read-only mode reads it row by row (slow, flat memory)
+# It is called in build_datasets_main.py and wait-times/build_datasets_wait_times.py
+
+##########################################
+
+
+### LIBRARIES
+import pandas as pd
+import importlib.util
+import os
+from pathlib import Path
+
+
+### SETTINGS
+# Backends in order of preference per extension, and the module each one needs
+EXCEL_BACKENDS = {
+    '.xlsx': ['calamine', 'openpyxl'],
+    '.xlsm': ['calamine', 'openpyxl'],
+    '.xls': ['calamine', 'xlrd'],
+    '.xlsb': ['calamine', 'pyxlsb'],
+    '.ods': ['calamine', 'odf'],
+}
+BACKEND_MODULES = {'calamine': 'python_calamine', 'openpyxl': 'openpyxl', 'xlrd': 'xlrd', 'pyxlsb': 'pyxlsb',
+                   'odf': 'odf'}
+
+_available = {}  # backend -> whether its module is installed
+
+
+### FUNCTIONS
+def is_available(backend):
+    """Whether the module of a backend is installed (checked once, without importing it)."""
+    if backend not in _available:
+        _available[backend] = importlib.util.find_spec(BACKEND_MODULES[backend]) is not None
+    return _available[backend]
+
+
+def backends_for(file_path, preferred=None):
+    """Available backends for a file, in the order they are tried."""
+    ext = Path(file_path).suffix.lower()
+    candidates = EXCEL_BACKENDS.get(ext, ['calamine', 'openpyxl'])
+    preferred = preferred or [b.strip() for b in os.getenv("EXCEL_BACKEND", "").split(',') if b.strip()]
+    if preferred:
+        # Forced backends first, the remaining ones as fallbacks
+        candidates = [b for b in preferred if b in BACKEND_MODULES] + [b for b in candidates if b not in preferred]
+    return [b for b in candidates if is_available(b)]
+
+
+def read_excel(file_path, sheet_name=0, backends=None, **kwargs):
+    """
+    pd.read_excel with backend selection and per-file fallback. sheet_name=None reads every sheet in one parse
+    (returns {sheet: DataFrame}). The backend used is stored in df.attrs['excel_backend'].
+    """
+    candidates = backends if backends is not None else backends_for(file_path)
+    if not candidates:
+        raise ImportError(f"No Excel backend installed for {Path(file_path).suffix} files "
+                          f"(install one of {EXCEL_BACKENDS.get(Path(file_path).suffix.lower())})")
+    errors = []
+    for backend in candidates:
+        try:
+            result = pd.read_excel(file_path, sheet_name=sheet_name, engine=backend, **kwargs)
+        except Exception as e:
+            errors.append(f"{backend}: {type(e).__name__}: {e}")
+            if backend != candidates[-1]:
+                print(f"Excel backend {backend} failed on {Path(file_path).name} ({e}), trying the next one")
+            continue
+        for df in (result.values() if isinstance(result, dict) else [result]):
+            df.attrs['excel_backend'] = backend
+        return result
+    raise ValueError(f"Could not read {file_path} with any backend: " + "; ".join(errors))
+
+
+def _rows_calamine(file_path, sheet):
+    from python_calamine import CalamineWorkbook
+    workbook = CalamineWorkbook.from_path(str(file_path))
+    worksheet = workbook.get_sheet_by_name(sheet) if isinstance(sheet, str) else workbook.get_sheet_by_index(sheet)
+    for row in worksheet.iter_rows():
+        yield [None if value == '' else value for value in row]
+
+
+def _rows_openpyxl(file_path, sheet):
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if isinstance(sheet, str) else workbook.worksheets[sheet]
+        for row in worksheet.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def _rows_xlrd(file_path, sheet):
+    import xlrd
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        worksheet = workbook.sheet_by_name(sheet) if isinstance(sheet, str) else workbook.sheet_by_index(sheet)
+        for i in range(worksheet.nrows):
+            yield [None if value == '' else value for value in worksheet.row_values(i)]
+    finally:
+        workbook.release_resources()
+
+
+def _sheet_names_calamine(file_path):
+    from python_calamine import CalamineWorkbook
+    return CalamineWorkbook.from_path(str(file_path)).sheet_names
+
+
+def _sheet_names_openpyxl(file_path):
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def _sheet_names_xlrd(file_path):
+    import xlrd
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        return workbook.sheet_names()
+    finally:
+        workbook.release_resources()
+
+
+ROW_READERS = {'calamine': _rows_calamine, 'openpyxl': _rows_openpyxl, 'xlrd': _rows_xlrd}
+SHEET_NAME_READERS = {'calamine': _sheet_names_calamine, 'openpyxl': _sheet_names_openpyxl, 'xlrd': _sheet_names_xlrd}
+
+
+def sheet_names(file_path, backends=None):
+    """Sheet names of a workbook, with the same backend selection and fallback as read_excel."""
+    candidates = [b for b in (backends if backends is not None else backends_for(file_path)) if b in SHEET_NAME_READERS]
+    errors = []
+    for backend in candidates:
+        try:
+            return SHEET_NAME_READERS[backend](file_path)
+        except Exception as e:
+            errors.append(f"{backend}: {type(e).__name__}: {e}")
+    raise ValueError(f"Could not read the sheets of {file_path} with any backend: " + "; ".join(errors))
+
+
+def iter_rows(file_path, sheet=0, backends=None):
+    """
+    Yield the rows of one sheet (by index or name) as lists of cell values, empty cells as None.
+    A backend that fails before the first row falls back to the next one; later errors are raised.
+    """
+    candidates = [b for b in (backends if backends is not None else backends_for(file_path)) if b in ROW_READERS]
+    errors = []
+    for backend in candidates:
+        rows = ROW_READERS[backend](file_path, sheet)
+        try:
+            first = next(rows)
+        except StopIteration:
+            return
+        except Exception as e:
+            errors.append(f"{backend}: {type(e).__name__}: {e}")
+            continue
+        yield first
+        yield from rows
+        return
+    raise ValueError(f"Could not read sheet {sheet} of {file_path} with any backend: " + "; ".join(errors))
@@ -4,34 +4,23 @@
 
 ##########################################
 
-import pandas as pd
-import numpy as np
-from pathlib import Path
-import os
-import seaborn as sns
-import matplotlib.pyplot as plt
-
-
-try:
-    BASE_DIR = Path(__file__).resolve().parent.parent
-except NameError:
-    BASE_DIR = Path.cwd()
-
-# Go one level up from BASE_DIR using parent
-DATA_DIR = BASE_DIR.parent / "data"
-
-df = pd.read_csv(os.path.join(DATA_DIR, "supporting-facilities_clean.csv"))
-
-
-# Test: histogram
-plt.figure(figsize=(10, 6))  # Set figure size
-plt.hist(df['nr_operating_theatres'], bins=30, edgecolor='black')
-plt.xlabel('Number of Operating Theatres')
-plt.ylabel('Frequency')
-plt.title('Distribution of Operating Theatres')
-plt.grid(True, alpha=0.3)
-plt.show()
-
-
-
-
+from loader import load # memory-mapped series loading
+
+
+def plot_theatres(df):
+    """Test: histogram of the number of operating theatres"""
+    # matplotlib is only imported when a plot is drawn (it is slow to import)
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(10, 6))  # Set figure size
+    plt.hist(df['nr_operating_theatres'], bins=30, edgecolor='black')
+    plt.xlabel('Number of Operating Theatres')
+    plt.ylabel('Frequency')
+    plt.title('Distribution of Operating Theatres')
+    plt.grid(True, alpha=0.3)
+    plt.show()
+
+
+if __name__ == "__main__":
+    # Only the column needed for the plot is loaded, from the memory-mapped Arrow copy of the series
+    df = load('supporting_facilities', columns=['nr_operating_theatres'])
+    plot_theatres(df)
@@ -9,13 +9,13 @@
 
 # pip install selenium
 import os
-import time
 from urllib.parse import urljoin
 from urllib.request import urlopen, Request, URLError
 from bs4 import BeautifulSoup
-import requests
 from pathlib import Path
-from extract_supporting_facilities_webarchive import handle_webarchive_download # webarchive functionality
+from download_metrics import DownloadMetrics, fetch # download telemetry
+from selection import validate_id_input # validating IDs functionality
+from instrument import instrumented_run, stage, file_bytes # per-stage run report
     
 
 ### FUNCTIONS
@@ -66,24 +66,29 @@ def check_downloaded_file(download_dir):
         return None
 
 
-def download_file(url, filename):
+def download_file(url, filename, metrics=None):
     """Download file using Selenium for complex JavaScript-based redirection or direct download."""
     download_dir = os.path.dirname(filename)
+    metrics = metrics if metrics is not None else DownloadMetrics('download')  # records are dropped without a run
     try:
         if 'webarchive' in url or 'web.archive' in url:
             print('This is likely a webarchive URL, using Selenium library...')
-            latest_file = handle_webarchive_download(url, download_dir, check_downloaded_file) # calling function from different file
-            if latest_file:
-                os.rename(latest_file, filename)
-                print(f"Successfully downloaded and renamed to {filename}")
-                return True
+            with metrics.timed(url, 'selenium') as record:
+                # Imported here so the Selenium/webdriver stack is only loaded when a webarchive file is downloaded
+                from extract_supporting_facilities_webarchive import handle_webarchive_download # webarchive functionality
+                latest_file = handle_webarchive_download(url, download_dir, check_downloaded_file) # calling function from different file
+                if latest_file:
+                    os.rename(latest_file, filename)
+                    record['ok'], record['bytes'] = True, os.path.getsize(filename)
+                    print(f"Successfully downloaded and renamed to {filename}")
+                    return True
         else:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             print("Non-webarchive file, direct download method using 'urllib.request' library)...")
-            response = requests.get(url, headers=headers, allow_redirects=True)
-            if response.status_code == 200:
+            response = fetch(url, headers, metrics) # timings, size, status and retries go to the run metrics
+            if response is not None and response.status_code == 200:
                 with open(filename, 'wb') as f:
                     f.write(response.content)
                 print(f"Successfully downloaded {filename}")
@@ -94,33 +99,6 @@ def download_file(url, filename):
         return False
 
 
-def validate_id_input(selected_files, max_id):
-    """Validate user input for file selection."""
-    selected_ids = []
-    try:
-        if selected_files.lower() == 'all':
-            return list(range(1, max_id + 1))
-        
-        for part in selected_files.split(','):
-            if '-' in part:
-                start, end = map(int, part.split('-'))
-                if start < 1 or end > max_id:
-                    print(f"ID range {start}-{end} out of range. Please enter IDs between 1 and {max_id}")
-                    return None
-                selected_ids.extend(range(start, end + 1))
-            else:
-                id_num = int(part)
-                if id_num < 1 or id_num > max_id:
-                    print(f"ID {id_num} out of range. Please enter IDs between 1 and {max_id}")
-                    return None
-                selected_ids.append(id_num)
-        return selected_ids
-    except ValueError:
-        print("Invalid input format. Please use numbers separated by commas or ranges (e.g., 1,3,5 or 1-3)")
-        return None
-
-
-
 ### MAIN EXECUTION
 def main():
     # Defining directories
@@ -136,8 +114,9 @@ def main():
     
     try:
         print("Reading webpage...")
-        page = urlopen(Request(dataurl, headers={'User-Agent': 'Mozilla/5.0'}))
-        soup = BeautifulSoup(page, features="html.parser")
+        with stage('read_index', file=dataurl):
+            page = urlopen(Request(dataurl, headers={'User-Agent': 'Mozilla/5.0'}))
+            soup = BeautifulSoup(page, features="html.parser")
                 
         links = []
         for link in soup.find_all('a', href=True):
@@ -165,6 +144,7 @@ def main():
             print("Please try again.\n")
                 
         # Output
+        metrics = DownloadMetrics('supporting-facilities') # download telemetry, summarised at the end of the run
         for id in selected_ids:
             url, filename, text = links[id - 1]
             full_path = os.path.join(RAW_DATA_DIR, filename)
@@ -174,13 +154,17 @@ def main():
                 continue
     
             print(f"Downloading {filename} ...\n")
-            success = download_file(url, full_path)
+            with stage('download', file=filename) as s:
+                success = download_file(url, full_path, metrics)
+                s['bytes_out'] = file_bytes(full_path) if success else None
+                if not success:
+                    s['status'] = 'failed'
             if success:
                 print(f"Successfully downloaded {filename}\n")
             else:
                 print(f"Failed to download {filename}\n")
                 failed_downloads.append((id, filename, url))
-            time.sleep(1)
+            metrics.sleep(1)
             
         # Failed downloads
         if failed_downloads:
@@ -191,6 +175,8 @@ def main():
                 print(f"Filename: {filename}")
                 print(f"URL: {url}\n")
  
+        metrics.finish()
+
     # Errors
     except URLError as e:
         print(f"Network error: {e}")
@@ -198,7 +184,8 @@ def main():
         print(f"Unexpected error: {e}")
      
 if __name__ == "__main__":
-    main()
+    with instrumented_run('extract-supporting-facilities'):
+        main()
     
     
 
@@ -0,0 +1,119 @@
+##########################################
+
+# This python script maps the raw column headers of a series to its canonical variables without asking anyone
+# Each series has a registry of canonical variables with the headers they have been published under over the
+# years (e.g. 'OrgID' and 'Organisation Code' are both organisation_code). Headers are normalised (case,
+# whitespace and punctuation removed) and looked up in a dict compiled once per series, so mapping the columns of
+# a new workbook is a few dict lookups. Headers that are not in the registry are reported, not prompted for
+# To support a renamed header, add it to the aliases of its variable below
+# Example:
+#   from header_aliases import map_columns
+#   df = map_columns(df, 'supporting_facilities')
+
+##########################################
+
+
+### LIBRARIES
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+
+### SETTINGS
+# series -> canonical variable -> known headers, in output column order
+ALIASES = {
+    'supporting_facilities': {
+        'SHA': ['SHA', 'SHA Code'],
+        'organisation_code': ['OrgID', 'Org ID', 'Organisation Code', 'Org Code'],
+        'organisation_name': ['Name', 'Organisation Name', 'Org Name'],
+        'area_team_code': ['Area Team Code'],
+        'area_team_name': ['Area Team Name'],
+        'region_code': ['Region Code'],
+        'region_name': ['Region Name'],
+        'nr_operating_theatres': ['Number of operating theatres'],
+        'nr_day_case_theatres': ['Of which, number of dedicated day case theatres',
+                                 'Number of dedicated day case theatres'],
+    },
+}
+# Columns added by the builders, kept as they are and in front of the canonical variables
+KEY_COLUMNS = {
+    'supporting_facilities': ['year_var', 'quarter_var', 'period'],
+}
+IGNORED_HEADERS = {'', 'na', 'nan', 'none'}  # blank header cells (filter_rows writes them as 'NA'), dropped
+MISSING_VALUES = ['NA', 'nan', '']  # markers of missing values in the appended datasets
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+### FUNCTIONS
+@lru_cache(maxsize=4096)
+def normalise_header(header):
+    """Header reduced to lower case letters and digits: 'Org ID', 'OrgID' and 'org_id' all become 'orgid'."""
+    return _NON_ALNUM.sub('', str(header).lower())
+
+
+@lru_cache(maxsize=None)
+def compile_aliases(series):
+    """Lookup of normalised header -> canonical variable of a series. Raises if one header maps to two variables."""
+    if series not in ALIASES:
+        raise KeyError(f"No header aliases for series '{series}', use one of {list(ALIASES)}")
+    lookup = {}
+    for canonical, aliases in ALIASES[series].items():
+        for alias in [canonical] + aliases:
+            key = normalise_header(alias)
+            if lookup.setdefault(key, canonical) != canonical:
+                raise ValueError(f"Header '{alias}' of {series} maps to both {lookup[key]} and {canonical}")
+    return lookup
+
+
+def match_headers(headers, series):
+    """
+    Canonical variable of each header as {header: canonical}, the key columns, and the headers that are not
+    in the registry (blank headers are neither).
+    """
+    lookup = compile_aliases(series)
+    keys = set(KEY_COLUMNS.get(series, []))
+    mapping, key_cols, unknown = {}, [], []
+    for header in headers:
+        if header in keys:
+            key_cols.append(header)
+            continue
+        key = normalise_header(header)
+        if key in lookup:
+            mapping[header] = lookup[key]
+        elif key not in IGNORED_HEADERS:
+            unknown.append(header)
+    return mapping, key_cols, unknown
+
+
+def coalesce(df, columns):
+    """First non-missing value across columns, row by row (None where all are missing)."""
+    frame = df[columns]
+    values = frame.to_numpy(dtype=object)
+    missing = frame.isna().to_numpy() | frame.isin(MISSING_VALUES).to_numpy()
+    first = np.argmin(missing, axis=1)  # first column with a value (0 when there is none)
+    result = values[np.arange(len(values)), first]
+    result[missing.all(axis=1)] = None
+    return pd.Series(result, index=df.index, dtype=object)
+
+
+def map_columns(df, series, report=True):
+    """
+    Rename the columns of df to the canonical variables of the series, merging the columns of one variable that
+    was published under several headers (the first non-missing value wins, missing markers become None).
+    Columns come out as the key columns, the canonical variables in registry order, then the unknown headers,
+    which are kept and reported. Blank headers are dropped.
+    """
+    mapping, key_cols, unknown = match_headers(df.columns, series)
+    if report and unknown:
+        print(f"Unknown headers for {series} (kept as they are, add them to header_aliases.ALIASES): {unknown}")
+    groups = {}
+    for header, canonical in mapping.items():
+        groups.setdefault(canonical, []).append(header)
+    out = {col: df[col] for col in key_cols}
+    for canonical in ALIASES[series]:
+        if canonical in groups:
+            out[canonical] = coalesce(df, groups[canonical])
+    out.update({col: df[col] for col in unknown})
+    return pd.DataFrame(out, index=df.index)
@@ -0,0 +1,135 @@
+##########################################
+
+# This python script keeps the state needed for incremental builds
+# For each raw file that went into an output it records the file hash (plus size and modification time, so unchanged
+# files are not re-hashed) and caches the processed frame under its name and hash (the period of a frame comes from
+# the file name, so two files with the same bytes have their own frames). A build then only processes new or
+# changed files; frames of revised files are replaced and frames of removed files are dropped
+# Cached frames are stored as period-sorted runs, so they can be merged straight into the output (see streaming.py)
+# It is called in build_datasets_main.py
+
+##########################################
+
+
+### LIBRARIES
+# pandas and streaming.py are imported in the functions that cache frames, so the file hashing used by
+# pipeline.py does not load pandas
+from pathlib import Path
+import hashlib
+import json
+import os
+
+
+### FUNCTIONS
+def file_hash(file_path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_state(state_dir):
+    """Load the build state of an output, or an empty state for a first build."""
+    state_path = Path(state_dir) / 'state.json'
+    if not state_path.exists():
+        return {'files': {}, 'outputs': {}}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state, state_dir):
+    """Write the build state atomically."""
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_dir / 'state.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_dir / 'state.json')
+
+
+def current_fingerprint(file_path, previous=None):
+    """
+    Hash, size and modification time of a raw file. The stored hash is reused when size and modification
+    time are unchanged, so only new or touched files are read.
+    """
+    stat = os.stat(file_path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return {'hash': previous['hash'], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return {'hash': file_hash(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def cache_name(file, digest):
+    """Name of the cached frame of a raw file: a short hash of the file name and the hash of its content."""
+    return f"{hashlib.sha1(file.encode()).hexdigest()[:12]}-{digest}.pkl"
+
+
+def plan_build(raw_dir, files, state, state_dir):
+    """
+    Split the raw files into those that need processing and those whose cached frame can be reused.
+    Returns (to_process, unchanged, removed, fingerprints).
+    """
+    fingerprints = {}
+    to_process, unchanged = [], []
+    for file in files:
+        previous = state['files'].get(file)
+        fingerprints[file] = current_fingerprint(Path(raw_dir) / file, previous)
+        cached = previous is not None and 'period_known' in previous \
+            and previous['cache'] == cache_name(file, fingerprints[file]['hash']) \
+            and (Path(state_dir) / previous['cache']).exists()
+        (unchanged if cached else to_process).append(file)
+    removed = sorted(set(state['files']) - set(files))
+    return to_process, unchanged, removed, fingerprints
+
+
+def store_frame(df, file, fingerprint, state, state_dir, period_known=True):
+    """Cache the processed frame of a raw file as a sorted run and record it in the state (replacing any earlier revision)."""
+    from streaming import spill_run # sorted runs for the streaming append
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    previous = state['files'].get(file)
+    cache = cache_name(file, fingerprint['hash'])
+    run = spill_run(df, state_dir / cache, order=0, name=file, period_known=period_known)
+    if previous and previous['cache'] != cache and not _cache_in_use(previous['cache'], state, besides=file):
+        (state_dir / previous['cache']).unlink(missing_ok=True)
+    state['files'][file] = {**fingerprint, 'cache': cache, 'rows': run['rows'], 'columns': run['columns'],
+                            'min_period': run['min_period'], 'max_period': run['max_period'],
+                            'period_known': period_known}
+
+
+def cached_run(file, order, state, state_dir):
+    """Run metadata of a cached frame, for merging into the output."""
+    entry = state['files'][file]
+    return {'path': str(Path(state_dir) / entry['cache']), 'order': order, 'name': file, 'rows': entry['rows'],
+            'columns': entry['columns'], 'min_period': entry['min_period'], 'max_period': entry['max_period'],
+            'period_known': entry['period_known']}
+
+
+def load_frame(file, state, state_dir):
+    """Cached processed frame of an unchanged raw file."""
+    import pandas as pd
+    return pd.read_pickle(Path(state_dir) / state['files'][file]['cache'])
+
+
+def _cache_in_use(cache, state, besides=None):
+    """Whether another file of the state points to a cached frame (states written before cache_name shared them)."""
+    return any(entry['cache'] == cache for file, entry in state['files'].items() if file != besides)
+
+
+def cache_exists(file, state, state_dir):
+    """Whether the cached frame of a file is there (check after drop_files, before reusing it)."""
+    return file in state['files'] and (Path(state_dir) / state['files'][file]['cache']).exists()
+
+
+def drop_files(files, state, state_dir):
+    """Forget raw files that are no longer present, deleting their cached frames unless another file uses them."""
+    for file in files:
+        entry = state['files'].pop(file, None)
+        if entry and not _cache_in_use(entry['cache'], state):
+            (Path(state_dir) / entry['cache']).unlink(missing_ok=True)
+
+
+def record_output(state, output_name, files):
+    """Record which raw files (by hash) went into an output."""
+    state['outputs'][output_name] = {file: state['files'][file]['hash'] for file in files if file in state['files']}
@@ -0,0 +1,171 @@
+##########################################
+
+# This python script records per-stage instrumentation for the extractors and builders
+# Every stage (per file where it applies) records wall time, CPU time, the process peak RSS and how much the stage
+# raised it, rows and bytes in/out, and, when INSTRUMENT_TRACEMALLOC=1, the peak of Python allocations in the stage
+# At the end of a run a JSON report is written to RUN_REPORT_DIR (default rawdata/.build-state/reports/)
+# The cost per stage is a few clock and getrusage calls, so it is always on; tracemalloc is opt-in as it slows
+# allocation-heavy code down
+# Stages can also be profiled without code changes: PROFILE=all or --profile (see profiling.py)
+# Example:
+#   from instrument import start_run, stage, finish_run
+#   start_run('supporting-facilities')
+#   with stage('read_dataset', file=filename, bytes_in=os.path.getsize(path)) as s:
+#       df = read_dataset(path, filename)
+#       s['rows_out'] = len(df)
+#   finish_run()
+
+##########################################
+
+
+### LIBRARIES
+import contextlib
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from profiling import profile_stage, enable_from_argv # opt-in profiling of stages
+try:
+    import resource # peak RSS, not available on Windows
+except ImportError:
+    resource = None
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+RUN_REPORT_DIR = Path(os.getenv("RUN_REPORT_DIR", BASE_DIR / "rawdata" / ".build-state" / "reports"))
+
+_run = None  # the active run; stages outside a run are timed but not recorded
+_peaks = []  # tracemalloc peak so far of each open stage, outermost first (the peak is reset for every stage)
+
+
+### FUNCTIONS
+def peak_rss_mb():
+    """High-water mark of the resident set size of this process in MB (None where getrusage is unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10  # bytes on macOS, KB on Linux
+
+
+def frame_bytes(df):
+    """Shallow in-memory size of a DataFrame (deep=True would scan every string, which is not cheap)."""
+    return int(df.memory_usage(index=True, deep=False).sum()) if df is not None else None
+
+
+def file_bytes(path):
+    """Size of a file on disk, or None if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def start_run(name, trace_memory=None):
+    """Start recording a run; trace_memory defaults to INSTRUMENT_TRACEMALLOC=1."""
+    global _run
+    enable_from_argv()
+    if trace_memory is None:
+        trace_memory = os.getenv("INSTRUMENT_TRACEMALLOC") == '1'
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _run = {'name': name, 'argv': sys.argv, 'pid': os.getpid(),
+            'started': datetime.datetime.now().isoformat(timespec='seconds'), 'status': 'running',
+            'trace_memory': trace_memory, 'stages': [],
+            '_wall': time.perf_counter(), '_cpu': time.process_time()}
+    return _run
+
+
+@contextlib.contextmanager
+def stage(name, file=None, rows_in=None, bytes_in=None, profile=True, **extra):
+    """
+    Record one stage of the active run. The yielded dict can be filled in by the caller
+    (e.g. s['rows_out'] = len(df), s['bytes_out'] = file_bytes(path)).
+    With profile=True the stage is also profiled when profiling is enabled for it.
+    """
+    record = {'stage': name, 'file': file, 'rows_in': rows_in, 'bytes_in': bytes_in, 'rows_out': None,
+              'bytes_out': None, 'status': 'ok', **extra}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _peaks:  # keep the enclosing stage's peak before resetting it for this one
+            _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+        _peaks.append(0)
+        tracemalloc.reset_peak()
+    rss_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    profile_outputs = []
+    try:
+        with profile_stage(name, file) if profile else contextlib.nullcontext([]) as profile_outputs:
+            yield record
+    except BaseException as e:
+        record['status'] = 'error'
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 6)
+        record['cpu_s'] = round(time.process_time() - cpu, 6)
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['rss_growth_mb'] = record['peak_rss_mb'] - rss_before if rss_before is not None else None
+        if tracing:
+            peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            record['tracemalloc_peak_mb'] = peak / 2**20
+        if profile_outputs:
+            record['profile'] = [str(path) for path in profile_outputs]
+        if _run is not None:
+            _run['stages'].append(record)
+
+
+def summarise(stages):
+    """Totals per stage name: count, wall and CPU time, rows and bytes, errors."""
+    summary = {}
+    for record in stages:
+        total = summary.setdefault(record['stage'], {'count': 0, 'errors': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                     'rows_in': 0, 'rows_out': 0, 'bytes_in': 0, 'bytes_out': 0})
+        total['count'] += 1
+        total['errors'] += record['status'] != 'ok'
+        total['wall_s'] += record['wall_s']
+        total['cpu_s'] += record['cpu_s']
+        for key in ('rows_in', 'rows_out', 'bytes_in', 'bytes_out'):
+            total[key] += record[key] or 0
+    return summary
+
+
+def finish_run(status='ok', report_dir=RUN_REPORT_DIR):
+    """Close the active run and write its JSON report. Returns the report path (None if no run is active)."""
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+    report = {key: value for key, value in run.items() if not key.startswith('_')}
+    report.update({'status': status, 'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'wall_s': round(time.perf_counter() - run['_wall'], 6),
+                   'cpu_s': round(time.process_time() - run['_cpu'], 6),
+                   'peak_rss_mb': peak_rss_mb(), 'summary': summarise(run['stages'])})
+    report_dir = Path(report_dir)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    stamp = report['started'].replace(':', '').replace('-', '')
+    report_path = report_dir / f"{run['name']}-{stamp}-{run['pid']}.json"
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    return report_path
+
+
+@contextlib.contextmanager
+def instrumented_run(name, trace_memory=None):
+    """Run a block as one instrumented run, writing the report even when it fails."""
+    start_run(name, trace_memory)
+    status = 'error'
+    try:
+        yield
+        status = 'ok'
+    finally:
+        report_path = finish_run(status)
+        print(f"Run report saved to {report_path}")
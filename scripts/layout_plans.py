@@ -0,0 +1,187 @@
+##########################################
+
+# This python script recognises the workbook templates the NHS reuses across years, so the header of a raw sheet
+# is searched for once per template instead of once per file
+# - fingerprint: hash of the top-of-sheet structure, i.e. the text of the rows above the data (titles, notes and
+#   the header row, with digits and month names masked so 'Quarter ending June 2009' and 'Quarter ending Sep 2010'
+#   look the same) and the cell pattern (empty, number, text) of the first data row
+# - parse plan of a fingerprint: the header row, the header cells with their canonical variables (see
+#   header_aliases.py) and the data row range (rows after the header, less the footer rows)
+# Plans are kept in the raw-file catalog database (see raw_catalog.py). Sheets of a known template are sliced with
+# its plan; plans of new templates are detected automatically and flagged for review
+# Usage:
+#   python layout_plans.py                   list the templates, new ones first
+#   python layout_plans.py --review <fp>     mark a template as reviewed
+
+##########################################
+
+
+### LIBRARIES
+import argparse
+import datetime
+import hashlib
+import json
+import numbers
+import re
+import pandas as pd
+import raw_catalog # catalog database
+from header_aliases import ALIASES, match_headers # canonical variables of the raw headers
+
+
+### SETTINGS
+TOP_ROWS = 30  # rows scanned for the top-of-sheet structure
+MIN_NUMERIC_CELLS = 2  # the data starts at the first row with this many numbers
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    fingerprint TEXT PRIMARY KEY,
+    series TEXT,
+    header_row INTEGER,   -- index of the header row in the sheet as read with its first row as header, or null
+    footer_rows INTEGER,  -- rows after the last data row (sources, notes)
+    headers TEXT,         -- JSON list of the header cells
+    columns TEXT,         -- JSON {header: canonical variable}
+    source TEXT,          -- file and sheet the plan was made from
+    reviewed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+)
+"""
+_MONTHS = re.compile(r'\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+                     r'|sep(?:t|tember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)(?=\b|\d)')
+_DIGITS = re.compile(r'\d+')
+_OTHER = re.compile(r'[^0-9a-z#]+')
+
+
+### FUNCTIONS
+def connect(db_path=raw_catalog.CATALOG_PATH):
+    """Open the catalog database with its plans table."""
+    con = raw_catalog.connect(db_path)
+    con.execute(SCHEMA)
+    return con
+
+
+def _masked(value):
+    """Text of a cell without its dates: lower case, month names and numbers as '#', punctuation removed."""
+    text = _MONTHS.sub('#', str(value).lower())
+    return _OTHER.sub('', _DIGITS.sub('#', text))
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool) and not pd.isna(value)
+
+
+def _kinds(row):
+    """Cell pattern of a row: '' for empty cells, 'n' for numbers and 't' for text."""
+    return ['' if pd.isna(v) or str(v).strip() == '' else 'n' if _is_number(v) else 't' for v in row]
+
+
+def data_start(df, top_rows=TOP_ROWS):
+    """Index of the first data row (MIN_NUMERIC_CELLS numbers) in the top rows of a sheet, or None."""
+    for idx, row in enumerate(df.iloc[:top_rows].itertuples(index=False)):
+        if sum(_is_number(v) for v in row) >= MIN_NUMERIC_CELLS:
+            return idx
+    return None
+
+
+def fingerprint(df, top_rows=TOP_ROWS):
+    """
+    Fingerprint of the template of a sheet (as read with its first row as header): its column labels, the masked
+    text of the rows above the data and the cell pattern of the first data row.
+    """
+    start = data_start(df, top_rows)
+    top = df.iloc[:top_rows if start is None else start]
+    parts = [str(len(df.columns)), '|'.join(_masked(c) for c in df.columns)]
+    parts += ['|'.join('' if pd.isna(v) else _masked(v) for v in row) for row in top.itertuples(index=False)]
+    if start is not None:
+        parts.append('|'.join(_kinds(df.iloc[start])))
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:16]
+
+
+def header_cells(df, header_row):
+    """Cells of the header row as text ('' for empty cells)."""
+    return ['' if pd.isna(v) else str(v).strip() for v in df.iloc[header_row]]
+
+
+def footer_rows(df, header_row):
+    """Rows after the last row with a number, below the header."""
+    numeric = [i for i, row in enumerate(df.iloc[header_row + 1:].itertuples(index=False), header_row + 1)
+               if any(_is_number(v) for v in row)]
+    return len(df) - (numeric[-1] + 1) if numeric else 0
+
+
+def make_plan(df, header_row, series=None):
+    """Parse plan of a sheet whose header is at header_row (None when no header was found)."""
+    if header_row is None:
+        return {'header_row': None, 'footer_rows': 0, 'headers': [], 'columns': {}}
+    headers = header_cells(df, header_row)
+    columns = match_headers(headers, series)[0] if series in ALIASES else {}
+    return {'header_row': int(header_row), 'footer_rows': footer_rows(df, header_row), 'headers': headers,
+            'columns': columns}
+
+
+def matches(df, plan):
+    """Whether a sheet has the header cells of a plan where the plan expects them."""
+    if plan['header_row'] is None:
+        return True
+    return plan['header_row'] < len(df) and header_cells(df, plan['header_row']) == plan['headers']
+
+
+def get_plan(con, fp):
+    """Plan of a fingerprint, or None."""
+    row = con.execute("SELECT * FROM plans WHERE fingerprint = ?", (fp,)).fetchone()
+    if row is None:
+        return None
+    plan = dict(row)
+    plan['headers'], plan['columns'] = json.loads(plan['headers']), json.loads(plan['columns'])
+    return plan
+
+
+def save_plan(con, fp, plan, series=None, source=None, reviewed=False):
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+    con.execute("INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (fp, series, plan['header_row'], plan['footer_rows'], json.dumps(plan['headers']),
+                 json.dumps(plan['columns']), source, int(reviewed), now))
+    con.commit()
+
+
+def plan_for(con, df, series=None, source=None, detect=None):
+    """
+    Parse plan of a sheet as (fingerprint, plan, new). A known template whose header cells are where its plan
+    expects them reuses the plan; otherwise detect(df) finds the header row and the new plan is saved unreviewed.
+    """
+    fp = fingerprint(df)
+    plan = get_plan(con, fp)
+    if plan is not None and matches(df, plan):
+        return fp, plan, False
+    plan = make_plan(df, detect(df) if detect is not None else None, series)
+    save_plan(con, fp, plan, series, source)
+    return fp, plan, True
+
+
+def data_rows(df, plan):
+    """Data rows of a sheet according to its plan, with the header cells as column names."""
+    start, end = plan['header_row'] + 1, len(df) - plan['footer_rows']
+    return df.iloc[start:end].set_axis(plan['headers'], axis=1).reset_index(drop=True)
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Workbook templates and their parse plans")
+    parser.add_argument('--review', nargs='+', metavar='FINGERPRINT', help="mark templates as reviewed")
+    args = parser.parse_args(argv)
+    con = connect()
+    if args.review:
+        for fp in args.review:
+            if con.execute("UPDATE plans SET reviewed = 1 WHERE fingerprint = ?", (fp,)).rowcount == 0:
+                print(f"No template {fp}")
+        con.commit()
+    rows = con.execute("SELECT * FROM plans ORDER BY reviewed, created_at").fetchall()
+    if not rows:
+        print(f"No templates in {raw_catalog.CATALOG_PATH} yet (they are recorded by the builds)")
+    for row in rows:
+        flag = 'reviewed' if row['reviewed'] else 'NEW, to review'
+        print(f"{row['fingerprint']} [{flag}] {row['series'] or ''} from {row['source']}: header row {row['header_row']}, "
+              f"{row['footer_rows']} footer rows")
+        print(f"    {json.loads(row['columns']) or json.loads(row['headers'])}")
+
+
+if __name__ == "__main__":
+    main()
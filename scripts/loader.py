@@ -0,0 +1,101 @@
+##########################################
+
+# This python script loads built series through a memory-mapped Arrow IPC (Feather) copy of each series
+# The copy lives in data/arrow/<series>.arrow, is written uncompressed so it can be memory-mapped, and is rebuilt
+# whenever its source (store partitions or CSV) changes. Columns are read zero-copy from the mapped file, so
+# opening a series costs about the same whatever its size, and processes on the same machine share the pages
+# Example:
+#   from loader import load
+#   df = load('supporting_facilities', columns=['organisation_code', 'period', 'nr_operating_theatres'])
+
+##########################################
+
+
+### LIBRARIES
+# pip install pyarrow
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pandas as pd
+import os
+from pathlib import Path
+from dataset_store import DATA_DIR, STORE_DIR, SERIES, load_manifest, select_partitions # partitioned dataset store
+
+
+### SETTINGS
+ARROW_DIR = Path(os.getenv("ARROW_DIR", DATA_DIR / "arrow"))
+
+_tables = {}  # in-process cache: series -> (source signature, memory-mapped table)
+
+
+### FUNCTIONS
+def source_signature(series, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Cheap fingerprint of the source of a series: the partition hashes from the store manifest when the series
+    has been published there, otherwise the size and modification time of its CSV.
+    """
+    manifest = load_manifest(store_dir)
+    if series in manifest['series'] and manifest['series'][series]['partitions']:
+        partitions = manifest['series'][series]['partitions']
+        return 'store:' + ','.join(partitions[name]['hash'] for name in sorted(partitions))
+    if SERIES[series][0] is None:
+        raise KeyError(f"Series '{series}' is built straight into the store and is not in {store_dir} yet")
+    csv_path = Path(data_dir) / SERIES[series][0]
+    stat = os.stat(csv_path)
+    return f'csv:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def read_source(series, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Read the full series from the store, or from its CSV if it has not been published."""
+    manifest = load_manifest(store_dir)
+    if series in manifest['series'] and manifest['series'][series]['partitions']:
+        return pa.concat_tables([pq.read_table(path) for path in select_partitions(series, store_dir=store_dir)],
+                                promote_options='permissive')
+    if SERIES[series][0] is None:
+        raise KeyError(f"Series '{series}' is built straight into the store and is not in {store_dir} yet")
+    df = pd.read_csv(Path(data_dir) / SERIES[series][0])
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def build_arrow_copy(series, signature, arrow_dir=ARROW_DIR, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Write the uncompressed Arrow IPC copy of a series, tagging it with its source signature."""
+    arrow_dir = Path(arrow_dir)
+    arrow_dir.mkdir(parents=True, exist_ok=True)
+    table = read_source(series, data_dir, store_dir)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'source_signature': signature.encode()})
+    tmp_path = arrow_dir / f'{series}.arrow.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, arrow_dir / f'{series}.arrow')
+
+
+def _open_mapped(path):
+    """Open an Arrow IPC file through a memory map (no data is copied into process memory)."""
+    return pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+
+
+def load_table(series, columns=None, arrow_dir=ARROW_DIR, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Memory-mapped Arrow table of a series, (re)building the Arrow copy when its source has changed."""
+    if series not in SERIES:
+        raise KeyError(f"Unknown series '{series}', use one of {list(SERIES)}")
+    signature = source_signature(series, data_dir, store_dir)
+    cached = _tables.get(series)
+    if cached is None or cached[0] != signature:
+        path = Path(arrow_dir) / f'{series}.arrow'
+        table = _open_mapped(path) if path.exists() else None
+        if table is None or (table.schema.metadata or {}).get(b'source_signature') != signature.encode():
+            print(f"Building Arrow copy of {series} ...")
+            build_arrow_copy(series, signature, arrow_dir, data_dir, store_dir)
+            table = _open_mapped(path)
+        _tables[series] = (signature, table)
+    table = _tables[series][1]
+    return table.select(columns) if columns is not None else table
+
+
+def load(series, columns=None, **kwargs):
+    """Series as a DataFrame; only the requested columns are converted from the mapped table."""
+    return load_table(series, columns, **kwargs).to_pandas(split_blocks=True)
+
+
+def clear_cache():
+    """Drop the in-process table cache."""
+    _tables.clear()
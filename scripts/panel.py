@@ -0,0 +1,80 @@
+##########################################
+
+# This python script harmonises series for organisational changes and joins them into one org*period panel
+# - remap_org_changes: the core of the R clean_org_changes_*.R scripts: organisations in the uncomplicated trust
+#   lookup are mapped to their final code and their values summed per period (NA when all values are NA);
+#   organisations involved in problematic changes are flagged
+# - join_panel: joins several series on (org_code, period) with hash-aligned indexes
+# Example:
+#   from panel import load_trust_lookup, remap_org_changes, join_panel
+#   sf = remap_org_changes(sf, load_trust_lookup(), ['nr_operating_theatres', 'nr_day_case_theatres'])
+#   panel = join_panel({'sf': sf, 'beds': beds})
+
+##########################################
+
+
+### LIBRARIES
+import pandas as pd
+import os
+from pathlib import Path
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data"))
+TRUST_LOOKUP = DATA_DIR / "org-changes" / "trust_lookup_uncomplicated_changes.csv"
+
+
+### FUNCTIONS
+def load_trust_lookup(path=TRUST_LOOKUP):
+    """Trust lookup (old_code, final_code, experiences_split, problematic) with codes as strings."""
+    return pd.read_csv(path, dtype={'old_code': str, 'final_code': str})
+
+
+def remap_org_changes(df, lookup, value_cols, org_col='org_code', period_col='period'):
+    """
+    Map organisations with uncomplicated changes to their final code and sum their values per period.
+    Adds exp_problematic_org_change (1 for organisations involved in a problematic change, as in the R scripts).
+    Columns other than the keys and value_cols are dropped from the remapped rows.
+    """
+    value_cols = list(value_cols)
+    problematic = lookup[lookup['problematic'] == 1]
+    problematic_codes = set(problematic['old_code']) | set(problematic['final_code'])
+    uncomplicated = lookup[lookup['problematic'] == 0]
+    mapping = dict(zip(uncomplicated['old_code'], uncomplicated['final_code']))
+    affected = set(mapping) | set(mapping.values())
+
+    df = df.assign(exp_problematic_org_change=df[org_col].isin(problematic_codes).astype('int8'))
+    is_affected = df[org_col].isin(affected)
+    unchanged = df[~is_affected]
+    changed = df.loc[is_affected, [period_col, org_col, 'exp_problematic_org_change'] + value_cols].copy()
+    changed[value_cols] = changed[value_cols].apply(pd.to_numeric, errors='coerce')
+    changed[org_col] = changed[org_col].map(mapping).fillna(changed[org_col])
+    # One hash aggregation over all affected rows; min_count=1 keeps NA when every value is NA.
+    # The problematic flag is kept if any merged organisation had it, so each (period, org) appears once
+    grouped = changed.groupby([period_col, org_col], sort=False)
+    changed = grouped[value_cols].sum(min_count=1) \
+        .join(grouped['exp_problematic_org_change'].max()).reset_index()
+    return pd.concat([unchanged, changed], ignore_index=True) \
+        .sort_values([org_col, period_col], kind='stable').reset_index(drop=True)
+
+
+def join_panel(frames, keys=('org_code', 'period'), how='outer'):
+    """
+    Join series given as {name: DataFrame} on the key columns. Non-key columns that appear in more than one
+    series are prefixed with the series name. Keys must be unique within each series.
+    """
+    keys = list(keys)
+    counts = pd.Series([c for df in frames.values() for c in df.columns if c not in keys]).value_counts()
+    indexed = []
+    for name, df in frames.items():
+        df = df.rename(columns={c: f'{name}_{c}' for c in df.columns if c not in keys and counts[c] > 1})
+        df = df.set_index(keys)
+        if not df.index.is_unique:
+            raise ValueError(f"Series '{name}' has duplicate {keys} keys")
+        indexed.append(df)
+    panel = pd.concat(indexed, axis=1, join='inner' if how == 'inner' else 'outer')
+    return panel.sort_index().reset_index()
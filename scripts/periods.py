@@ -0,0 +1,162 @@
+##########################################
+
+# This python script encodes the different period formats used across the series as one integer key
+# The key is the monthly ordinal (year * 12 + month - 1) of the month in which the period ends, stored as int32:
+# - supporting facilities: year_var (financial year start, from the filename) + quarter_var ('Q1'..'Q4' or '.')
+# - KH03 beds from 2010: year (calendar year of the period end) + period_end ('June', 'September', ...)
+# - KH03 beds before 2010: year (financial year start), annual
+# - critical care beds: ISO date (first day of the month)
+# NHS quarters are financial quarters, so Q1 is April-June and Q4 is January-March of the following calendar year
+
+##########################################
+
+
+### LIBRARIES
+import numpy as np
+import pandas as pd
+
+
+### FUNCTIONS
+MISSING_PERIOD = -1  # sentinel for rows whose period could not be parsed (e.g. year_var '.')
+
+FREQUENCIES = ('month', 'quarter', 'financial_year', 'calendar_year')
+
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12,
+}
+# Sheet names and file names use abbreviations (e.g. 'June03', 'Sep03', 'Mar04')
+MONTHS.update({name[:3]: number for name, number in list(MONTHS.items())})
+MONTHS['sept'] = 9
+
+
+def month_ordinal(year, month):
+    """Monthly ordinal (year * 12 + month - 1) for scalars or arrays of years and months."""
+    year = np.asarray(year, dtype=np.int32)
+    month = np.asarray(month, dtype=np.int32)
+    return year * 12 + month - 1
+
+
+def _to_int(values):
+    """Coerce years or quarter numbers (strings, floats, '.') to float, with NaN where unparseable."""
+    return pd.to_numeric(pd.Series(values).astype(str).str.extract(r'(\d+)', expand=False), errors='coerce').to_numpy()
+
+
+def _finalise(period):
+    """Replace NaN with MISSING_PERIOD and return int32 keys."""
+    period = np.asarray(period, dtype=float)
+    return np.where(np.isnan(period), MISSING_PERIOD, period).astype(np.int32)
+
+
+def encode_financial_quarter(year, quarter):
+    """
+    Encode financial year start + quarter ('Q1'..'Q4') as the monthly ordinal of the quarter end.
+    Quarters that are missing ('.') are treated as annual and keyed on the end of the financial year.
+    """
+    fy = _to_int(year)
+    q = _to_int(quarter)
+    q = np.where(np.isnan(q), 4, q)
+    return _finalise(fy * 12 + 3 * q + 2)
+
+
+def encode_financial_year(year):
+    """Encode a financial year start (2000 or '2000-01') as the monthly ordinal of March of the following year."""
+    return _finalise(_to_int(year) * 12 + 14)
+
+
+def encode_period_end(year, period_end):
+    """Encode a calendar year + month name ('June', 'Sep') as a monthly ordinal."""
+    names = pd.Series(period_end).astype(str).str.strip().str.lower()
+    month = names.map(MONTHS).to_numpy(dtype=float)
+    return _finalise(_to_int(year) * 12 + month - 1)
+
+
+def encode_date(dates):
+    """Encode dates (ISO strings or datetimes) as monthly ordinals."""
+    dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+    return _finalise(dates.dt.year.to_numpy(dtype=float) * 12 + dates.dt.month.to_numpy(dtype=float) - 1)
+
+
+def encode_series_period(df):
+    """Detect which period columns a series uses and return its int32 period keys."""
+    if 'period_end' in df.columns:
+        return encode_period_end(df['year'], df['period_end'])
+    if 'date' in df.columns:
+        return encode_date(df['date'])
+    if 'year_var' in df.columns:
+        return encode_financial_quarter(df['year_var'], df['quarter_var'])
+    if 'year' in df.columns and 'quarter' in df.columns:
+        return encode_financial_quarter(df['year'], df['quarter'])
+    if 'year' in df.columns:
+        return encode_financial_year(df['year'])
+    raise ValueError("No recognised period columns (period_end, date, year_var/quarter_var, year/quarter, year)")
+
+
+def add_period_key(df, period_col='period'):
+    """Add the int32 period key to a series, in place, and return it."""
+    df[period_col] = encode_series_period(df)
+    return df
+
+
+def period_year_month(period):
+    """Decode monthly ordinals to (calendar year, month) arrays."""
+    period = np.asarray(period, dtype=np.int32)
+    return period // 12, period % 12 + 1
+
+
+def period_financial_quarter(period):
+    """Decode monthly ordinals to (financial year start, quarter number) arrays."""
+    period = np.asarray(period, dtype=np.int32)
+    fy = (period - 3) // 12
+    quarter = (period - 3) % 12 // 3 + 1
+    return fy, quarter
+
+
+def period_to_target(period, freq):
+    """
+    Map monthly ordinals to integer keys at the requested periodicity.
+    Quarters are the same for financial and calendar years (Apr-Jun is financial Q1 and calendar Q2),
+    financial years run April-March and are keyed by their start year.
+    """
+    period = np.asarray(period, dtype=np.int32)
+    if freq == 'month':
+        return period
+    if freq == 'quarter':
+        return period // 3
+    if freq == 'financial_year':
+        return (period - 3) // 12
+    if freq == 'calendar_year':
+        return period // 12
+    raise ValueError(f"Unknown frequency '{freq}', use one of {FREQUENCIES}")
+
+
+def target_end_month(key, freq):
+    """Monthly ordinal of the last month in each target period (inverse of period_to_target)."""
+    key = np.asarray(key, dtype=np.int32)
+    if freq == 'month':
+        return key
+    if freq == 'quarter':
+        return key * 3 + 2
+    if freq == 'financial_year':
+        return key * 12 + 14  # March of the following year
+    if freq == 'calendar_year':
+        return key * 12 + 11
+    raise ValueError(f"Unknown frequency '{freq}', use one of {FREQUENCIES}")
+
+
+def period_label(period, freq='month'):
+    """Readable labels for monthly ordinals, e.g. '2010-06', '2010-11 Q1', '2010-11', '2010'."""
+    period = np.asarray(period, dtype=np.int32)
+    if freq == 'month':
+        year, month = period_year_month(period)
+        return [f"{y}-{m:02d}" if p != MISSING_PERIOD else '.' for p, y, m in zip(period, year, month)]
+    if freq == 'quarter':
+        fy, quarter = period_financial_quarter(period)
+        return [f"{y}-{(y + 1) % 100:02d} Q{q}" if p != MISSING_PERIOD else '.' for p, y, q in zip(period, fy, quarter)]
+    if freq == 'financial_year':
+        fy, _ = period_financial_quarter(period)
+        return [f"{y}-{(y + 1) % 100:02d}" if p != MISSING_PERIOD else '.' for p, y in zip(period, fy)]
+    if freq == 'calendar_year':
+        year, _ = period_year_month(period)
+        return [str(y) if p != MISSING_PERIOD else '.' for p, y in zip(period, year)]
+    raise ValueError(f"Unknown frequency '{freq}', use one of {FREQUENCIES}")
@@ -0,0 +1,385 @@
+##########################################
+
+# This python script runs the build stages of every series as a DAG
+# Each stage declares its inputs (raw data folders or files written by other stages), its code and its outputs.
+# The code of a python stage is its script and the local modules it imports (found by parsing the imports)
+# A stage is stale when an output is missing or changed, or when the hash of its inputs and code differs from the
+# last successful run. Only stale stages are re-run, and stages of independent series run in parallel
+# The extractors are interactive, so raw data folders are treated as sources rather than stages
+# Usage:
+#   python pipeline.py                 run every stale stage
+#   python pipeline.py sf_clean        run sf_clean and whatever it depends on, if stale
+#   python pipeline.py --dry-run       show which stages are stale without running them
+#   python pipeline.py --mark-fresh    record the current inputs and outputs as up to date without running anything
+#   python pipeline.py --profile       profile the build stages run by the stage processes (see profiling.py)
+
+##########################################
+
+
+### LIBRARIES
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from incremental import current_fingerprint # file hashes with stat-based reuse
+from instrument import instrumented_run, stage as instrument_stage # per-stage run report
+from profiling import enable as enable_profiling # opt-in profiling, passed on to the stage processes
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+SCRIPTS_DIR = BASE_DIR / "scripts"
+STATE_PATH = Path(os.getenv("PIPELINE_STATE", BASE_DIR / "rawdata" / ".build-state" / "pipeline.json"))
+
+RAW = BASE_DIR / "rawdata"
+DATA = BASE_DIR / "data"
+TRUST_LOOKUP = DATA / "org-changes" / "trust_lookup_uncomplicated_changes.csv"
+ORG_CHANGE_PATHS = DATA / "org-changes" / "all_org_changes_paths_2000_2018.csv"
+SF_DIR = DATA / "supporting-facilities"
+STORE = DATA / "store"
+# Series published by the store stage (supporting_facilities is published by sf_clean, the rest by their builders)
+STORE_SERIES = ["supporting_facilities_org_adj", "beds_2000_10", "beds_2010_24", "critical_care_beds"]
+
+
+def python_code(script):
+    """
+    Code of a python stage: its script and the local modules it imports, transitively (imports inside functions
+    included). Modules are looked up next to the importing file, then in scripts/.
+    """
+    found, todo = set(), [Path(script)]
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.add(path)
+        for node in ast.walk(ast.parse(path.read_text(), filename=str(path))):
+            if isinstance(node, ast.Import):
+                names = [alias.name.split('.')[0] for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module.split('.')[0]]
+            else:
+                continue
+            for name in names:
+                todo.extend(next(([folder / f"{name}.py"] for folder in (path.parent, SCRIPTS_DIR)
+                                  if (folder / f"{name}.py").exists()), []))
+    return sorted(found)
+
+
+def stage(name, inputs, outputs, code, command, shared=()):
+    """
+    Stage definition; paths are absolute, command is run from the repository root.
+    shared outputs are also rewritten by other stages (the store manifest): stages reading them run after this one,
+    but their hash is not checked, so another stage rewriting them does not make this one stale.
+    """
+    return {'name': name, 'inputs': [Path(p) for p in inputs], 'outputs': [Path(p) for p in outputs],
+            'code': [Path(p) for p in code], 'command': command, 'shared': [Path(p) for p in shared]}
+
+
+STAGES = [
+    # Supporting facilities: raw -> appended -> clean -> org-change adjusted
+    stage('sf_append', [RAW / "supporting-facilities"], [SF_DIR / "supporting-facilities.csv"],
+          python_code(SCRIPTS_DIR / "build_datasets_main.py"),
+          [sys.executable, SCRIPTS_DIR / "build_datasets_main.py", "--stage", "append"]),
+    stage('sf_clean', [SF_DIR / "supporting-facilities.csv"],
+          [SF_DIR / "supporting-facilities_clean.csv", STORE / "supporting_facilities"],
+          python_code(SCRIPTS_DIR / "build_datasets_main.py"),
+          [sys.executable, SCRIPTS_DIR / "build_datasets_main.py", "--stage", "clean"], shared=[STORE / "manifest.json"]),
+    stage('sf_org_adj', [SF_DIR / "supporting-facilities_clean.csv", TRUST_LOOKUP],
+          [SF_DIR / "supporting-facilities_clean_org_change_adj.csv"],
+          [SCRIPTS_DIR / "supporting-facilities" / "clean_org_changes_supporting_facilities.R"],
+          ["Rscript", SCRIPTS_DIR / "supporting-facilities" / "clean_org_changes_supporting_facilities.R"]),
+    # Organisation changes
+    stage('org_change_paths', [RAW / "organisational-changes"], [ORG_CHANGE_PATHS],
+          [SCRIPTS_DIR / "org-changes" / "build_all_org_changes.R"],
+          ["Rscript", SCRIPTS_DIR / "org-changes" / "build_all_org_changes.R"]),
+    stage('trust_lookup', [RAW / "organisational-changes", ORG_CHANGE_PATHS], [TRUST_LOOKUP],
+          [SCRIPTS_DIR / "org-changes" / "build_trust_lookup.R"],
+          ["Rscript", SCRIPTS_DIR / "org-changes" / "build_trust_lookup.R"]),
+    # KH03 available and occupied beds
+    stage('beds', [RAW / "available-and-occupied-beds"],
+          [DATA / "available-and-occupied-beds" / "overnight_day_beds_2000_10_clean.csv",
+           DATA / "available-and-occupied-beds" / "overnight_day_beds_2010_24_clean.csv"],
+          python_code(SCRIPTS_DIR / "available-and-occupied-beds" / "build_datasets_overnight_day_beds.py"),
+          [sys.executable, SCRIPTS_DIR / "available-and-occupied-beds" / "build_datasets_overnight_day_beds.py"]),
+    stage('beds_org_adj', [DATA / "available-and-occupied-beds" / "overnight_day_beds_2000_10_clean.csv",
+                           DATA / "available-and-occupied-beds" / "overnight_day_beds_2010_24_clean.csv", TRUST_LOOKUP],
+          [DATA / "available-and-occupied-beds" / "overnight_day_beds_2000_24_clean.csv"],
+          [SCRIPTS_DIR / "available-and-occupied-beds" / "clean_org_changes_overnight_day_beds.R"],
+          ["Rscript", SCRIPTS_DIR / "available-and-occupied-beds" / "clean_org_changes_overnight_day_beds.R"]),
+    # Critical care beds
+    stage('critical_care_beds', [RAW / "critical-care-beds", TRUST_LOOKUP],
+          [DATA / "critical-care-beds" / "critical_care_beds_2002_20_clean.csv"],
+          [SCRIPTS_DIR / "critical-care-beds" / "build_datasets_critical_care_beds.R"],
+          ["Rscript", SCRIPTS_DIR / "critical-care-beds" / "build_datasets_critical_care_beds.R"]),
+    stage('critical_care_store', [RAW / "critical-care-beds" / "after-2010"], [STORE / "critical_care_sitrep"],
+          python_code(SCRIPTS_DIR / "critical-care-beds" / "build_datasets_critical_care_beds.py"),
+          [sys.executable, SCRIPTS_DIR / "critical-care-beds" / "build_datasets_critical_care_beds.py"],
+          shared=[STORE / "manifest.json"]),
+    # RTT waiting times
+    stage('wait_times', [RAW / "wait-times", TRUST_LOOKUP],
+          [DATA / "wait-times" / f"rtt_{pathway}_jan07_today.csv" for pathway in ("admitted", "non_admitted", "incomplete")],
+          [SCRIPTS_DIR / "wait-times" / "build_datasets_wait_times.R"],
+          ["Rscript", SCRIPTS_DIR / "wait-times" / "build_datasets_wait_times.R"]),
+    stage('rtt_store', [RAW / "wait-times"], [STORE / "rtt_provider"],
+          python_code(SCRIPTS_DIR / "wait-times" / "build_datasets_wait_times.py"),
+          [sys.executable, SCRIPTS_DIR / "wait-times" / "build_datasets_wait_times.py"], shared=[STORE / "manifest.json"]),
+    # Partitioned store of the built series (every stage that publishes rewrites the manifest)
+    stage('store', [SF_DIR / "supporting-facilities_clean_org_change_adj.csv",
+                    DATA / "available-and-occupied-beds" / "overnight_day_beds_2000_10_clean.csv",
+                    DATA / "available-and-occupied-beds" / "overnight_day_beds_2010_24_clean.csv",
+                    DATA / "critical-care-beds" / "critical_care_beds_2002_20_clean.csv"],
+          [STORE / series for series in STORE_SERIES], python_code(SCRIPTS_DIR / "dataset_store.py"),
+          [sys.executable, SCRIPTS_DIR / "dataset_store.py", *STORE_SERIES], shared=[STORE / "manifest.json"]),
+    # Coverage and period-gap report of every series in the store (series not built yet are left out of the report)
+    stage('coverage', [STORE / "manifest.json"],
+          [RAW / ".build-state" / "reports" / "coverage.json"],
+          python_code(SCRIPTS_DIR / "coverage_report.py"),
+          [sys.executable, SCRIPTS_DIR / "coverage_report.py"]),
+    # Change log of every series against its previous build
+    stage('build_diff', [STORE / "manifest.json"],
+          [RAW / ".build-state" / "diffs"],
+          python_code(SCRIPTS_DIR / "build_diff.py"),
+          [sys.executable, SCRIPTS_DIR / "build_diff.py"]),
+]
+
+
+### FUNCTIONS
+def build_graph(stages):
+    """Dependencies of each stage: the stages that write one of its inputs."""
+    writers = {}
+    for s in stages:
+        for output in s['outputs'] + s['shared']:
+            writers.setdefault(output, set()).add(s['name'])
+    deps = {s['name']: sorted(set().union(*(writers.get(i, set()) for i in s['inputs'])) - {s['name']}) for s in stages}
+    # Check for cycles (depth-first search)
+    visiting, done = set(), set()
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle in stage graph at {name}")
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+    for name in deps:
+        visit(name)
+    return deps
+
+
+def upstream(targets, deps):
+    """The target stages and everything they depend on."""
+    selected, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(deps[name])
+    return selected
+
+
+def load_state(state_path=STATE_PATH):
+    """Signatures of the last successful run of each stage, and cached file hashes."""
+    if not Path(state_path).exists():
+        return {'stages': {}, 'files': {}}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state, state_path=STATE_PATH):
+    """Write the pipeline state atomically."""
+    state_path = Path(state_path)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def _files_under(path):
+    """Files of an input: the path itself, or every non-hidden file below a folder."""
+    if path.is_file():
+        return [path]
+    return sorted(p for p in path.rglob('*') if p.is_file() and not any(part.startswith('.') for part in p.relative_to(path).parts))
+
+
+def path_hash(path, file_cache):
+    """Content hash of a file or folder; file hashes are reused while size and modification time are unchanged."""
+    h = hashlib.sha256()
+    for file in _files_under(path):
+        key = str(file)
+        file_cache[key] = current_fingerprint(file, file_cache.get(key))
+        h.update(f"{file.relative_to(path) if file != path else file.name}:{file_cache[key]['hash']}\n".encode())
+    return h.hexdigest()
+
+
+def stage_signature(s, file_cache):
+    """Hash of everything a stage reads: its inputs and its code."""
+    h = hashlib.sha256()
+    for path in s['inputs'] + s['code']:
+        h.update(f"{path.relative_to(BASE_DIR)}={path_hash(path, file_cache) if path.exists() else 'missing'}\n".encode())
+    return h.hexdigest()
+
+
+def stale_reason(s, state, file_cache):
+    """Why a stage needs to run, or None when it is up to date."""
+    missing_inputs = [p for p in s['inputs'] if not p.exists()]
+    if missing_inputs:
+        return 'missing input ' + ', '.join(str(p.relative_to(BASE_DIR)) for p in missing_inputs)
+    record = state['stages'].get(s['name'])
+    if record is None:
+        return 'never run'
+    if any(not p.exists() for p in s['outputs'] + s['shared']):
+        return 'missing output'
+    if record['signature'] != stage_signature(s, file_cache):
+        return 'inputs or code changed'
+    for p in s['outputs']:
+        if record['outputs'].get(str(p.relative_to(BASE_DIR))) != path_hash(p, file_cache):
+            return 'output changed'
+    return None
+
+
+def record_stage(s, state, file_cache):
+    """Store the signature and output hashes of a successful (or adopted) stage."""
+    state['stages'][s['name']] = {
+        'signature': stage_signature(s, file_cache),
+        'outputs': {str(p.relative_to(BASE_DIR)): path_hash(p, file_cache) for p in s['outputs'] if p.exists()},
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run_stage(s):
+    """
+    Run the command of a stage from the repository root; returns (returncode, seconds).
+    CPU time and peak RSS of the stage process are added to the run report where os.wait4 is available.
+    """
+    start = time.perf_counter()
+    command = [str(part) for part in s['command']]
+    print(f"[{s['name']}] running: {' '.join(command)}")
+    with instrument_stage(s['name'], profile=False, command=' '.join(command)) as record:
+        try:
+            proc = subprocess.Popen(command, cwd=BASE_DIR, stdin=subprocess.DEVNULL)
+            if hasattr(os, 'wait4'):
+                _, wait_status, usage = os.wait4(proc.pid, 0)
+                returncode = proc.returncode = os.waitstatus_to_exitcode(wait_status)
+                record['child_cpu_s'] = usage.ru_utime + usage.ru_stime
+                record['child_peak_rss_mb'] = usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+            else:
+                returncode = proc.wait()
+        except FileNotFoundError as e:
+            print(f"[{s['name']}] could not start: {e}")
+            returncode = 127
+        record['returncode'] = returncode
+        if returncode != 0:
+            record['status'] = 'failed'
+    return returncode, time.perf_counter() - start
+
+
+def run_pipeline(stages=STAGES, targets=None, jobs=4, dry_run=False, mark_fresh=False, state_path=STATE_PATH):
+    """
+    Run the stale stages in dependency order, independent stages in parallel.
+    Returns {stage: status}, where status is one of 'fresh', 'ran', 'failed', 'blocked', 'skipped' or 'stale'
+    (dry run).
+    """
+    by_name = {s['name']: s for s in stages}
+    deps = build_graph(stages)
+    selected = upstream(targets, deps) if targets else set(by_name)
+    state = load_state(state_path)
+    file_cache = state['files']
+    status = {}
+    pending = {name for name in selected}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            # Stages whose dependencies have all finished
+            for name in sorted(pending):
+                if any(dep in pending or dep in running.values() for dep in deps[name] if dep in selected):
+                    continue
+                pending.discard(name)
+                s = by_name[name]
+                if any(status.get(dep) in ('failed', 'blocked') for dep in deps[name]):
+                    status[name] = 'blocked'
+                    continue
+                if mark_fresh:
+                    if all(p.exists() for p in s['outputs'] + s['shared']):
+                        record_stage(s, state, file_cache)
+                        status[name] = 'fresh'
+                    else:
+                        status[name] = 'skipped'
+                    continue
+                upstream_stale = any(status.get(dep) == 'stale' for dep in deps[name])
+                reason = 'upstream stale' if upstream_stale else stale_reason(s, state, file_cache)
+                if reason is None:
+                    status[name] = 'fresh'
+                elif reason.startswith('missing input'):
+                    print(f"[{name}] skipped: {reason}")
+                    status[name] = 'skipped'
+                elif dry_run:
+                    print(f"[{name}] stale: {reason}")
+                    status[name] = 'stale'
+                else:
+                    print(f"[{name}] stale: {reason}")
+                    running[pool.submit(run_stage, s)] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode == 0:
+                    record_stage(by_name[name], state, file_cache)
+                    status[name] = 'ran'
+                    print(f"[{name}] finished in {seconds:.1f}s")
+                else:
+                    status[name] = 'failed'
+                    print(f"[{name}] failed with exit code {returncode} after {seconds:.1f}s")
+                save_state(state, state_path)
+
+    if not dry_run:
+        save_state(state, state_path)
+    return status
+
+
+### MAIN EXECUTION
+def main():
+    parser = argparse.ArgumentParser(description="Run the stale build stages of every series")
+    parser.add_argument('targets', nargs='*', help="stages to bring up to date (default: all)")
+    parser.add_argument('--jobs', type=int, default=int(os.getenv("PIPELINE_JOBS", 4)), help="stages run in parallel")
+    parser.add_argument('--dry-run', action='store_true', help="only report which stages are stale")
+    parser.add_argument('--mark-fresh', action='store_true', help="adopt the existing outputs as up to date")
+    parser.add_argument('--profile', nargs='?', const='all', default=None,
+                        help="profile the stages inside the stage processes ('all' or comma-separated stage names)")
+    args = parser.parse_args()
+    if args.profile:
+        enable_profiling(args.profile)
+
+    unknown = [t for t in args.targets if t not in {s['name'] for s in STAGES}]
+    if unknown:
+        print(f"Unknown stages: {unknown}. Stages: {[s['name'] for s in STAGES]}")
+        return 2
+
+    if args.dry_run or args.mark_fresh:
+        status = run_pipeline(STAGES, args.targets, args.jobs, args.dry_run, args.mark_fresh)
+    else:
+        with instrumented_run('pipeline'):
+            status = run_pipeline(STAGES, args.targets, args.jobs)
+    print("-" * 50)
+    for s in STAGES:
+        if s['name'] in status:
+            print(f"{s['name']:<20} {status[s['name']]}")
+    return 1 if any(v in ('failed', 'blocked') for v in status.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
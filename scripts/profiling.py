@@ -0,0 +1,164 @@
+##########################################
+
+# This python script adds opt-in profiling to every instrumented stage (see instrument.py), without code changes
+# Enable it with an environment variable (or --profile on the builder and pipeline command lines):
+#   PROFILE=all                         profile every stage
+#   PROFILE=read_dataset,filter_rows    profile only these stages
+#   PROFILE_MODE=cprofile,sample        cProfile dump (.prof, open with pstats or snakeviz) and/or a sampling profile
+#                                       written as collapsed stacks (.collapsed, for flamegraph.pl or speedscope)
+#   PROFILE_INTERVAL=0.005              sampling interval in seconds
+#   PROFILE_MEMORY=1                    also track allocations with tracemalloc (top allocation sites, .alloc.txt)
+#   PROFILE_DIR=...                     output folder (default rawdata/.build-state/profiles/)
+# One set of files is written per stage (and file), e.g. read_dataset-Supporting_Facilities_Q1_2010-11-3.prof
+
+##########################################
+
+
+### LIBRARIES
+import cProfile
+import collections
+import contextlib
+import datetime
+import os
+import re
+import sys
+import threading
+import tracemalloc
+from pathlib import Path
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", BASE_DIR / "rawdata" / ".build-state" / "profiles"))
+
+_settings = {'stages': os.getenv("PROFILE", ""),
+             'modes': set(os.getenv("PROFILE_MODE", "cprofile,sample").split(',')),
+             'interval': float(os.getenv("PROFILE_INTERVAL", 0.005)),
+             'memory': os.getenv("PROFILE_MEMORY") == '1'}
+_state = {'count': 0, 'cprofile_active': False, 'output_dir': None}
+
+
+### FUNCTIONS
+def enable(stages='all'):
+    """Turn profiling on from code or a CLI switch; the setting is passed on to child processes."""
+    _settings['stages'] = stages
+    os.environ['PROFILE'] = stages
+
+
+def enable_from_argv(argv=None):
+    """Enable profiling when --profile or --profile=<stages> is on the command line (the switch is removed)."""
+    argv = sys.argv if argv is None else argv
+    for arg in list(argv):
+        if arg == '--profile' or arg.startswith('--profile='):
+            enable(arg.split('=', 1)[1] if '=' in arg else 'all')
+            argv.remove(arg)
+
+
+def wants(stage):
+    """Whether a stage should be profiled under the current settings."""
+    stages = _settings['stages'].strip()
+    if stages in ('', '0'):
+        return False
+    return stages in ('1', 'all') or stage in {s.strip() for s in stages.split(',')}
+
+
+def output_dir():
+    """Profile folder of this process, created on first use."""
+    if _state['output_dir'] is None:
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        _state['output_dir'] = PROFILE_DIR / f"{stamp}-{os.getpid()}"
+        _state['output_dir'].mkdir(parents=True, exist_ok=True)
+    return _state['output_dir']
+
+
+def frame_label(code):
+    """Label of a stack frame in the collapsed stacks: function (file:line)."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread at a fixed interval and counts identical stacks."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path):
+        """Collapsed stack format: one 'frame;frame;frame count' line per distinct stack."""
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def write_allocations(snapshot, path, limit=30):
+    """Top allocation sites of a tracemalloc snapshot."""
+    stats = snapshot.statistics('lineno')
+    with open(path, 'w') as f:
+        f.write(f"Total traced: {sum(s.size for s in stats) / 2**20:.1f} MB\n")
+        for s in stats[:limit]:
+            f.write(f"{s.size / 2**20:9.2f} MB {s.count:9d} blocks  {s.traceback}\n")
+
+
+@contextlib.contextmanager
+def profile_stage(stage, file=None):
+    """
+    Profile a block when the stage is selected, yielding the list of files written (empty when not profiled).
+    Nested stages are sampled but not cProfiled, since only one cProfile profiler can be active at a time.
+    """
+    outputs = []
+    if not wants(stage):
+        yield outputs
+        return
+    _state['count'] += 1
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', f"{stage}-{Path(file).stem}" if file else stage)
+    base = output_dir() / f"{name}-{_state['count']}"
+
+    profiler = None
+    if 'cprofile' in _settings['modes'] and not _state['cprofile_active']:
+        profiler = cProfile.Profile()
+        _state['cprofile_active'] = True
+        profiler.enable()
+    sampler = None
+    if 'sample' in _settings['modes']:
+        sampler = StackSampler(threading.get_ident(), _settings['interval'])
+        sampler.start()
+    started_tracing = _settings['memory'] and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield outputs
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _state['cprofile_active'] = False
+            profiler.dump_stats(f"{base}.prof")
+            outputs.append(f"{base}.prof")
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(f"{base}.collapsed")
+            outputs.append(f"{base}.collapsed")
+        if _settings['memory'] and tracemalloc.is_tracing():
+            write_allocations(tracemalloc.take_snapshot(), f"{base}.alloc.txt")
+            outputs.append(f"{base}.alloc.txt")
+            if started_tracing:
+                tracemalloc.stop()
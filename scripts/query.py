@@ -0,0 +1,107 @@
+##########################################
+
+# This python script exposes every built series as a view in an embedded, in-process DuckDB database
+# Series are read from the partitioned store (data/store/, see dataset_store.py) where they have been published,
+# otherwise from the CSVs in data/. The org-change lookup tables are views too
+# Example:
+#   python query.py "SELECT org_code, period, nr_operating_theatres FROM supporting_facilities_org_adj LIMIT 10"
+
+##########################################
+
+
+### LIBRARIES
+# pip install duckdb
+import duckdb
+import csv
+import sys
+from dataset_store import DATA_DIR, STORE_DIR, SERIES, load_manifest # partitioned dataset store
+
+
+### SETTINGS
+# Lookup tables: view name -> csv path relative to DATA_DIR
+LOOKUPS = {
+    'org_changes': 'org-changes/all_org_changes_paths_2000_2018.csv',
+    'trust_lookup': 'org-changes/trust_lookup_uncomplicated_changes.csv',
+}
+
+_connection = None  # shared in-process connection, created on first use
+
+
+### FUNCTIONS
+def _csv_types(csv_path):
+    """Force organisation codes and names to VARCHAR so codes like '00F' or '5A1' are never parsed as numbers."""
+    with open(csv_path, newline='') as f:
+        header = next(csv.reader(f))
+    return {col: 'VARCHAR' for col in header if col.endswith('_code') or col.endswith('_name') or col.startswith('new_code')}
+
+
+def _csv_view_sql(name, csv_path):
+    types = ', '.join(f"'{col}': '{dtype}'" for col, dtype in _csv_types(csv_path).items())
+    return (f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_csv('{csv_path.as_posix()}', header = true, "
+            f"nullstr = 'NA', types = {{{types}}})")
+
+
+def register_views(con, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Create one view per built series and lookup table, preferring the partitioned store over the CSVs."""
+    manifest = load_manifest(store_dir)
+    views = {}
+    for name, (rel_path, _) in SERIES.items():
+        if name in manifest['series'] and manifest['series'][name]['partitions']:
+            # Partitions may be nested (e.g. pathway/month) and add columns over time. Folder names are not read
+            # as columns (hive partitioning), so a view has the same columns as the data in the store
+            pattern = (store_dir / name / '**' / 'part.parquet').as_posix()
+            con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet('{pattern}', "
+                        f"union_by_name = true, hive_partitioning = false)")
+            views[name] = 'store'
+        elif rel_path is not None and (data_dir / rel_path).exists():
+            con.execute(_csv_view_sql(name, data_dir / rel_path))
+            views[name] = 'csv'
+    for name, rel_path in LOOKUPS.items():
+        if (data_dir / rel_path).exists():
+            con.execute(_csv_view_sql(name, data_dir / rel_path))
+            views[name] = 'csv'
+    return views
+
+
+def connect(database=':memory:', data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """Open a DuckDB connection with every series and lookup registered as a view."""
+    con = duckdb.connect(database)
+    register_views(con, data_dir, store_dir)
+    return con
+
+
+def get_connection():
+    """Shared connection for this process, so views are only registered once."""
+    global _connection
+    if _connection is None:
+        _connection = connect()
+    return _connection
+
+
+def query(sql, params=None, con=None):
+    """Run SQL against the series views and return the result as a DataFrame."""
+    con = con or get_connection()
+    return con.execute(sql, params or []).df()
+
+
+def list_views(con=None):
+    """Names and column types of the registered views."""
+    con = con or get_connection()
+    return con.execute("SELECT table_name, column_name, data_type FROM information_schema.columns "
+                       "ORDER BY table_name, ordinal_position").df()
+
+
+### MAIN EXECUTION
+def main():
+    if len(sys.argv) < 2:
+        views = list_views()
+        for name, cols in views.groupby('table_name', sort=True):
+            print(f"{name}: {', '.join(cols['column_name'])}")
+        return views
+    result = query(sys.argv[1])
+    print(result.to_string(max_rows=50))
+    return result
+
+
+if __name__ == "__main__":
+    result = main()
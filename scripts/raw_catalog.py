@@ -0,0 +1,139 @@
+##########################################
+
+# This python script keeps a catalog of the raw files of a series in SQLite (rawdata/.build-state/catalog.sqlite)
+# For every raw file it records its size, modification time and hash, and the structure found when it was first
+# read: the year and quarters parsed from its name, its layout, its sheet names with their row counts and the
+# header row of each sheet. Refreshing the catalog only stats the files; files are hashed when their size or
+# modification time changed and opened only when their hash changed, so listing and planning a build do not open
+# any unchanged workbook
+# The structure is filled in by a describe function of the builder (see build_datasets_main.describe_file). Files
+# it could not describe are listed without their structure but not catalogued, so they are read again on the
+# next refresh
+# Usage:
+#   python raw_catalog.py [raw dir]    list the catalogued files of a raw folder (supporting facilities by default)
+
+##########################################
+
+
+### LIBRARIES
+import datetime
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from incremental import file_hash # SHA-256 of a raw file
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+CATALOG_PATH = Path(os.getenv("RAW_CATALOG", BASE_DIR / "rawdata" / ".build-state" / "catalog.sqlite"))
+JSON_FIELDS = ('quarters', 'sheets', 'header_rows', 'details')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    raw_dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    year TEXT,
+    quarters TEXT,      -- JSON list, e.g. ["Q1", "Q2", "Q3", "Q4"] for All_quarters workbooks
+    layout TEXT,
+    sheets TEXT,        -- JSON {sheet name: number of rows}, in workbook order
+    header_rows TEXT,   -- JSON {sheet name: header row index or null}
+    details TEXT,       -- JSON, anything else the describe function records
+    catalogued_at TEXT NOT NULL,
+    PRIMARY KEY (raw_dir, name)
+)
+"""
+
+
+### FUNCTIONS
+def connect(db_path=CATALOG_PATH):
+    """Open (and create) the catalog database."""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.row_factory = sqlite3.Row
+    con.execute(SCHEMA)
+    return con
+
+
+def _entry(row):
+    """Catalog row as a dict, with the JSON fields decoded."""
+    entry = dict(row)
+    for field in JSON_FIELDS:
+        entry[field] = json.loads(entry[field]) if entry[field] is not None else None
+    return entry
+
+
+def _json(value):
+    return json.dumps(value) if value is not None else None
+
+
+def entries(con, raw_dir):
+    """Catalogued files of a raw folder, by name."""
+    rows = con.execute("SELECT * FROM files WHERE raw_dir = ? ORDER BY name", (str(raw_dir),))
+    return {row['name']: _entry(row) for row in rows}
+
+
+def refresh(con, raw_dir, describe=None):
+    """
+    Bring the catalog of raw_dir up to date and return its entries as {name: entry}, in name order.
+    Files with unchanged size and modification time are not read; changed files are hashed, and files whose hash
+    changed are passed to describe(path), which returns the structure fields (year, quarters, layout, sheets,
+    header_rows, details), or None when the file could not be read: such files are returned without their
+    structure but not catalogued, so they are described again next time. Files no longer in raw_dir are dropped
+    from the catalog.
+    """
+    raw_dir = Path(raw_dir)
+    known = entries(con, raw_dir)
+    with os.scandir(raw_dir) as it:
+        found = {e.name: e.stat() for e in it if e.is_file()}
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+    undescribed = {}
+    with con:
+        for name in sorted(set(known) - set(found)):
+            con.execute("DELETE FROM files WHERE raw_dir = ? AND name = ?", (str(raw_dir), name))
+        for name, stat in sorted(found.items()):
+            previous = known.get(name)
+            if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+                continue
+            digest = file_hash(raw_dir / name)
+            if previous and previous['hash'] == digest:  # touched but not changed
+                con.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE raw_dir = ? AND name = ?",
+                            (stat.st_size, stat.st_mtime_ns, str(raw_dir), name))
+                continue
+            structure = describe(raw_dir / name) if describe is not None else {}
+            if structure is None:  # not described: not cached, so the next refresh tries again
+                con.execute("DELETE FROM files WHERE raw_dir = ? AND name = ?", (str(raw_dir), name))
+                undescribed[name] = {'raw_dir': str(raw_dir), 'name': name, 'size': stat.st_size,
+                                     'mtime_ns': stat.st_mtime_ns, 'hash': digest, 'year': None, 'layout': None,
+                                     'catalogued_at': None, **{field: None for field in JSON_FIELDS}}
+                continue
+            con.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (str(raw_dir), name, stat.st_size, stat.st_mtime_ns, digest, structure.get('year'),
+                         _json(structure.get('quarters')), structure.get('layout'), _json(structure.get('sheets')),
+                         _json(structure.get('header_rows')), _json(structure.get('details')), now))
+    return dict(sorted({**entries(con, raw_dir), **undescribed}.items()))
+
+
+### MAIN EXECUTION
+def main():
+    raw_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else BASE_DIR / "rawdata" / "supporting-facilities"
+    con = connect()
+    catalogued = entries(con, raw_dir.resolve()) or entries(con, raw_dir)
+    if not catalogued:
+        print(f"No files of {raw_dir} in the catalog {CATALOG_PATH} (it is filled in by the builds)")
+        return
+    for i, (name, entry) in enumerate(catalogued.items(), 1):
+        headers = entry['header_rows'] or {}
+        print(f"{i}. {name} ({entry['size']/1024:.1f} KB) year {entry['year']} {entry['layout'] or ''} "
+              f"{len(entry['sheets'] or {})} sheets, header rows {list(headers.values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+##########################################
+
+# This python script converts a built series to a different periodicity (month, quarter, financial year, calendar year)
+# Periods are the integer monthly ordinals from periods.py (the month in which each period ends),
+# so that every resample is a single grouped reduction on integer keys
+
+##########################################
+
+
+### LIBRARIES
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import os
+from periods import MISSING_PERIOD, period_to_target, target_end_month, encode_date # integer period keys
+
+
+### FUNCTIONS
+def resample(df, to, rules, id_cols=('org_code',), period_col='period', count_col='n_periods'):
+    """
+    Resample a series to a (coarser) periodicity with per-variable rules.
+    rules maps each output column to one of:
+      - 'sum'  : total over the period (e.g. admissions)
+      - 'mean' : average over the period (e.g. beds available)
+      - 'last' : end-of-period value, the latest non-missing observation (e.g. stock counts)
+      - ('ratio', numerator, denominator) : recomputed as sum(numerator) / sum(denominator)
+    The period column of the output holds the monthly ordinal of the month each target period ends in,
+    and count_col holds the number of source periods that went into each row.
+    """
+    id_cols = list(id_cols)
+    keys = id_cols + ['_target']
+
+    # Only the columns the rules need are carried into the reduction
+    value_cols = set()
+    for out_col, rule in rules.items():
+        if isinstance(rule, tuple):
+            value_cols.update(rule[1:])
+        else:
+            value_cols.add(out_col)
+    df = df[df[period_col] != MISSING_PERIOD]
+    work = df[id_cols + [period_col]].copy()
+    for col in value_cols:
+        work[col] = pd.to_numeric(df[col], errors='coerce')
+    work['_target'] = period_to_target(df[period_col].to_numpy(), to)
+
+    # A single sort makes 'last' pick the end-of-period observation
+    if any(rule == 'last' for rule in rules.values()):
+        work = work.sort_values(id_cols + [period_col], kind='stable')
+
+    aggs = {count_col: (period_col, 'nunique')}
+    ratios = {}
+    for out_col, rule in rules.items():
+        if isinstance(rule, tuple):
+            if rule[0] != 'ratio' or len(rule) != 3:
+                raise ValueError(f"Invalid rule for {out_col}: {rule}")
+            _, num, den = rule
+            aggs[f'_num_{out_col}'] = (num, 'sum')
+            aggs[f'_den_{out_col}'] = (den, 'sum')
+            ratios[out_col] = (f'_num_{out_col}', f'_den_{out_col}')
+        elif rule in ('sum', 'mean', 'last'):
+            aggs[out_col] = (out_col, rule)
+        else:
+            raise ValueError(f"Invalid rule for {out_col}: {rule}")
+
+    out = work.groupby(keys, sort=True, dropna=False).agg(**aggs).reset_index()
+
+    for out_col, (num, den) in ratios.items():
+        denominator = out[den].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[out_col] = np.where(denominator != 0, out[num].to_numpy(dtype=float) / denominator, np.nan)
+        out = out.drop(columns=[num, den])
+
+    out[period_col] = target_end_month(out['_target'].to_numpy(), to)
+    out = out.drop(columns='_target')
+    return out[id_cols + [period_col, count_col] + list(rules)]
+
+
+### MAIN EXECUTION
+def main():
+    # Defining directories
+    try:
+        BASE_DIR = Path(__file__).resolve().parent.parent
+    except NameError:
+        BASE_DIR = Path.cwd()
+    DATA_DIR = os.getenv("DATA_DIR", BASE_DIR / "data")
+
+    # Example: monthly critical care beds to financial years
+    df = pd.read_csv(Path(DATA_DIR) / "critical-care-beds" / "critical_care_beds_2002_20_clean.csv")
+    df['period'] = encode_date(df['date'])
+    rules = {
+        'number_of_adult_critical_care_beds_open': 'mean',
+        'number_of_adult_critical_care_beds_occupied': 'mean',
+        'adult_critical_care_beds_percent_occupied': ('ratio', 'number_of_adult_critical_care_beds_occupied',
+                                                      'number_of_adult_critical_care_beds_open'),
+        'number_of_non_medical_critical_care_transfers': 'sum',
+    }
+    out = resample(df, 'financial_year', rules)
+    print(out.head(10))
+    return out
+
+
+if __name__ == "__main__":
+    resampled = main()
@@ -0,0 +1,115 @@
+##########################################
+
+# This python script resolves revised releases when a raw folder holds both the original and a revised file for
+# the same period (the NHS republishes files as 'revised', 'v2', 'updated', ...)
+# - revision_rank: orders files by the revision marker in their name (the extractors name files after the link
+#   text), then by download date (modification time of the raw file)
+# - overlapping_files: files whose periods overlap, to report them. Files whose quarter is unknown ('.', keyed on
+#   Q4) are left out: they do not really cover Q4, so they are neither reported nor deduplicated against it
+# - drop_superseded: while the sorted runs are merged (see streaming.py), the blocks of a period that comes from
+#   more than one file are concatenated with the rank of their file, and one stable sort plus drop_duplicates keeps
+#   the observation of the latest revision for each organisation. Periods from a single file pass through untouched
+# It is called in build_datasets_main.py
+
+##########################################
+
+
+### LIBRARIES
+import os
+import re
+from pathlib import Path
+import pandas as pd
+from header_aliases import coalesce, match_headers # canonical variables of the raw headers
+
+
+### SETTINGS
+# Revision markers in file names, with their rank (higher is later); the number after a marker (v2, revision 3)
+# breaks ties between files with the same marker
+REVISION_MARKERS = [
+    (re.compile(r'(?:^|[_\W])(?:v|version)[_\s-]?(\d+)(?=[_\W]|$)', re.IGNORECASE), 1),
+    (re.compile(r'revis(?:ed|ion)(?:[_\s-]?(\d+))?', re.IGNORECASE), 2),
+    (re.compile(r'(?:updated|amended|corrected|republished)(?:[_\s-]?(\d+))?', re.IGNORECASE), 2),
+]
+RANK_COLUMN = '_revision_rank'
+
+
+### FUNCTIONS
+def revision_rank(filename, raw_dir=None):
+    """
+    Sort key of a file among files for the same period: (marker rank, marker number, download time). Files without
+    a marker rank 0; the download time is the modification time of the raw file (0 if raw_dir is not given).
+    """
+    stem = Path(filename).stem
+    marker, number = max(((rank, int(match.group(1) or 0)) for pattern, rank in REVISION_MARKERS
+                          if (match := pattern.search(stem))), default=(0, 0))
+    path = Path(raw_dir) / filename if raw_dir is not None else None
+    downloaded = os.stat(path).st_mtime_ns if path is not None and path.exists() else 0
+    return marker, number, downloaded
+
+
+def revision_order(runs, raw_dir=None):
+    """
+    Position of each run (by run order) when ranked from the earliest to the latest revision. Runs whose period is
+    not known are not ranked, so drop_superseded passes them through.
+    """
+    ranked = sorted((run for run in runs if run.get('period_known', True)),
+                    key=lambda run: (revision_rank(run['name'] or '', raw_dir), run['order']))
+    return {run['order']: position for position, run in enumerate(ranked)}
+
+
+def overlapping_files(runs):
+    """
+    Pairs of files whose period ranges overlap, as [(earlier file, later file, first period, last period)].
+    Files whose period is not known are left out.
+    """
+    runs = sorted((r for r in runs if r['rows'] and r.get('period_known', True)), key=lambda r: (r['min_period'], r['order']))
+    pairs = []
+    for i, a in enumerate(runs):
+        for b in runs[i + 1:]:
+            if b['min_period'] > a['max_period']:
+                break
+            pairs.append((a['name'], b['name'], b['min_period'], min(a['max_period'], b['max_period'])))
+    return pairs
+
+
+def drop_superseded(blocks, ranks, key_columns, stats=None):
+    """
+    Keep the latest revision of each key in the merged blocks. blocks yields (period, run order, block) in period
+    order; key_columns are the raw headers that hold the organisation code (coalesced, as they change over the
+    years). Rows without an organisation code, and blocks of runs without a rank (period not known), are kept as
+    they are. stats (a dict) counts the dropped rows.
+    """
+    pending, pending_period = [], None
+
+    def resolve(group):
+        unranked = [block for order, block in group if order not in ranks]
+        group = [(order, block) for order, block in group if order in ranks]
+        if len({order for order, _ in group}) < 2:
+            return unranked + [block for _, block in group]
+        df = pd.concat([block.assign(**{RANK_COLUMN: ranks[order]}) for order, block in group], ignore_index=True)
+        columns = [col for col in key_columns if col in df.columns]
+        key = coalesce(df, columns) if columns else pd.Series(None, index=df.index, dtype=object)
+        has_key = key.notna().to_numpy()
+        # One stable sort on the revision rank and one drop_duplicates pass: the last row of each key is the latest
+        ranked = df[has_key].assign(_key=key[has_key]).sort_values(RANK_COLUMN, kind='stable')
+        latest = ranked.drop_duplicates(subset='_key', keep='last').drop(columns='_key')
+        kept = pd.concat([df[~has_key], latest]).sort_index()  # back to the merge order
+        if stats is not None:
+            stats['dropped'] = stats.get('dropped', 0) + len(df) - len(kept)
+            stats['periods'] = stats.get('periods', 0) + 1
+        return unranked + [kept.drop(columns=RANK_COLUMN)]
+
+    for period, order, block in blocks:
+        if pending and period != pending_period:
+            yield from resolve(pending)
+            pending = []
+        pending_period = period
+        pending.append((order, block))
+    if pending:
+        yield from resolve(pending)
+
+
+def organisation_headers(columns, series='supporting_facilities'):
+    """Raw headers that hold the organisation code of a series (e.g. 'OrgID' and 'Organisation Code')."""
+    mapping, _, _ = match_headers(columns, series)
+    return [header for header, canonical in mapping.items() if canonical == 'organisation_code']
@@ -0,0 +1,34 @@
+##########################################
+
+# This python script holds the file selection helpers shared by the extractors and builders
+# It only uses the standard library, so builders can import it without loading the download stack
+# (bs4, requests, selenium) of the extractors
+
+##########################################
+
+
+### FUNCTIONS
+def validate_id_input(selected_files, max_id):
+    """Validate user input for file selection."""
+    selected_ids = []
+    try:
+        if selected_files.lower() == 'all':
+            return list(range(1, max_id + 1))
+        
+        for part in selected_files.split(','):
+            if '-' in part:
+                start, end = map(int, part.split('-'))
+                if start < 1 or end > max_id:
+                    print(f"ID range {start}-{end} out of range. Please enter IDs between 1 and {max_id}")
+                    return None
+                selected_ids.extend(range(start, end + 1))
+            else:
+                id_num = int(part)
+                if id_num < 1 or id_num > max_id:
+                    print(f"ID {id_num} out of range. Please enter IDs between 1 and {max_id}")
+                    return None
+                selected_ids.append(id_num)
+        return selected_ids
+    except ValueError:
+        print("Invalid input format. Please use numbers separated by commas or ranges (e.g., 1,3,5 or 1-3)")
+        return None
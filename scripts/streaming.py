@@ -0,0 +1,102 @@
+##########################################
+
+# This python script streams processed files to an output file with bounded memory
+# Each processed file is sorted by period and spilled to disk as a "run"; runs are then merged in period order
+# (k-way merge of pre-sorted runs) and written block by block, so at most the runs that overlap in period are in
+# memory at once (usually one file) instead of every file plus their concatenation
+# It is called in build_datasets_main.py
+
+##########################################
+
+
+### LIBRARIES
+import pandas as pd
+import numpy as np
+import heapq
+import os
+from pathlib import Path
+
+
+### FUNCTIONS
+def spill_run(df, run_path, order, name=None, period_col='period', period_known=True):
+    """
+    Sort a processed file by period (stable) and write it to disk as a run.
+    Returns the run metadata needed to plan the merge without loading it again; period_known is False for files
+    whose period had to be assumed (e.g. a missing quarter keyed on the end of the year).
+    """
+    df = df.sort_values(by=period_col, kind='stable').reset_index(drop=True)
+    df.columns = [str(c) for c in df.columns]  # header rows can contain numbers; the CSV header is text anyway
+    df.to_pickle(run_path)
+    return {'path': str(run_path), 'order': order, 'name': name, 'rows': int(len(df)), 'columns': list(df.columns),
+            'min_period': int(df[period_col].min()) if len(df) else None,
+            'max_period': int(df[period_col].max()) if len(df) else None, 'period_known': period_known}
+
+
+def union_columns(runs):
+    """Union of the columns of all runs, in order of first appearance (same order as pd.concat)."""
+    columns = []
+    seen = set()
+    for run in sorted(runs, key=lambda r: r['order']):
+        for col in run['columns']:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    return columns
+
+
+def iter_period_blocks(run, period_col='period'):
+    """Load a run and yield (period, block) for each period it contains, in order."""
+    df = pd.read_pickle(run['path'])
+    periods = df[period_col].to_numpy()
+    if len(periods) == 0:
+        return
+    # Runs are sorted, so each period is one contiguous slice
+    boundaries = [0] + (np.flatnonzero(periods[1:] != periods[:-1]) + 1).tolist() + [len(periods)]
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        yield int(periods[start]), df.iloc[start:end]
+
+
+def merge_runs(runs, period_col='period', with_keys=False):
+    """
+    K-way merge of pre-sorted runs, yielding blocks in (period, run order) order. This is the same row order
+    as concatenating the runs by order and stable-sorting on period. A run is only loaded once the merge reaches
+    its first period, and released when exhausted. with_keys yields (period, run order, block) instead.
+    """
+    pending = sorted((r for r in runs if r['rows']), key=lambda r: (r['min_period'], r['order']))
+    heap = []
+    i = 0
+    while i < len(pending) or heap:
+        # Activate every run that starts at or before the smallest period still to be written
+        while i < len(pending) and (not heap or pending[i]['min_period'] <= heap[0][0]):
+            blocks = iter_period_blocks(pending[i], period_col)
+            first = next(blocks, None)
+            if first is not None:
+                heapq.heappush(heap, (first[0], pending[i]['order'], first[1], blocks))
+            i += 1
+        period, order, block, blocks = heapq.heappop(heap)
+        yield (period, order, block) if with_keys else block
+        following = next(blocks, None)
+        if following is not None:
+            heapq.heappush(heap, (following[0], order, following[1], blocks))
+
+
+def write_csv_stream(blocks, columns, output_path, rename=None):
+    """Write blocks to one CSV with a fixed header, aligning each block to the union of columns."""
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    header = [rename.get(c, c) for c in columns] if rename else columns
+    rows = 0
+    with open(tmp_path, 'w', newline='') as f:
+        pd.DataFrame(columns=header).to_csv(f, index=False)
+        for block in blocks:
+            block = block.reindex(columns=columns)
+            block.columns = header
+            block.to_csv(f, index=False, header=False)
+            rows += len(block)
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def read_appended(path):
+    """Read an appended dataset back, keeping the 'NA' markers written by filter_rows as strings."""
+    return pd.read_csv(path, keep_default_na=False, na_values=[''])
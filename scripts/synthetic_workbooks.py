@@ -0,0 +1,330 @@
+##########################################
+
+# This python script generates synthetic NHS workbooks in the layouts of the real raw files, for benchmarks and
+# for trying the builders without downloading anything:
+# - supporting facilities before 2009-10: one 'All_quarters' workbook per year with June03/Sep03/Dec03/Mar04 sheets
+# - supporting facilities from 2009-10: one workbook per quarter with preamble rows above the header
+# - RTT waiting times: monthly provider workbooks with one wide column per week band
+# - critical care beds: monthly SitRep workbooks, with a one-row header (2010-11) or a two-row grouped header
+# - KH03 overnight and day beds: annual workbooks (2000-01 to 2009-10) and quarterly 'NHS Trust by Sector' workbooks
+# Scale multiplies the number of organisations (rows) per sheet; 1x is about the size of the real files
+# Usage:
+#   python synthetic_workbooks.py <output dir> [scale]
+
+##########################################
+
+
+### LIBRARIES
+# pip install openpyxl (.xlsx), pip install xlwt (optional, .xls)
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+
+
+### SETTINGS
+ORGS_PER_SCALE = 200  # the real supporting facilities files have ~190 organisations
+PROVIDERS_PER_SCALE = 40  # RTT providers per workbook at 1x (each with every treatment function)
+TREATMENT_FUNCTIONS = [('100', 'General Surgery'), ('101', 'Urology'), ('110', 'Trauma & Orthopaedics'),
+                       ('120', 'ENT'), ('130', 'Ophthalmology'), ('140', 'Oral Surgery'), ('150', 'Neurosurgery'),
+                       ('160', 'Plastic Surgery'), ('170', 'Cardiothoracic Surgery'), ('300', 'General Medicine'),
+                       ('301', 'Gastroenterology'), ('320', 'Cardiology'), ('330', 'Dermatology'),
+                       ('340', 'Thoracic Medicine'), ('400', 'Neurology'), ('410', 'Rheumatology'),
+                       ('430', 'Geriatric Medicine'), ('502', 'Gynaecology'), ('X01', 'Other'), ('999', 'Total')]
+WEEK_BANDS = [f'>{i}-{i + 1}' for i in range(52)] + ['52 plus']
+TRUSTS_PER_SCALE = 200  # critical care SitRep rows per workbook at 1x
+CARE_TYPES = ['Adult', 'Paediatric Intensive Care', 'Neonatal Critical Care (cots or beds)']
+KH03_SECTORS = ['Total', 'General & Acute', 'Learning Disabilities', 'Maternity', 'Mental Illness']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+               'October', 'November', 'December']
+
+
+### FUNCTIONS
+def _org_rows(rng, n_orgs, early_layout):
+    """Organisation rows of a supporting facilities sheet, with the England total rows the cleaning drops."""
+    codes = [f'R{i:04X}' for i in range(n_orgs)]
+    theatres = rng.integers(1, 40, n_orgs)
+    day_case = np.minimum(theatres, rng.integers(0, 8, n_orgs))
+    sha = [f'Q{(i % 30) + 1:02d}' for i in range(n_orgs)]
+    names = [f'Synthetic Hospitals NHS Trust {i}' for i in range(n_orgs)]
+    rows = [[None, None, 'England (Including Independent Sector)', int(theatres.sum()), int(day_case.sum())]]
+    if not early_layout:
+        rows[0] += [None, None]
+    for i in range(n_orgs):
+        row = [sha[i], codes[i], names[i], int(theatres[i]), int(day_case[i])]
+        if not early_layout:
+            row += [f'Q{(i % 10) + 30}', f'Y{(i % 4) + 54}']
+        rows.append(row)
+    return rows
+
+
+def supporting_facilities_sheet(rng, n_orgs, early_layout, period_text):
+    """One sheet as a list of rows: preamble, header row and organisation rows."""
+    preamble = [['Supporting Facilities Data'], [period_text], ['Source: Department of Health, KH03a'], []]
+    if early_layout:
+        header = ['SHA', 'OrgID', 'Name', 'Number of operating theatres',
+                  'Of which, number of dedicated day case theatres']
+    else:
+        header = ['SHA Code', 'Organisation Code', 'Organisation Name', 'Number of operating theatres',
+                  'Of which, number of dedicated day case theatres', 'Area Team Code', 'Region Code']
+    return preamble + [header] + _org_rows(rng, n_orgs, early_layout)
+
+
+def write_workbook(path, sheets):
+    """Write {sheet name: rows} as .xlsx (openpyxl) or .xls (xlwt)."""
+    path = Path(path)
+    if path.suffix == '.xls':
+        import xlwt
+        book = xlwt.Workbook()
+        for name, rows in sheets.items():
+            sheet = book.add_sheet(name)
+            for r, row in enumerate(rows):
+                for c, value in enumerate(row):
+                    if value is not None:
+                        sheet.write(r, c, value)
+        book.save(str(path))
+        return path
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for name, rows in sheets.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=name, index=False, header=False)
+    return path
+
+
+def make_all_quarters_workbook(path, year, n_orgs, seed=0):
+    """Pre-2009-10 layout: one sheet per quarter named June03, Sep03, Dec03, Mar04."""
+    rng = np.random.default_rng(seed)
+    yy, yy_next = year % 100, (year + 1) % 100
+    sheets = {}
+    for sheet_name, month in [(f'June{yy:02d}', 'June'), (f'Sep{yy:02d}', 'September'),
+                              (f'Dec{yy:02d}', 'December'), (f'Mar{yy_next:02d}', 'March')]:
+        sheets[sheet_name] = supporting_facilities_sheet(rng, n_orgs, True, f'Quarter ending {month}')
+    return write_workbook(path, sheets)
+
+
+def make_quarterly_workbook(path, year, quarter, n_orgs, seed=0):
+    """2009-10 onwards layout: one workbook per quarter, preamble rows above the header."""
+    rng = np.random.default_rng(seed)
+    sheet = supporting_facilities_sheet(rng, n_orgs, False, f'Quarter {quarter} {year}-{(year + 1) % 100:02d}')
+    return write_workbook(path, {'Supporting Facilities': sheet})
+
+
+def make_rtt_provider_workbook(path, year, month, n_providers, seed=0, pathway='Incomplete'):
+    """Monthly RTT provider workbook: one row per provider and treatment function, one column per week band."""
+    rng = np.random.default_rng(seed)
+    preamble = [['Title:', f'Referral to Treatment (RTT) Waiting Times - {pathway} Pathways'],
+                ['Summary:', 'Provider level data'],
+                ['Period:', f'{MONTH_NAMES[month - 1]} {year}'],
+                ['Source:', 'Consultant-led RTT Waiting Times Data Collection'], []]
+    header = ['Region Code', 'Provider Code', 'Provider Name', 'Treatment Function Code', 'Treatment Function'] \
+        + WEEK_BANDS + ['Total number of incomplete pathways', 'Total within 18 weeks', '% within 18 weeks',
+                        'Average (median) waiting time (in weeks)', '92nd percentile waiting time (in weeks)']
+    n_rows = n_providers * len(TREATMENT_FUNCTIONS)
+    # Waiting list counts decay with the number of weeks waited
+    decay = np.exp(-np.arange(len(WEEK_BANDS)) / rng.uniform(6, 14, (n_rows, 1)))
+    counts = rng.poisson(decay * rng.uniform(5, 200, (n_rows, 1)))
+    totals = counts.sum(axis=1)
+    within_18 = counts[:, :18].sum(axis=1)
+    rows = []
+    for i in range(n_rows):
+        provider = i // len(TREATMENT_FUNCTIONS)
+        tf_code, tf_name = TREATMENT_FUNCTIONS[i % len(TREATMENT_FUNCTIONS)]
+        share = within_18[i] / totals[i] if totals[i] else None
+        rows.append([f'Y{54 + provider % 4}', f'R{provider:03X}', f'Synthetic Provider {provider}', tf_code, tf_name]
+                    + counts[i].tolist() + [int(totals[i]), int(within_18[i]), share, None, None])
+    return write_workbook(path, {'Provider': preamble + [header] + rows})
+
+
+def make_critical_care_workbook(path, year, month, n_trusts, seed=0, grouped_header=True):
+    """Monthly critical care SitRep workbook: beds open and occupied, % occupied and transfers per trust."""
+    rng = np.random.default_rng(seed)
+    opened = rng.integers(0, 60, (n_trusts, 3)) * (rng.random((n_trusts, 3)) < 0.7)
+    occupied = np.minimum(opened, rng.integers(0, 60, (n_trusts, 3)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percent = np.where(opened > 0, occupied / np.maximum(opened, 1), None)
+    transfers = rng.integers(0, 4, n_trusts)
+    preamble = [['Critical Care Bed Capacity and Urgent Operations Cancelled'],
+                [f'Period: {MONTH_NAMES[month - 1]} {year}'], ['Source: Monthly SitRep'], []]
+    if grouped_header:
+        header = [[None, None, None, 'Number of critical care beds open', None, None,
+                   'Number of critical care beds occupied', None, None, 'Critical care beds % occupied', None, None,
+                   'Number of non-medical critical care transfers'],
+                  ['Region Code', 'Code', 'Name'] + CARE_TYPES * 3 + [None]]
+    else:
+        header = [['SHA', 'Org ID', 'Name']
+                  + [f'Number of {t.lower()} beds open' for t in ('adult critical care', 'paediatric intensive care',
+                                                                   'neonatal critical care cots or')]
+                  + [f'Number of {t.lower()} beds occupied' for t in ('adult critical care', 'paediatric intensive care',
+                                                                       'neonatal critical care cots or')]
+                  + [f'{t} beds % occupied' for t in ('Adult critical care', 'Paediatric intensive care',
+                                                      'Neonatal critical care cots or')]
+                  + ['Number of non-medical critical care transfers']]
+    rows = [[None, None, 'England'] + opened.sum(axis=0).tolist() + occupied.sum(axis=0).tolist() + [None] * 3
+            + [int(transfers.sum())]]
+    for i in range(n_trusts):
+        rows.append([f'Y{54 + i % 4}', f'R{i:03X}', f'Synthetic NHS Trust {i}'] + opened[i].tolist()
+                    + occupied[i].tolist() + [None if p is None else float(p) for p in percent[i]] + [int(transfers[i])])
+    return write_workbook(path, {'Critical Care Beds': preamble + header + rows})
+
+
+def generate_critical_care(raw_dir, scale=1, months=((2010, 8), (2013, 4), (2013, 5)), extension='.xlsx', seed=0):
+    """
+    Write synthetic monthly critical care workbooks named like the downloaded files (month and financial year).
+    Months up to November 2010 have the one-row header. Returns the file names.
+    """
+    raw_dir = Path(raw_dir)
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for year, month in months:
+        fy = year if month >= 4 else year - 1
+        name = f'Critical_Care_Bed_Capacity_{MONTH_NAMES[month - 1]}_{fy}-{(fy + 1) % 100:02d}{extension}'
+        make_critical_care_workbook(raw_dir / name, year, month, int(TRUSTS_PER_SCALE * scale),
+                                    seed + year * 12 + month, grouped_header=(year, month) > (2010, 11))
+        files.append(name)
+    return files
+
+
+def _kh03_counts(rng, n_orgs):
+    """Available and occupied beds per organisation for the 5 KH03 sectors (total first), and the occupancy."""
+    sectors = rng.integers(0, 400, (n_orgs, 4)) * (rng.random((n_orgs, 4)) < 0.6)
+    available = np.column_stack([sectors.sum(axis=1), sectors]).astype(float)
+    occupied = np.round(available * rng.uniform(0.6, 1, (n_orgs, 1)), 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percent = np.where(available > 0, occupied / available, np.nan)
+    return available, occupied, percent
+
+
+def _cells(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def make_kh03_annual_workbook(path, year, n_orgs, kind='overnight', seed=0):
+    """
+    Annual KH03 workbook (2000-01 to 2009-10): one sheet, header with OrgID and Name. Overnight beds come in
+    available / occupied / % occupied blocks of sector columns (named 'Available all sectors', ... in 2000-01),
+    day beds as a total and two age groups.
+    """
+    rng = np.random.default_rng(seed)
+    fy = f'{year}-{(year + 1) % 100:02d}'
+    available, occupied, percent = _kh03_counts(rng, n_orgs)
+    preamble = [[f'Bed Availability and Occupancy, {kind} beds, {fy}'], ['Source: KH03']]
+    if kind == 'day':
+        header = ['Year', 'SHA', 'Org ID', 'Name', 'Total', 'Neonates and children', 'Other ages']
+        rows = [[fy, 'Q01', f'R{i:03X}', f'Synthetic NHS Trust {i}', float(available[i, 0]), None, None]
+                for i in range(n_orgs)]
+        return write_workbook(path, {'Day beds': preamble + [[]] + [header] + rows})
+    # Sector columns in file order: total, general & acute, acute, geriatric, mental illness, learning, maternity
+    order = [0, 1, None, None, 4, 2, 3]
+    names = ['Total', 'General & Acute', 'Acute', 'Geriatric', 'Mental Illness', 'Learning Disability', 'Maternity']
+    if year == 2000:
+        names = ['all sectors', 'General & Acute', 'Acute', 'Geriatric', 'Mental Illness', 'Learning Disability',
+                 'Maternity']
+        header = ['Year', 'SHA', 'Org ID', 'Name'] + [f'Available {n}' for n in names] \
+            + [f'Occupied {n}' for n in names]
+        blocks = (available, occupied)
+        group = None
+    else:
+        header = ['Year', 'SHA', 'Org ID', 'Name'] + names + [None] + names + [None] + names
+        blocks = (available, occupied, percent)
+        group = [None] * 4 + ['Available'] + [None] * 7 + ['Occupied'] + [None] * 7 + ['% Occupied']
+    rows = []
+    for i in range(n_orgs):
+        row = [fy, 'Q01', f'R{i:03X}', f'Synthetic NHS Trust {i}']
+        for b, block in enumerate(blocks):
+            if b and group is not None:
+                row.append(None)
+            row += _cells([np.nan if j is None else block[i, j] for j in order])
+        rows.append(row)
+    header_rows = [group, header] if group is not None else [[], header]
+    return write_workbook(path, {'Overnight beds': preamble + header_rows + rows})
+
+
+def make_kh03_quarterly_workbook(path, year, quarter, n_orgs, kind='overnight', seed=0):
+    """Quarterly KH03 workbook (2010-11 onwards): 'NHS Trust by Sector' sheet with grouped sector blocks."""
+    rng = np.random.default_rng(seed)
+    fy = f'{year}-{(year + 1) % 100:02d}'
+    period_end = ['June', 'September', 'December', 'March'][quarter - 1]
+    available, occupied, percent = _kh03_counts(rng, n_orgs)
+    preamble = [[f'Average {kind} beds available and occupied, by sector'], [f'Quarter {quarter} {fy}'],
+                ['Source: KH03'], []]
+    group = [None] * 5 + ['Available'] + [None] * 5 + ['Occupied'] + [None] * 5 + ['% Occupied']
+    header = ['Year', 'Period End', 'Region Code', 'Org Code', 'Org Name'] + KH03_SECTORS + [None] \
+        + KH03_SECTORS + [None] + KH03_SECTORS
+    rows = [[fy, period_end, f'Y{54 + i % 4}', f'R{i:03X}', f'Synthetic NHS Trust {i}'] + _cells(available[i])
+            + [None] + _cells(occupied[i]) + [None] + _cells(percent[i]) for i in range(n_orgs)]
+    return write_workbook(path, {'Notes': [['KH03 notes']], 'NHS Trust by Sector': preamble + [group, header] + rows})
+
+
+def generate_kh03(raw_dir, scale=1, annual_years=(2000, 2008), quarters=((2010, 1), (2023, 4)), extension='.xlsx',
+                  seed=0):
+    """
+    Write synthetic overnight and day KH03 workbooks into raw_dir/overnight and raw_dir/day, named like the
+    downloaded files. The day files cover a subset of the organisations. Returns the file names.
+    """
+    raw_dir = Path(raw_dir)
+    n_orgs = int(TRUSTS_PER_SCALE * scale)
+    files = []
+    for kind in ('overnight', 'day'):
+        (raw_dir / kind).mkdir(parents=True, exist_ok=True)
+        n_kind = n_orgs if kind == 'overnight' else n_orgs * 3 // 4
+        label = 'Overnight' if kind == 'overnight' else 'Day'
+        for year in annual_years:
+            name = f'Beds_Open_{label}_-_NHS_Organisations_in_England_{year}-{(year + 1) % 100:02d}{extension}'
+            make_kh03_annual_workbook(raw_dir / kind / name, year, n_kind, kind, seed + year)
+            files.append(name)
+        for year, quarter in quarters:
+            name = f'Beds_Open_{label}_Web_File_Quarter_{quarter}_{year}-{(year + 1) % 100:02d}{extension}'
+            make_kh03_quarterly_workbook(raw_dir / kind / name, year, quarter, n_kind, kind, seed + year * 4 + quarter)
+            files.append(name)
+    return files
+
+
+def generate_supporting_facilities(raw_dir, scale=1, all_quarters_years=(2007, 2008),
+                                   quarterly_years=(2009, 2010), extension='.xlsx', seed=0):
+    """
+    Write a synthetic supporting facilities raw folder: one All_quarters workbook per early year and
+    four quarterly workbooks per later year. Returns the file names.
+    """
+    raw_dir = Path(raw_dir)
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    n_orgs = int(ORGS_PER_SCALE * scale)
+    files = []
+    for year in all_quarters_years:
+        name = f'Supporting_Facilities_Data_All_quarters_{year}-{(year + 1) % 100:02d}{extension}'
+        make_all_quarters_workbook(raw_dir / name, year, n_orgs, seed + year)
+        files.append(name)
+    for year in quarterly_years:
+        for quarter in range(1, 5):
+            name = f'Supporting_Facilities_Quarter_{quarter}_{year}-{(year + 1) % 100:02d}{extension}'
+            make_quarterly_workbook(raw_dir / name, year, quarter, n_orgs, seed + year * 10 + quarter)
+            files.append(name)
+    return files
+
+
+def generate_rtt(raw_dir, scale=1, months=((2015, 4), (2015, 5), (2015, 6)), extension='.xlsx', seed=0):
+    """Write synthetic monthly RTT provider workbooks. Returns the file names."""
+    raw_dir = Path(raw_dir)
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for year, month in months:
+        name = f'Incomplete_Provider_{MONTH_NAMES[month - 1][:3]}{year % 100:02d}{extension}'
+        make_rtt_provider_workbook(raw_dir / name, year, month, int(PROVIDERS_PER_SCALE * scale), seed + year * 12 + month)
+        files.append(name)
+    return files
+
+
+### MAIN EXECUTION
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python synthetic_workbooks.py <output dir> [scale]")
+        return
+    output_dir = Path(sys.argv[1])
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    files = generate_supporting_facilities(output_dir / 'supporting-facilities', scale)
+    files += generate_rtt(output_dir / 'wait-times', scale)
+    files += generate_critical_care(output_dir / 'critical-care-beds' / 'after-2010', scale)
+    files += generate_kh03(output_dir / 'available-and-occupied-beds', scale)
+    print(f"Wrote {len(files)} synthetic workbooks to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
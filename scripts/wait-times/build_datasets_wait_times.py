@@ -0,0 +1,338 @@
+##########################################
+
+# This python script builds the provider-level RTT waiting times files (downloaded by extract_wait_times_main.py)
+# into the partitioned store: data/store/rtt_provider/<pathway>/month=<YYYY-MM>/part.parquet
+# - the files are grouped by month and the months are built in a process pool, one month per worker
+# - each file is streamed from its sheet in chunks of CHUNK_ROWS rows, which are written as Parquet row groups,
+#   so memory per worker is bounded by the sheet reader plus one chunk, whatever the size of the file; the number of
+#   workers is capped to stay within a memory budget (WAIT_TIMES_MEMORY_MB, --memory-mb)
+# - names are cleaned as in build_datasets_wait_times.R (week bands as between_<from>_<to>, provider_code as
+#   org_code, bands over 52 weeks collapsed into between_52_plus) with the pathway and period as columns
+# - a month is only rebuilt when one of its files is new or changed (--full rebuilds everything); when a pathway and
+#   month has several files (an original and a revised release) the latest revision is built (see revisions.py)
+# Files before January 2011 (a different layout, rawdata/wait-times/before-2011) are left to the R script
+# Usage:
+#   python scripts/wait-times/build_datasets_wait_times.py [--workers 4] [--chunk-rows 20000] [--memory-mb 4096] [--full]
+
+##########################################
+
+
+### LIBRARIES
+# pip install pyarrow, pip install python-calamine (faster sheet reading, optional)
+import argparse
+import hashlib
+import itertools
+import operator
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # shared modules in scripts/
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from excel_backends import backends_for, iter_rows, sheet_names # streamed sheet reading
+from periods import MONTHS, month_ordinal, period_to_target # integer period keys
+from dataset_store import STORE_DIR, load_manifest, register_partitions # partitioned dataset store
+from instrument import instrumented_run, stage, peak_rss_mb # per-stage run report
+from revisions import revision_rank # revised releases
+
+
+### SETTINGS
+try:
+    BASE_DIR = Path(__file__).resolve().parent.parent.parent
+except NameError:
+    BASE_DIR = Path.cwd()
+RAW_DATA_DIR = Path(os.getenv("RAW_DATA_DIR", BASE_DIR / "rawdata" / "wait-times"))
+SERIES_NAME = 'rtt_provider'
+CHUNK_ROWS = int(os.getenv("WAIT_TIMES_CHUNK_ROWS", 20000))
+WORKERS = int(os.getenv("WAIT_TIMES_WORKERS", min(4, os.cpu_count() or 1)))
+MEMORY_BUDGET_MB = float(os.getenv("WAIT_TIMES_MEMORY_MB", 4096))  # for all workers together
+# Peak memory of a worker, measured on synthetic RTT files: the interpreter with pandas and pyarrow, the decoded
+# sheet when calamine reads it (openpyxl streams rows instead) and the chunk being converted
+WORKER_BASE_MB = 120
+SHEET_MB_PER_FILE_MB = 13
+CHUNK_MB_PER_1000_ROWS = 4
+FIRST_MONTH = (2011, 1)  # earlier files have a different layout
+EXCLUDE = ('Adjusted', 'Periods', 'New_RTT_data_items')  # as in the R script
+HEADER_SEARCH_ROWS = 40  # rows searched for the header in each sheet
+TEXT_COLUMNS = ['org_code', 'org_name', 'treatment_function_code', 'treatment_function']
+RENAMES = {'provider_code': 'org_code', 'provider_name': 'org_name', 'code': 'org_code', 'provider': 'org_name'}
+DROP_COLUMNS = r'form|region_code|nhs_region|sha|area_team'  # not common across years (as in the R script)
+
+
+### FUNCTIONS
+def file_month(filename):
+    """(year, month) from the month in a file name (e.g. Incomplete_Provider_Apr15.xlsx), or None."""
+    match = re.search(r'([A-Z][a-z]{2})(\d{2})', filename)
+    if not match or match.group(1).lower() not in MONTHS:
+        return None
+    return 2000 + int(match.group(2)), MONTHS[match.group(1).lower()]
+
+
+def file_pathway(filename):
+    """Pathway of a file: admitted, non_admitted or incomplete (None if not in the name)."""
+    match = re.search(r'(non[-_ ]?admitted|admitted|incomplete)', filename, re.IGNORECASE)
+    if not match:
+        return None
+    return re.sub(r'non[-_ ]?admitted', 'non_admitted', match.group(1).lower())
+
+
+def find_files(raw_dir=RAW_DATA_DIR):
+    """
+    Provider files from FIRST_MONTH on, as {(year, month): [(pathway, path), ...]}. When several files cover the
+    same pathway and month (an original and a revised release), only the latest revision is kept (see revisions.py).
+    """
+    found = defaultdict(list)
+    for path in sorted(Path(raw_dir).rglob('*')):
+        if path.suffix.lower() not in ('.xls', '.xlsx') or any(word in path.name for word in EXCLUDE):
+            continue
+        month, pathway = file_month(path.name), file_pathway(path.name)
+        if month is None or pathway is None or month < FIRST_MONTH:
+            continue
+        found[(month, pathway)].append(path)
+    months = defaultdict(list)
+    for (month, pathway), paths in sorted(found.items()):
+        latest = max(paths, key=lambda path: (revision_rank(path.name, path.parent), path.name))
+        superseded = [path.name for path in paths if path != latest]
+        if superseded:
+            print(f"{pathway} {month[0]}-{month[1]:02d}: using {latest.name}, superseded {superseded}")
+        months[month].append((pathway, latest))
+    return dict(months)
+
+
+def file_signature(path):
+    """Cheap fingerprint of a raw file: size and modification time."""
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def partition_name(pathway, year, month):
+    """Partition of one pathway and month, e.g. incomplete/month=2015-04."""
+    return f'{pathway}/month={year}-{month:02d}'
+
+
+def clean_name(name):
+    """janitor::make_clean_names for one header cell, with week bands named between_<from>_<to>."""
+    name = str(name).strip().lower().replace('%', ' percent ').replace('#', ' number ')
+    name = re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+    if re.fullmatch(r'\d+(_\d+|_plus)?', name):
+        name = f'between_{name}'
+    return RENAMES.get(name, name)
+
+
+def clean_header(row):
+    """
+    Clean names of a header row and the columns kept, as [(position, name), ...]. Bands over 52 weeks are
+    dropped when the file has a 52 plus total, which becomes between_52_plus (as in the R script).
+    """
+    columns, seen = [], set()
+    for i, cell in enumerate(row):
+        if cell is None or str(cell).strip() == '':
+            continue
+        name = clean_name(cell)
+        if name in seen:
+            suffix = 2
+            while f'{name}_{suffix}' in seen:
+                suffix += 1
+            name = f'{name}_{suffix}'
+        seen.add(name)
+        columns.append((i, name))
+    names = {name for _, name in columns}
+    if 'total_52_plus_weeks' in names:
+        columns = [(i, 'between_52_plus' if name == 'total_52_plus_weeks' else name) for i, name in columns
+                   if not (re.fullmatch(r'between_\d+_\d+', name) and int(name.split('_')[1]) >= 52)
+                   and not re.match(r'total_\d', name) and '104' not in name]
+    return [(i, name) for i, name in columns if not re.search(DROP_COLUMNS, name)]
+
+
+def provider_table(file_path):
+    """
+    Header row and the row iterator after it of the provider by treatment function table, searching the sheets
+    in order (files before April 2013 have a provider summary sheet first).
+    """
+    for sheet in range(len(sheet_names(file_path))):
+        rows = iter_rows(file_path, sheet)
+        for row_number, row in enumerate(rows):
+            if row_number >= HEADER_SEARCH_ROWS:
+                break
+            cells = {str(cell).strip().lower() for cell in row if cell is not None}
+            if 'treatment function code' in cells or 'treatment function' in cells:
+                return row, rows
+        rows.close()
+    raise ValueError(f"No provider by treatment function table in {file_path}")
+
+
+def as_text(value):
+    """Codes and names as strings; numeric codes (e.g. treatment function 100.0) without the decimals."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def arrow_schema(names):
+    """Fixed schema of a file, so every chunk is written with the same types."""
+    fields = [pa.field('period', pa.int32()), pa.field('pathway', pa.string())]
+    fields += [pa.field(name, pa.string() if name in TEXT_COLUMNS else pa.float64()) for name in names]
+    return pa.schema(fields)
+
+
+def chunk_frame(rows, columns, period, pathway):
+    """DataFrame of a chunk of sheet rows: text columns as strings, values as floats ('-', '*' as NaN)."""
+    positions = [i for i, _ in columns]
+    width = positions[-1] + 1
+    pick = operator.itemgetter(*positions)
+    df = pd.DataFrame([pick(row if len(row) >= width else row + [None] * (width - len(row))) for row in rows],
+                      columns=[name for _, name in columns], dtype=object)
+    for name in df.columns:
+        if name in TEXT_COLUMNS:
+            df[name] = df[name].map(as_text)
+        else:
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype('float64')
+    df = df[df['org_code'].notna()] if 'org_code' in df.columns else df.iloc[0:0]
+    df.insert(0, 'pathway', pathway)
+    df.insert(0, 'period', np.int32(period))
+    return df
+
+
+def build_file(file_path, pathway, year, month, series_dir, chunk_rows=CHUNK_ROWS):
+    """
+    Stream one file into its partition, chunk by chunk, and return its manifest entry.
+    The partition is written to a temporary file and moved into place when complete.
+    """
+    header, rows = provider_table(file_path)
+    columns = clean_header(header)
+    schema = arrow_schema([name for _, name in columns])
+    period = int(month_ordinal(year, month))
+    name = partition_name(pathway, year, month)
+    part_dir = Path(series_dir) / name
+    part_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = part_dir / 'part.parquet.tmp'
+
+    digest = hashlib.sha256('|'.join(schema.names).encode())  # content hash, updated chunk by chunk
+    n_rows, orgs, chunks = 0, set(), 0
+    try:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            while batch := list(itertools.islice(rows, chunk_rows)):
+                df = chunk_frame(batch, columns, period, pathway)
+                if not len(df):
+                    continue
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+                n_rows += len(df)
+                orgs.update(df['org_code'].dropna())
+                chunks += 1
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, part_dir / 'part.parquet')
+    return name, {'path': f'{name}/part.parquet', 'fy': int(period_to_target(np.array([period]), 'financial_year')[0]),
+                  'month': f'{year}-{month:02d}', 'pathway': pathway, 'hash': digest.hexdigest(), 'rows': n_rows,
+                  'min_period': period, 'max_period': period, 'n_orgs': len(orgs), 'chunks': chunks,
+                  'source': Path(file_path).name, 'source_signature': file_signature(file_path),
+                  'columns': {field.name: str(field.type) for field in schema}}
+
+
+def build_month(year, month, files, series_dir, chunk_rows=CHUNK_ROWS):
+    """Worker: build every file of one month. Returns the manifest entries and the peak RSS of the worker."""
+    start = time.perf_counter()
+    entries = dict(build_file(path, pathway, year, month, series_dir, chunk_rows) for pathway, path in files)
+    return entries, time.perf_counter() - start, peak_rss_mb()
+
+
+def worker_memory_mb(months, chunk_rows=CHUNK_ROWS):
+    """Estimated peak memory of one worker, for the largest file to build."""
+    paths = [path for files in months.values() for _, path in files]
+    if not paths:
+        return WORKER_BASE_MB
+    largest = max(paths, key=os.path.getsize)
+    sheet_mb = SHEET_MB_PER_FILE_MB * os.path.getsize(largest) / 2**20 if backends_for(largest)[:1] == ['calamine'] else 0
+    return WORKER_BASE_MB + sheet_mb + CHUNK_MB_PER_1000_ROWS * chunk_rows / 1000
+
+
+def stale_months(months, partitions):
+    """Files whose partition is missing or was built from a different version of the file, per month."""
+    stale = {}
+    for (year, month), files in months.items():
+        changed = [(pathway, path) for pathway, path in files
+                   if partitions.get(partition_name(pathway, year, month), {}).get('source_signature')
+                   != file_signature(path)]
+        if changed:
+            stale[(year, month)] = changed
+    return stale
+
+
+def build(raw_dir=RAW_DATA_DIR, store_dir=STORE_DIR, workers=WORKERS, chunk_rows=CHUNK_ROWS, full=False,
+          memory_mb=MEMORY_BUDGET_MB):
+    """
+    Build the stale months in a process pool and record their partitions in the store manifest.
+    The number of workers is capped so that their estimated peak memory stays within memory_mb.
+    """
+    months = find_files(raw_dir)
+    partitions = load_manifest(store_dir)['series'].get(SERIES_NAME, {}).get('partitions', {})
+    todo = months if full else stale_months(months, partitions)
+    current = {partition_name(pathway, year, month) for (year, month), files in months.items() for pathway, _ in files}
+    removed = sorted(set(partitions) - current) if full else []
+    per_worker_mb = worker_memory_mb(todo, chunk_rows)
+    workers = max(1, min(workers, len(todo), int(memory_mb // per_worker_mb)))
+    print(f"{sum(len(f) for f in months.values())} provider files in {len(months)} months, "
+          f"{len(todo)} months to build with {workers} workers (about {per_worker_mb:.0f} MB each)")
+
+    series_dir = Path(store_dir) / SERIES_NAME
+    if removed:
+        register_partitions(SERIES_NAME, {}, 'org_code', remove=removed, store_dir=store_dir)
+        print(f"Removed {len(removed)} partitions whose file is gone")
+    entries, failed, worker_peaks = {}, [], []
+    with stage('build_months', files=sum(len(f) for f in todo.values()), workers=workers,
+               chunk_rows=chunk_rows) as s:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(build_month, year, month, files, series_dir, chunk_rows): (year, month)
+                       for (year, month), files in sorted(todo.items())}
+            for future in as_completed(futures):
+                year, month = futures[future]
+                try:
+                    month_entries, seconds, worker_peak = future.result()
+                except Exception as e:
+                    failed.append((year, month, f'{type(e).__name__}: {e}'))
+                    print(f"Failed {year}-{month:02d}: {e}")
+                    continue
+                # Registered as each month completes, so an interrupted build keeps the finished months
+                columns = {}
+                for entry in month_entries.values():
+                    columns.update(entry.pop('columns'))
+                register_partitions(SERIES_NAME, month_entries, 'org_code', columns, store_dir=store_dir)
+                entries.update(month_entries)
+                worker_peaks.append(worker_peak or 0)
+                print(f"Built {year}-{month:02d}: {sum(e['rows'] for e in month_entries.values())} rows "
+                      f"from {len(month_entries)} files in {seconds:.1f} s")
+        s['rows_out'] = sum(e['rows'] for e in entries.values())
+        s['worker_peak_rss_mb'] = max(worker_peaks, default=None)
+        s['failed'] = len(failed)
+    print(f"Registered {len(entries)} partitions of {SERIES_NAME}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} months failed: " + "; ".join(f"{y}-{m:02d} {e}" for y, m, e in failed))
+    return entries
+
+
+### MAIN EXECUTION
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the RTT provider files into the partitioned store")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="months built in parallel")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows read and written per chunk")
+    parser.add_argument('--memory-mb', type=float, default=MEMORY_BUDGET_MB, help="memory budget of all workers")
+    parser.add_argument('--full', action='store_true', help="rebuild every month, not only new or changed files")
+    parser.add_argument('--raw-dir', type=Path, default=RAW_DATA_DIR)
+    with instrumented_run('wait-times'):  # takes --profile off the command line first
+        args = parser.parse_args(argv)
+        build(args.raw_dir, STORE_DIR, args.workers, args.chunk_rows, args.full, args.memory_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+##########################################
+
+# This python script derives waiting-time metrics from the week-band counts of the RTT provider data
+# (between_0_1, between_1_2, ..., between_52_plus, see wait-times/build_datasets_wait_times.py)
+# All rows are handled at once as one 2-D array of band counts (rows x bands), with cumulative sums along the bands:
+# - total: number of pathways, the sum of the bands
+# - within_18_weeks and percent_within_18_weeks: pathways in the bands that end at or before 18 weeks
+# - median and 92nd percentile waits in weeks, interpolated linearly within the band the percentile falls in
+#   (as in the NHS England RTT methodology). A percentile in the open last band (e.g. 52 plus) is its lower bound
+# Bands missing for a row (NaN, e.g. bands that only exist in some months) count as 0; rows without any band
+# count get NaN metrics
+# Example:
+#   from wait_distribution import wait_metrics, to_long
+#   df = wait_metrics(read('rtt_provider'))
+#   long = to_long(df, id_cols=['org_code', 'period', 'pathway', 'treatment_function_code'])
+
+##########################################
+
+
+### LIBRARIES
+import numpy as np
+import pandas as pd
+import re
+
+
+### SETTINGS
+BAND_PATTERN = re.compile(r'between_(\d+)_(\d+|plus)$')
+THRESHOLD_WEEKS = 18  # the RTT standard
+PERCENTILES = {'median_wait_weeks': 0.5, 'p92_wait_weeks': 0.92}
+
+
+### FUNCTIONS
+def band_columns(columns):
+    """Week-band columns ordered by their bounds, with their lower and upper bounds in weeks (inf for 'plus')."""
+    bands = []
+    for col in columns:
+        match = BAND_PATTERN.match(str(col))
+        if match:
+            lower, upper = match.groups()
+            bands.append((int(lower), np.inf if upper == 'plus' else int(upper), col))
+    bands.sort()
+    return ([col for _, _, col in bands], np.array([lower for lower, _, _ in bands], dtype=float),
+            np.array([upper for _, upper, _ in bands], dtype=float))
+
+
+def band_counts(df, bands):
+    """Band counts as a float64 (rows x bands) array with missing counts as 0, and the rows without any count."""
+    counts = df[bands].to_numpy(dtype=np.float64, na_value=np.nan)
+    empty = np.isnan(counts).all(axis=1)
+    return np.nan_to_num(counts, nan=0.0), empty
+
+
+def percentile_waits(counts, cumulative, total, lower, upper, q):
+    """
+    Wait in weeks below which a share q of the pathways of each row falls, by linear interpolation within the band
+    where the cumulative count reaches q * total.
+    """
+    target = q * total
+    # First band whose cumulative count reaches the target (rows with total 0 are masked by the caller)
+    index = np.minimum((cumulative < target[:, None]).sum(axis=1), counts.shape[1] - 1)
+    rows = np.arange(len(counts))
+    before = np.where(index > 0, cumulative[rows, index - 1], 0.0)
+    in_band = counts[rows, index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = np.where(in_band > 0, (target - before) / in_band, 0.0)
+    band_lower, band_upper = lower[index], upper[index]
+    return np.where(np.isinf(band_upper), band_lower, band_lower + share * (band_upper - band_lower))
+
+
+def distribution_metrics(counts, lower, upper, threshold_weeks=THRESHOLD_WEEKS, percentiles=PERCENTILES):
+    """Total, pathways within the threshold, their share and the percentile waits of a (rows x bands) array."""
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1] if counts.shape[1] else np.zeros(len(counts))
+    within = counts[:, upper <= threshold_weeks].sum(axis=1)
+    has_total = total > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        metrics = {'total': total, f'within_{threshold_weeks}_weeks': within,
+                   f'percent_within_{threshold_weeks}_weeks': np.where(has_total, within / total, np.nan)}
+    for name, q in percentiles.items():
+        metrics[name] = np.where(has_total, percentile_waits(counts, cumulative, total, lower, upper, q), np.nan)
+    return metrics
+
+
+def wait_metrics(df, threshold_weeks=THRESHOLD_WEEKS, percentiles=PERCENTILES, prefix='bands_'):
+    """
+    Add the metrics derived from the week bands of df as columns (named with prefix, e.g. bands_total, so they
+    do not overwrite the published totals and percentiles). Rows without any band count get NaN.
+    """
+    bands, lower, upper = band_columns(df.columns)
+    if not bands:
+        raise ValueError("No week-band columns (between_<from>_<to>) in the data")
+    counts, empty = band_counts(df, bands)
+    metrics = distribution_metrics(counts, lower, upper, threshold_weeks, percentiles)
+    for values in metrics.values():
+        values[empty] = np.nan
+    return df.assign(**{f'{prefix}{name}': values for name, values in metrics.items()})
+
+
+def to_long(df, id_cols=None):
+    """
+    Long format of the week bands: one row per row of df and band, with the band bounds and the count.
+    id_cols defaults to every column that is not a band.
+    """
+    bands, lower, upper = band_columns(df.columns)
+    id_cols = [col for col in df.columns if col not in bands] if id_cols is None else list(id_cols)
+    n_rows, n_bands = len(df), len(bands)
+    rows = np.repeat(np.arange(n_rows), n_bands)
+    long = {col: df[col].take(rows).reset_index(drop=True) for col in id_cols}
+    long['band'] = pd.Categorical.from_codes(np.tile(np.arange(n_bands), n_rows), bands)  # ordered by bounds
+    long['lower_weeks'] = np.tile(lower, n_rows)
+    long['upper_weeks'] = np.tile(upper, n_rows)
+    long['count'] = df[bands].to_numpy(dtype=np.float64, na_value=np.nan).ravel()
+    return pd.DataFrame(long)
@@ -0,0 +1,7 @@
+# The scripts are run from scripts/ (and its series folders), so their modules are imported from there
+import sys
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(1, str(SCRIPTS_DIR / "available-and-occupied-beds"))
@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+from incremental import cache_exists, cached_run, drop_files, plan_build, store_frame
+
+
+def frame(period):
+    return pd.DataFrame({'period': [period, period], 'value': [1, 2]})
+
+
+def build(raw_dir, state, state_dir, periods):
+    """Plan a build and cache a frame of every file to process, like build_incremental."""
+    files = sorted(os.listdir(raw_dir))
+    to_process, unchanged, removed, fingerprints = plan_build(raw_dir, files, state, state_dir)
+    drop_files(removed, state, state_dir)
+    for file in files:
+        if file not in unchanged or not cache_exists(file, state, state_dir):
+            store_frame(frame(periods[file]), file, fingerprints[file], state, state_dir)
+    return to_process, unchanged, removed
+
+
+def test_only_new_or_changed_files_are_processed(tmp_path):
+    raw, state_dir, state = tmp_path / 'raw', tmp_path / 'state', {'files': {}, 'outputs': {}}
+    raw.mkdir()
+    (raw / 'a.xlsx').write_bytes(b'a')
+    (raw / 'b.xlsx').write_bytes(b'b')
+    periods = {'a.xlsx': 1, 'b.xlsx': 2, 'c.xlsx': 3}
+    assert build(raw, state, state_dir, periods) == (['a.xlsx', 'b.xlsx'], [], [])
+    (raw / 'b.xlsx').write_bytes(b'b revised')
+    (raw / 'c.xlsx').write_bytes(b'c')
+    (raw / 'a.xlsx').unlink()
+    assert build(raw, state, state_dir, periods) == (['b.xlsx', 'c.xlsx'], [], ['a.xlsx'])
+    assert build(raw, state, state_dir, periods) == ([], ['b.xlsx', 'c.xlsx'], [])
+    assert len(list(state_dir.glob('*.pkl'))) == 2  # the frames of a and of the first b are gone
+
+
+def test_files_with_the_same_bytes_keep_their_own_frames(tmp_path):
+    raw, state_dir, state = tmp_path / 'raw', tmp_path / 'state', {'files': {}, 'outputs': {}}
+    raw.mkdir()
+    (raw / 'Quarter_1_2010-11.xlsx').write_bytes(b'same')
+    (raw / 'Quarter_1_2010-11 (revised).xlsx').write_bytes(b'same')
+    periods = {'Quarter_1_2010-11.xlsx': 1, 'Quarter_1_2010-11 (revised).xlsx': 2}
+    build(raw, state, state_dir, periods)
+    caches = {file: entry['cache'] for file, entry in state['files'].items()}
+    assert len(set(caches.values())) == 2
+    (raw / 'Quarter_1_2010-11.xlsx').unlink()
+    build(raw, state, state_dir, periods)
+    run = cached_run('Quarter_1_2010-11 (revised).xlsx', 0, state, state_dir)
+    assert pd.read_pickle(run['path'])['period'].tolist() == [2, 2]
+
+
+def test_a_frame_cached_under_the_content_hash_alone_is_rebuilt(tmp_path):
+    raw, state_dir, state = tmp_path / 'raw', tmp_path / 'state', {'files': {}, 'outputs': {}}
+    raw.mkdir()
+    (raw / 'a.xlsx').write_bytes(b'a')
+    build(raw, state, state_dir, {'a.xlsx': 1})
+    entry = state['files']['a.xlsx']
+    old_name = f"{entry['hash']}.pkl"
+    os.replace(state_dir / entry['cache'], state_dir / old_name)
+    entry['cache'] = old_name
+    assert build(raw, state, state_dir, {'a.xlsx': 1})[0] == ['a.xlsx']
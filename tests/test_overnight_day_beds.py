@@ -0,0 +1,20 @@
+import pandas as pd
+import pytest
+from build_datasets_overnight_day_beds import finalise
+
+
+def quarterly(period_ends):
+    return pd.DataFrame({'org_code': ['RA1'] * len(period_ends), 'org_name': ['trust'] * len(period_ends),
+                         'year': ['2010-11'] * len(period_ends), 'period_end': period_ends, 'beds': ['5'] * len(period_ends)})
+
+
+def test_quarter_and_year_of_the_period_end():
+    out = finalise(quarterly(['June', 'march']), 'quarterly', ['beds'])
+    assert out['quarter'].tolist() == ['Q1', 'Q4']
+    assert out['year'].tolist() == [2010, 2011]
+    assert out['period'].tolist() == [2010 * 12 + 5, 2011 * 12 + 2]
+
+
+def test_unknown_period_end_is_not_taken_for_q4():
+    with pytest.raises(ValueError, match='Sept'):
+        finalise(quarterly(['June', 'Sept']), 'quarterly', ['beds'])
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+from periods import (MISSING_PERIOD, add_period_key, encode_date, encode_financial_quarter, encode_financial_year,
+                     encode_period_end, month_ordinal, period_financial_quarter, period_label, period_to_target,
+                     target_end_month)
+
+
+def test_month_ordinal():
+    assert month_ordinal(2010, 1) == 2010 * 12
+    assert month_ordinal(2010, 12) == 2010 * 12 + 11
+
+
+@pytest.mark.parametrize('quarter, year, month', [('Q1', 2010, 6), ('Q2', 2010, 9), ('Q3', 2010, 12), ('Q4', 2011, 3)])
+def test_financial_quarter_is_keyed_on_its_last_month(quarter, year, month):
+    assert encode_financial_quarter(['2010'], [quarter])[0] == month_ordinal(year, month)
+
+
+def test_financial_quarter_without_quarter_is_keyed_on_the_end_of_the_year():
+    assert encode_financial_quarter(['2010'], ['.'])[0] == month_ordinal(2011, 3)
+
+
+def test_financial_quarter_without_year_is_missing():
+    keys = encode_financial_quarter(['.', '2010'], ['Q1', 'Q1'])
+    assert keys.dtype == np.int32
+    assert keys.tolist() == [MISSING_PERIOD, month_ordinal(2010, 6)]
+
+
+def test_financial_year_is_keyed_on_march_of_the_next_year():
+    assert encode_financial_year(['2000-01', 2009]).tolist() == [month_ordinal(2001, 3), month_ordinal(2010, 3)]
+
+
+def test_period_end_takes_full_and_abbreviated_month_names():
+    keys = encode_period_end([2010, 2010, 2011, 2010], ['June', 'Sep', ' march ', 'Whenever'])
+    assert keys.tolist() == [month_ordinal(2010, 6), month_ordinal(2010, 9), month_ordinal(2011, 3), MISSING_PERIOD]
+
+
+def test_date():
+    assert encode_date(['2012-04-01', 'not a date']).tolist() == [month_ordinal(2012, 4), MISSING_PERIOD]
+
+
+def test_add_period_key_detects_the_columns_of_a_series():
+    sf = add_period_key(pd.DataFrame({'year_var': ['2010'], 'quarter_var': ['Q2']}))
+    beds = add_period_key(pd.DataFrame({'year': [2010], 'period_end': ['December']}))
+    annual = add_period_key(pd.DataFrame({'year': [2005]}))
+    assert sf['period'].tolist() == [month_ordinal(2010, 9)]
+    assert beds['period'].tolist() == [month_ordinal(2010, 12)]
+    assert annual['period'].tolist() == [month_ordinal(2006, 3)]
+
+
+def test_financial_quarter_decodes_back():
+    fy, quarter = period_financial_quarter(encode_financial_quarter(['2010'] * 4, ['Q1', 'Q2', 'Q3', 'Q4']))
+    assert fy.tolist() == [2010] * 4
+    assert quarter.tolist() == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('freq', ['month', 'quarter', 'financial_year', 'calendar_year'])
+def test_target_end_month_is_the_last_month_of_the_target_period(freq):
+    period = np.arange(month_ordinal(2009, 1), month_ordinal(2012, 1), dtype=np.int32)
+    end = target_end_month(period_to_target(period, freq), freq)
+    assert (end >= period).all()
+    assert (period_to_target(end, freq) == period_to_target(period, freq)).all()
+
+
+def test_financial_year_runs_april_to_march():
+    period = np.array([month_ordinal(2010, 3), month_ordinal(2010, 4), month_ordinal(2011, 3)], dtype=np.int32)
+    assert period_to_target(period, 'financial_year').tolist() == [2009, 2010, 2010]
+
+
+def test_labels():
+    period = [month_ordinal(2010, 6), MISSING_PERIOD]
+    assert period_label(period) == ['2010-06', '.']
+    assert period_label(period, 'quarter') == ['2010-11 Q1', '.']
+    assert period_label([month_ordinal(2000, 3)], 'financial_year') == ['1999-00']
+    assert period_label([month_ordinal(2000, 3)], 'calendar_year') == ['2000']
+
+
+def test_unknown_frequency():
+    with pytest.raises(ValueError):
+        period_to_target([0], 'week')
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+from periods import MISSING_PERIOD, month_ordinal
+from resample import resample
+
+
+def monthly():
+    months = [(2010, 3), (2010, 4), (2010, 5), (2010, 6)]
+    return pd.DataFrame({
+        'org_code': ['A'] * 4 + ['B'],
+        'period': [month_ordinal(y, m) for y, m in months] + [MISSING_PERIOD],
+        'beds': [99, 10, 20, 30, 1],
+        'occupied': [0, 5, 10, 15, 1],
+        'transfers': [7, 1, 2, 3, 1],
+    })
+
+
+def test_financial_year_rules():
+    rules = {'beds': 'mean', 'transfers': 'sum', 'occupied': 'last', 'occupancy': ('ratio', 'occupied', 'beds')}
+    out = resample(monthly(), 'financial_year', rules)
+    assert out.columns.tolist() == ['org_code', 'period', 'n_periods', 'beds', 'transfers', 'occupied', 'occupancy']
+    assert out['org_code'].tolist() == ['A', 'A']  # B only has a missing period
+    assert out['period'].tolist() == [month_ordinal(2010, 3), month_ordinal(2011, 3)]
+    assert out['n_periods'].tolist() == [1, 3]
+    assert out['beds'].tolist() == [99, 20]
+    assert out['transfers'].tolist() == [7, 6]
+    assert out['occupied'].tolist() == [0, 15]
+    assert out['occupancy'].tolist() == pytest.approx([0, 30 / 60])
+
+
+def test_last_is_the_latest_observation_whatever_the_row_order():
+    df = monthly().iloc[::-1]
+    out = resample(df, 'quarter', {'beds': 'last'})
+    assert out.loc[out['period'] == month_ordinal(2010, 6), 'beds'].tolist() == [30]
+
+
+def test_ratio_with_zero_denominator_is_missing():
+    df = pd.DataFrame({'org_code': ['A'], 'period': [month_ordinal(2010, 4)], 'num': [1], 'den': [0]})
+    assert np.isnan(resample(df, 'quarter', {'r': ('ratio', 'num', 'den')})['r'][0])
+
+
+def test_invalid_rule():
+    with pytest.raises(ValueError):
+        resample(monthly(), 'quarter', {'beds': 'median'})
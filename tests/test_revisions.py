@@ -0,0 +1,56 @@
+import os
+import pandas as pd
+from revisions import drop_superseded, overlapping_files, revision_order, revision_rank
+
+
+def test_revision_rank_orders_markers_then_numbers():
+    names = ['SF Q1 revised.xlsx', 'SF Q1 v3.xlsx', 'SF Q1.xlsx', 'SF Q1 v2.xlsx', 'SF Q1 revision 2.xlsx']
+    assert sorted(names, key=revision_rank) == ['SF Q1.xlsx', 'SF Q1 v2.xlsx', 'SF Q1 v3.xlsx',
+                                                'SF Q1 revised.xlsx', 'SF Q1 revision 2.xlsx']
+    assert revision_rank('Supporting Facilities Data Q1 2020-21.xlsx') == (0, 0, 0)
+    assert revision_rank('SF_Q2_updated.xls')[:2] == (2, 0)
+
+
+def test_download_date_breaks_ties(tmp_path):
+    for name, mtime in [('a.xlsx', 200), ('b.xlsx', 100)]:
+        (tmp_path / name).write_bytes(b'')
+        os.utime(tmp_path / name, ns=(mtime, mtime))
+    assert sorted(['a.xlsx', 'b.xlsx'], key=lambda name: revision_rank(name, tmp_path)) == ['b.xlsx', 'a.xlsx']
+
+
+def run(name, order, min_period, max_period, rows=10, period_known=True):
+    return {'name': name, 'order': order, 'rows': rows, 'min_period': min_period,
+            'max_period': max_period, 'period_known': period_known}
+
+
+def test_overlapping_files():
+    runs = [run('q1.xlsx', 0, 100, 100), run('q1 revised.xlsx', 1, 100, 100), run('q2.xlsx', 2, 103, 103),
+            run('all quarters.xlsx', 3, 97, 103), run('empty.xlsx', 4, 100, 100, rows=0),
+            run('unknown quarter.xlsx', 5, 103, 103, period_known=False)]
+    assert overlapping_files(runs) == [('all quarters.xlsx', 'q1.xlsx', 100, 100),
+                                       ('all quarters.xlsx', 'q1 revised.xlsx', 100, 100),
+                                       ('all quarters.xlsx', 'q2.xlsx', 103, 103),
+                                       ('q1.xlsx', 'q1 revised.xlsx', 100, 100)]
+
+
+def test_revision_order_skips_unknown_periods():
+    runs = [run('q1 revised.xlsx', 0, 100, 100), run('q1.xlsx', 1, 100, 100),
+            run('unknown quarter.xlsx', 2, 100, 100, period_known=False)]
+    assert revision_order(runs) == {1: 0, 0: 1}
+
+
+def test_drop_superseded_keeps_the_latest_revision():
+    original = pd.DataFrame({'OrgID': ['A', 'B', None], 'beds': [1, 2, 3]})
+    revised = pd.DataFrame({'Organisation Code': ['B', 'C'], 'beds': [20, 30]})
+    other = pd.DataFrame({'OrgID': ['A'], 'beds': [5]})
+    unknown = pd.DataFrame({'OrgID': ['A'], 'beds': [9]})
+    blocks = [(100, 0, original), (100, 1, revised), (100, 3, unknown), (103, 2, other)]
+    stats = {}
+    out = list(drop_superseded(blocks, {0: 0, 1: 1, 2: 2}, ['OrgID', 'Organisation Code'], stats))
+    # the unranked block passes through first, then the deduplicated period, then the single-file period untouched
+    assert out[0] is unknown
+    merged = out[1]
+    assert merged['beds'].tolist() == [1, 3, 20, 30]
+    assert merged['OrgID'].iloc[0] == 'A' and pd.isna(merged['OrgID'].iloc[1])  # the row without a key is kept
+    assert out[2] is other
+    assert stats == {'dropped': 1, 'periods': 1}
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from wait_distribution import band_columns, to_long, wait_metrics
+
+
+def bands(rows):
+    """Week bands 0-6, 6-18, 18-52 and 52 plus (in scrambled column order) with the given counts."""
+    columns = ['between_18_52', 'between_0_6', 'between_52_plus', 'between_6_18']
+    order = ['between_0_6', 'between_6_18', 'between_18_52', 'between_52_plus']
+    return pd.DataFrame([dict(zip(order, row)) for row in rows])[columns]
+
+
+def test_bands_are_ordered_by_their_bounds():
+    cols, lower, upper = band_columns(['org_code', 'between_10_11', 'between_9_10', 'between_52_plus', 'between_0_1'])
+    assert cols == ['between_0_1', 'between_9_10', 'between_10_11', 'between_52_plus']
+    assert lower.tolist() == [0, 9, 10, 52]
+    assert upper.tolist() == [1, 10, 11, np.inf]
+
+
+def test_metrics_of_a_hand_computed_distribution():
+    # 100 pathways: 10 in 0-6, 30 in 6-18, 40 in 18-52, 20 in 52 plus
+    out = wait_metrics(bands([[10, 30, 40, 20]])).iloc[0]
+    assert out['bands_total'] == 100
+    assert out['bands_within_18_weeks'] == 40
+    assert out['bands_percent_within_18_weeks'] == pytest.approx(0.4)
+    # the 50th pathway is the 10th of 40 in 18-52: 18 + 10/40 * 34 weeks
+    assert out['bands_median_wait_weeks'] == pytest.approx(26.5)
+    # the 92nd pathway is in the open 52 plus band: its lower bound
+    assert out['bands_p92_wait_weeks'] == 52
+
+
+def test_percentile_at_a_band_boundary():
+    # the 50th of 100 pathways is the last of the 0-6 band
+    assert wait_metrics(bands([[50, 50, 0, 0]]))['bands_median_wait_weeks'][0] == pytest.approx(6)
+
+
+def test_missing_bands_count_as_zero_and_empty_rows_are_missing():
+    out = wait_metrics(bands([[np.nan, 10, np.nan, np.nan], [np.nan] * 4, [0, 0, 0, 0]]))
+    assert out['bands_total'].tolist()[0] == 10
+    assert out['bands_median_wait_weeks'][0] == pytest.approx(12)
+    assert out[['bands_total', 'bands_median_wait_weeks']].iloc[1].isna().all()
+    assert out['bands_total'][2] == 0
+    assert np.isnan(out['bands_percent_within_18_weeks'][2])
+
+
+def test_no_bands():
+    with pytest.raises(ValueError):
+        wait_metrics(pd.DataFrame({'org_code': ['A']}))
+
+
+def test_long_format():
+    df = bands([[1, 2, 3, 4]]).assign(org_code='A')
+    long = to_long(df, id_cols=['org_code'])
+    assert long['band'].astype(str).tolist() == ['between_0_6', 'between_6_18', 'between_18_52', 'between_52_plus']
+    assert long['count'].tolist() == [1, 2, 3, 4]
+    assert long['org_code'].tolist() == ['A'] * 4